@@ -1,90 +1,287 @@
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point, box
+import numpy as np
+import shapely
+from pyproj import Transformer
 import os # Necesario para verificar carpetas
+import multiprocessing
+import instrumentacion  # Tiempos / memoria / conteos por etapa (reporte JSON por año)
 
 # ================= CONFIGURACIÓN =================
 YEAR = 2021  # <--- ¡CAMBIA ESTO POR AÑO! (2020, 2021, 2022, etc.)
 
+# Modo lote: varios años de una vez (ej: range(2020, 2025)). None = solo YEAR.
+YEARS = None
+
+# orquestador.py fija los años de cada tarea por entorno (ej: SIG_YEARS=2021)
+if os.environ.get('SIG_YEARS'):
+    YEARS = [int(y) for y in os.environ['SIG_YEARS'].split(',')]
+
+# Procesos en paralelo para el modo lote (un año por proceso)
+N_PROCESOS = os.cpu_count() or 1
+
 # Rutas dinámicas usando f-strings (f"...")
 # Nota: La 'r' es para rutas de Windows, la 'f' es para insertar variables. Se usan juntas: fr"..."
-
-input_csv = fr'D:\SIG\csv\{YEAR}\FIRMS_{YEAR}.csv'
-output_squares_shp = fr'D:\SIG\shapes\{YEAR}\Leoncio_Prado_cuadrados_FIRMS_{YEAR}.shp'
+def rutas_anio(year):
+    return {
+        'csv': fr'D:\SIG\csv\{year}\FIRMS_{year}.csv',
+        'salida': fr'D:\SIG\shapes\{year}\Leoncio_Prado_cuadrados_FIRMS_{year}.shp',
+    }
 
 # El AOI suele ser estático (el mismo para todos los años), se deja igual
 aoi_shp = r'D:\SIG\shapes\general\Leoncio_Prado.shp'
+
+# Lectura por bloques: filas del CSV en memoria a la vez (archivos FIRMS multi-año)
+TAM_CHUNK = 500_000
+
+# Lado del cuadrado (metros) según el sensor; cualquier otro sensor usa el de VIIRS
+TAMANO_SENSOR = {'MODIS': 1000, 'VIIRS': 375}
+EPSG_UTM = 'EPSG:32718'
+
+# Recorte: True = además corre gpd.overlay y compara resultado y tiempos (para benchmark)
+COMPARAR_CON_OVERLAY = False
 # =================================================
 
-print(f"--- Procesando Año: {YEAR} ---")
 
-# 0. VERIFICACIÓN DE CARPETAS (Seguridad)
-# Si la carpeta de salida (ej: D:\SIG\shapes\2022) no existe, la crea.
-carpeta_salida = os.path.dirname(output_squares_shp)
-if not os.path.exists(carpeta_salida):
+def leer_puntos_en_aoi(ruta_csv, aoi_union, tam_chunk=TAM_CHUNK):
+    """Lee el CSV de FIRMS por bloques y devuelve solo las filas dentro del AOI.
+
+    Cada bloque se filtra primero por el bounding box del AOI sobre las columnas
+    crudas de lat/lon y luego con shapely.contains_xy sobre el AOI preparado,
+    sin crear objetos Point. Solo los puntos que sobreviven quedan en memoria.
+    """
+    minx, miny, maxx, maxy = aoi_union.bounds
+    shapely.prepare(aoi_union)
+
+    partes = []
+    total_leidas = 0
+    for chunk in pd.read_csv(ruta_csv, chunksize=tam_chunk):
+        total_leidas += len(chunk)
+        lon = chunk['longitude'].to_numpy()
+        lat = chunk['latitude'].to_numpy()
+
+        # A. Prefiltro barato: bounding box del AOI
+        en_bbox = (lon >= minx) & (lon <= maxx) & (lat >= miny) & (lat <= maxy)
+        if not en_bbox.any():
+            continue
+        chunk = chunk[en_bbox]
+
+        # B. Filtro exacto: punto dentro del polígono (equivale a gdf.within(aoi_union))
+        dentro = shapely.contains_xy(aoi_union, chunk['longitude'].to_numpy(), chunk['latitude'].to_numpy())
+        if dentro.any():
+            partes.append(chunk[dentro])
+
+    if not partes:
+        return pd.DataFrame(), total_leidas
+    return pd.concat(partes, ignore_index=True), total_leidas
+
+
+def generar_cuadrados(df):
+    """Cuadrados en UTM 18S centrados en cada detección, con lado según el sensor."""
+    # Reproyectar coordenadas como arreglos (sin GeoSeries de puntos intermedia)
+    transformador = Transformer.from_crs('EPSG:4326', EPSG_UTM, always_xy=True)
+    x, y = transformador.transform(df['longitude'].to_numpy(), df['latitude'].to_numpy())
+
+    lado = df['instrument'].map(TAMANO_SENSOR).fillna(TAMANO_SENSOR['VIIRS']).to_numpy()
+    half_size = lado / 2
+
+    cuadrados = shapely.box(x - half_size, y - half_size, x + half_size, y + half_size)
+    return gpd.GeoDataFrame(df, geometry=cuadrados, crs=EPSG_UTM)
+
+
+def _solo_poligonos(geoms):
+    """Como overlay(keep_geom_type=True): de las colecciones quedan solo las partes poligonales."""
+    tipos = shapely.get_type_id(geoms)
+    for i in np.flatnonzero(tipos == shapely.GeometryType.GEOMETRYCOLLECTION):
+        partes = shapely.get_parts(geoms[i])
+        partes = partes[np.isin(shapely.get_type_id(partes),
+                                [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON])]
+        geoms[i] = shapely.union_all(partes) if len(partes) else None
+    tipos = shapely.get_type_id(geoms)
+    return np.isin(tipos, [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON]) & ~shapely.is_empty(geoms)
+
+
+def recortar_con_aoi(gdf, aoi):
+    """Equivale a gpd.overlay(gdf, aoi, how='intersection'), pero solo recorta lo necesario.
+
+    Con un STRtree sobre los cuadrados (las consultas usan el AOI preparado):
+      - 'contains'   -> cuadrados completamente dentro: se copian tal cual
+      - 'intersects' -> el resto de candidatos cruzan el borde: se intersectan
+      - sin resultado -> fuera del AOI: se descartan
+    """
+    cuadrados = gdf.geometry.values
+    poligonos_aoi = aoi.geometry.values
+    arbol = shapely.STRtree(cuadrados)
+
+    # Pares (índice AOI, índice cuadrado)
+    idx_aoi, idx_cuad = arbol.query(poligonos_aoi, predicate='intersects')
+    dentro_aoi, dentro_cuad = arbol.query(poligonos_aoi, predicate='contains')
+    n_cuad = len(cuadrados)
+    dentro = np.isin(idx_aoi * n_cuad + idx_cuad, dentro_aoi * n_cuad + dentro_cuad)
+
+    # Mismo orden que overlay: por cuadrado y luego por polígono del AOI
+    orden = np.lexsort((idx_aoi, idx_cuad))
+    idx_aoi, idx_cuad, dentro = idx_aoi[orden], idx_cuad[orden], dentro[orden]
+
+    geoms = np.asarray(cuadrados[idx_cuad]).copy()
+    borde = ~dentro
+    geoms[borde] = shapely.intersection(geoms[borde], np.asarray(poligonos_aoi[idx_aoi[borde]]))
+    validos = _solo_poligonos(geoms)
+
+    # Atributos: columnas del cuadrado + columnas del AOI (sufijos _1/_2 si se repiten, como overlay)
+    atrib_cuad = gdf.drop(columns=gdf.geometry.name).iloc[idx_cuad[validos]].reset_index(drop=True)
+    atrib_aoi = aoi.drop(columns=aoi.geometry.name).iloc[idx_aoi[validos]].reset_index(drop=True)
+    repetidas = atrib_cuad.columns.intersection(atrib_aoi.columns)
+    atrib_cuad = atrib_cuad.rename(columns={c: f'{c}_1' for c in repetidas})
+    atrib_aoi = atrib_aoi.rename(columns={c: f'{c}_2' for c in repetidas})
+
+    resultado = pd.concat([atrib_cuad, atrib_aoi], axis=1)
+    conteo = {
+        'dentro': int(dentro.sum()),
+        'borde': int(borde.sum()),
+        'fuera': n_cuad - len(np.unique(idx_cuad)),
+    }
+    return gpd.GeoDataFrame(resultado, geometry=geoms[validos], crs=gdf.crs), conteo
+
+
+def preparar_aoi(ruta_aoi):
+    """Lee el AOI una sola vez y deja listas sus dos versiones (EPSG:4326 y UTM 18S)."""
+    aoi = gpd.read_file(ruta_aoi)
+
+    # Asegurar misma proyección AOI (los puntos FIRMS vienen en EPSG:4326)
+    if aoi.crs != 'EPSG:4326':
+        aoi = aoi.to_crs('EPSG:4326')
+
+    aoi_utm = aoi.to_crs(EPSG_UTM)
+    return {'aoi_union': aoi.geometry.union_all(), 'aoi_utm': aoi_utm}
+
+
+def procesar_anio(year, aoi):
+    """Genera Leoncio_Prado_cuadrados_FIRMS_{year}.shp. Devuelve un resumen del año."""
+    rutas = rutas_anio(year)
+    resumen = {'year': year, 'puntos': 0, 'cuadrados': 0, 'estado': '❌'}
+    print(f"--- Procesando Año: {year} ---")
+
+    # 0. VERIFICACIÓN DE CARPETAS (Seguridad)
+    # Si la carpeta de salida (ej: D:\SIG\shapes\2022) no existe, la crea.
+    carpeta_salida = os.path.dirname(rutas['salida'])
+    if not os.path.exists(carpeta_salida):
+        try:
+            os.makedirs(carpeta_salida, exist_ok=True)
+            print(f"📁 Carpeta creada automáticamente: {carpeta_salida}")
+        except OSError:
+            print(f"⚠️ Error al intentar crear la carpeta: {carpeta_salida}")
+
+    # 1. CARGAR DATOS
+    if not os.path.exists(rutas['csv']):
+        print(f"❌ ERROR: No se encontró el archivo CSV del año {year}.")
+        return resumen
+
+    # 2. LEER Y FILTRAR PUNTOS DENTRO DEL AOI (por bloques)
+    print(f"[{year}] 1. Leyendo CSV por bloques y filtrando dentro del AOI: {rutas['csv']}")
+    with instrumentacion.etapa('leer_csv', year) as e:
+        df, total_leidas = leer_puntos_en_aoi(rutas['csv'], aoi['aoi_union'])
+        e.update(entrada=total_leidas, salida=len(df), unidad='puntos')
+    print(f"[{year}]    -> {total_leidas} filas leídas.")
+
+    if df.empty:
+        print(f"❌ ALERTA: No hay puntos FIRMS en el año {year} dentro del AOI.")
+        resumen['estado'] = '⚠️ sin puntos'
+        return resumen
+    print(f"[{year}]    -> {len(df)} puntos encontrados.")
+    resumen['puntos'] = len(df)
+
+    # 3. LIMPIEZA DE DATOS (solo sobre los puntos del AOI)
+    df['confidence'] = df['confidence'].replace({'h': 80, 'n': 60, 'l': 30})
+    df['confidence'] = pd.to_numeric(df['confidence'])
+
+    # 4. GENERAR CUADRADOS (UTM 18S)
+    print(f"[{year}] 2. Generando cuadrados (UTM 18S)...")
+    with instrumentacion.etapa('cuadrados', year, entrada=len(df), unidad='puntos') as e:
+        gdf_utm = generar_cuadrados(df)
+        e['salida'] = len(gdf_utm)
+    aoi_utm = aoi['aoi_utm']
+
+    # 5. RECORTAR CON AOI (solo se intersectan los cuadrados que cruzan el borde)
+    print(f"[{year}] 3. Recortando bordes...")
+    with instrumentacion.etapa('recorte_aoi', year, entrada=len(gdf_utm), unidad='poligonos') as e:
+        gdf_recortado, conteo = recortar_con_aoi(gdf_utm, aoi_utm)
+        e['salida'] = len(gdf_recortado)
+    t_recorte = e['segundos']
+    print(f"[{year}]    -> {conteo['dentro']} cuadrados completamente dentro, {conteo['borde']} en el borde, "
+          f"{conteo['fuera']} fuera ({t_recorte:.2f} s)")
+
+    if COMPARAR_CON_OVERLAY:
+        with instrumentacion.etapa('overlay', year, entrada=len(gdf_utm), unidad='poligonos') as e:
+            gdf_overlay = gpd.overlay(gdf_utm, aoi_utm, how='intersection')
+            e['salida'] = len(gdf_overlay)
+        t_overlay = e['segundos']
+        iguales = (len(gdf_overlay) == len(gdf_recortado)
+                   and list(gdf_overlay.columns) == list(gdf_recortado.columns)
+                   and bool(gdf_overlay.geometry.geom_equals(gdf_recortado.geometry).all()))
+        print(f"[{year}]    ⏱️ overlay: {t_overlay:.2f} s | recorte rápido: {t_recorte:.2f} s "
+              f"(x{t_overlay / max(t_recorte, 1e-9):.1f}) | ¿Mismo resultado?: {'✅' if iguales else '❌'}")
+
+    # 6. GUARDAR
+    print(f"[{year}] 4. Guardando: {rutas['salida']}")
+    with instrumentacion.etapa('guardar', year, salida=len(gdf_recortado), unidad='poligonos'):
+        gdf_recortado.to_file(rutas['salida'])
+    resumen.update({'cuadrados': len(gdf_recortado), 'estado': '✅'})
+
+    print(f"✅ ¡Proceso del año {year} finalizado!")
+    return resumen
+
+
+# AOI ya preparado dentro de cada proceso del pool (se recibe una vez por proceso)
+_AOI_WORKER = None
+
+
+def _inicializar_worker(aoi):
+    global _AOI_WORKER
+    # La preparación de shapely no viaja al serializar: se rehace en el proceso
+    shapely.prepare(aoi['aoi_union'])
+    shapely.prepare(aoi['aoi_utm'].geometry.values)
+    _AOI_WORKER = aoi
+
+
+def _procesar_anio_worker(year):
     try:
-        os.makedirs(carpeta_salida)
-        print(f"📁 Carpeta creada automáticamente: {carpeta_salida}")
-    except OSError:
-        print(f"⚠️ Error al intentar crear la carpeta: {carpeta_salida}")
-
-# 1. CARGAR DATOS
-print(f"1. Leyendo CSV: {input_csv}")
-try:
-    df = pd.read_csv(input_csv)
-except FileNotFoundError:
-    print(f"❌ ERROR: No se encontró el archivo CSV del año {YEAR}.")
-    exit()
-
-aoi = gpd.read_file(aoi_shp)
-
-# 2. LIMPIEZA DE DATOS
-df['confidence'] = df['confidence'].replace({'h': 80, 'n': 60, 'l': 30})
-df['confidence'] = pd.to_numeric(df['confidence'])
-
-# 3. CREAR GEODATAFRAME DE PUNTOS
-geometry = [Point(xy) for xy in zip(df['longitude'], df['latitude'])]
-gdf = gpd.GeoDataFrame(df, geometry=geometry, crs='EPSG:4326')
-
-# Asegurar misma proyección AOI
-if aoi.crs != gdf.crs:
-    aoi = aoi.to_crs(gdf.crs)
-
-# 4. FILTRAR PUNTOS DENTRO DEL AOI
-print("2. Filtrando puntos dentro del área de interés...")
-aoi_union = aoi.geometry.union_all()
-gdf_filtrado = gdf[gdf.within(aoi_union)].copy()
-
-if gdf_filtrado.empty:
-    print(f"❌ ALERTA: No hay puntos FIRMS en el año {YEAR} dentro del AOI.")
-else:
-    print(f"   -> {len(gdf_filtrado)} puntos encontrados.")
-
-    # 5. REPROYECTAR Y GENERAR CUADRADOS
-    print("3. Generando cuadrados (UTM 18S)...")
-    gdf_utm = gdf_filtrado.to_crs('EPSG:32718')
-    aoi_utm = aoi.to_crs('EPSG:32718')
-
-    def create_dynamic_square(row):
-        if row['instrument'] == 'MODIS':
-            size = 1000
-        elif row['instrument'] == 'VIIRS':
-            size = 375
-        else:
-            size = 375
-        
-        half_size = size / 2
-        point = row.geometry
-        return box(point.x - half_size, point.y - half_size, point.x + half_size, point.y + half_size)
-
-    gdf_utm['geometry'] = gdf_utm.apply(create_dynamic_square, axis=1)
-
-    # 6. RECORTAR CON AOI
-    print("4. Recortando bordes...")
-    gdf_recortado = gpd.overlay(gdf_utm, aoi_utm, how='intersection')
-
-    # 7. GUARDAR
-    print(f"5. Guardando: {output_squares_shp}")
-    gdf_recortado.to_file(output_squares_shp)
-    
-    print(f"✅ ¡Proceso del año {YEAR} finalizado!")
\ No newline at end of file
+        resumen = procesar_anio(year, _AOI_WORKER)
+    except Exception as e:
+        print(f"❌ ERROR en el año {year}: {e}")
+        resumen = {'year': year, 'puntos': 0, 'cuadrados': 0, 'estado': f'❌ {e}'}
+    # Las etapas medidas en este proceso vuelven al principal con el resumen
+    resumen['etapas'] = instrumentacion.tomar_etapas()
+    return resumen
+
+
+def procesar_firms(years, n_procesos=N_PROCESOS):
+    # El AOI se lee, une y reproyecta UNA sola vez para todos los años
+    print(f"0. Preparando AOI: {aoi_shp}")
+    with instrumentacion.etapa('preparar_aoi'):
+        aoi = preparar_aoi(aoi_shp)
+
+    n_procesos = max(1, min(n_procesos, len(years)))
+    if n_procesos == 1:
+        _inicializar_worker(aoi)
+        resumenes = [_procesar_anio_worker(y) for y in years]
+    else:
+        with multiprocessing.Pool(n_procesos, initializer=_inicializar_worker, initargs=(aoi,)) as pool:
+            resumenes = pool.map(_procesar_anio_worker, years, chunksize=1)
+    for r in resumenes:
+        instrumentacion.agregar_etapas(r.pop('etapas'))
+
+    if len(years) > 1:
+        print("\n" + "=" * 50)
+        print("RESUMEN POR AÑO")
+        print("-" * 50)
+        for r in resumenes:
+            print(f"{r['year']}: {r['puntos']:>8} puntos -> {r['cuadrados']:>8} cuadrados  {r['estado']}")
+        print("=" * 50)
+    return resumenes
+
+
+if __name__ == "__main__":
+    anios = list(YEARS) if YEARS is not None else [YEAR]
+    instrumentacion.iniciar('1_firms', anios)
+    procesar_firms(anios)
@@ -25,27 +25,54 @@ configurar_proj()
 
 import geopandas as gpd
 import rasterio
-from rasterio import features, mask
-from rasterio.warp import reproject, Resampling, calculate_default_transform
+from rasterio import features, windows
+from rasterio.warp import Resampling, calculate_default_transform
 from rasterio.transform import from_origin
+from rasterio.windows import Window
 import numpy as np
+import shapely
+import cache_alineado  # Reutiliza el agua ya alineada a esta grilla en corridas anteriores
+import piramide_mascara
+import instrumentacion  # Tiempos / memoria / conteos por etapa (reporte JSON por año)
 
 # ================= CONFIGURACIÓN =================
+YEAR = 2020  # <--- Año de la cobertura de agua y las construcciones
+
+# orquestador.py fija el año de cada tarea por entorno (ej: SIG_YEARS=2021)
+YEAR = int(os.environ.get('SIG_YEARS', YEAR))
+
 # 1. INPUTS
 ruta_area_estudio = r'D:\SIG\shapes\general\Leoncio_Prado.shp'
-ruta_raster_agua  = r'D:\SIG\raster\2020\preproceso\Cobertura_agua_2020.tif'
-ruta_shp_constr   = r'D:\SIG\shapes\2020\Construcciones_2020_FINAL_COMPLETO_b.shp'
+ruta_raster_agua  = fr'D:\SIG\raster\{YEAR}\preproceso\Cobertura_agua_{YEAR}.tif'
+ruta_shp_constr   = fr'D:\SIG\shapes\{YEAR}\Construcciones_{YEAR}_FINAL_COMPLETO_b.shp'
 
 # 2. OUTPUT
-carpeta_salida = r'D:\SIG\raster\2020\preproceso'
-nombre_salida = 'Mascara_Agua_Construcciones_2020.tif'  # Para cargar en GEE
+carpeta_salida = fr'D:\SIG\raster\{YEAR}\preproceso'
+nombre_salida = f'Mascara_Agua_Construcciones_{YEAR}.tif'  # Para cargar en GEE
 ruta_salida = os.path.join(carpeta_salida, nombre_salida)
 
 # 3. PARÁMETROS
 RESOLUCION = 10        # Tamaño de píxel (metros)
 EPSG_OBJETIVO = 32718  # UTM 18S (Para medir en metros)
+
+# 4. PROCESO POR VENTANAS (memoria acotada aunque la provincia sea grande o RESOLUCION baje)
+TAM_VENTANA = 2048     # Píxeles por lado de cada ventana procesada (múltiplo de TAM_BLOQUE)
+TAM_BLOQUE = 256       # Tiles internos del GeoTIFF de salida
+
+# 5. PIRÁMIDE DE COBERTURA (ver piramide_mascara.py)
+# Rasters hermanos con la fracción de cada celda cubierta por agua/construcción,
+# a resoluciones más gruesas (múltiplos de RESOLUCION). None = no generarlos.
+RESOLUCIONES_PIRAMIDE = (20, 30, 100)
 # =================================================
 
+def ventana_recorte(geoms, transform, height, width):
+    """Ventana de la grilla que contiene las geometrías (igual que mask.mask con crop=True)."""
+    left, bottom, right, top = shapely.total_bounds(geoms)
+    cols, rows = ~transform * (np.array([left, right, right, left]), np.array([top, top, bottom, bottom]))
+    fila0, fila1 = int(np.floor(rows.min())), int(np.ceil(rows.max()))
+    col0, col1 = int(np.floor(cols.min())), int(np.ceil(cols.max()))
+    return Window(col0, fila0, col1 - col0, fila1 - fila0).intersection(Window(0, 0, width, height))
+
 def generar_mascara_unificada():
     print("--- INICIANDO GENERACIÓN DE MÁSCARA UNIFICADA ---")
     
@@ -55,6 +82,7 @@ def generar_mascara_unificada():
 
     # 1. CARGAR Y PREPARAR EL ÁREA DE ESTUDIO (BASE DE LA GRILLA)
     print("1. Definiendo la cuadrícula base (Leoncio Prado)...")
+    instrumentacion.seccion('area_estudio', YEAR)
     gdf_area = gpd.read_file(ruta_area_estudio, encoding='latin1')
     
     if gdf_area.crs.to_epsg() != EPSG_OBJETIVO:
@@ -70,98 +98,122 @@ def generar_mascara_unificada():
     
     print(f"   -> Dimensiones: {width} x {height} píxeles")
     
-    # 2. RASTERIZAR CONSTRUCCIONES (SHAPE -> RASTER)
-    print("2. Rasterizando construcciones...")
+    # 2. CARGAR CONSTRUCCIONES (solo el vector; se rasterizan por ventana)
+    print("2. Cargando construcciones...")
+    e = instrumentacion.seccion('leer_construcciones', YEAR, unidad='poligonos')
     gdf_constr = gpd.read_file(ruta_shp_constr, encoding='latin1')
     
     if gdf_constr.crs.to_epsg() != EPSG_OBJETIVO:
         gdf_constr = gdf_constr.to_crs(epsg=EPSG_OBJETIVO)
-    
-    # Creamos array vacío de construcciones
-    # all_touched=True asegura que si el polígono toca el pixel, se pinta
-    array_constr = features.rasterize(
-        shapes=((geom, 1) for geom in gdf_constr.geometry),
-        out_shape=(height, width),
-        transform=transform_base,
-        fill=0,
-        all_touched=True,
-        dtype=rasterio.uint8
-    )
+
+    # Índice espacial: cada ventana rasteriza solo los polígonos que la tocan
+    geoms_constr = gdf_constr.geometry.values
+    arbol_constr = shapely.STRtree(geoms_constr)
+    e['salida'] = len(geoms_constr)
 
     # 3. ALINEAR RASTER DE AGUA (RASTER -> RASTER)
     print("3. Alineando raster de agua a la nueva cuadrícula...")
+    instrumentacion.seccion('alinear_agua', YEAR, salida=width * height, unidad='pixeles')
     
-    # Array vacío para el agua alineada
-    array_agua = np.zeros((height, width), dtype=rasterio.uint8)
-    
-    with rasterio.open(ruta_raster_agua) as src:
-        # Reproyectamos el agua para que calce EXACTAMENTE en la grilla base
-        # Usamos 'nearest' para mantener el valor 1 puro (sin interpolar decimales)
-        reproject(
-            source=rasterio.band(src, 1),
-            destination=array_agua,
-            src_transform=src.transform,
-            src_crs=src.crs,
-            dst_transform=transform_base,
-            dst_crs=f'EPSG:{EPSG_OBJETIVO}',
-            resampling=Resampling.nearest
-        )
-
-    # 4. COMBINAR (AGUA O CONSTRUCCIÓN)
-    print("4. Fusionando capas (Lógica: Agua OR Construcción)...")
-    # Si es agua (1) O construcción (1), el resultado es 1. Si no, 0.
-    array_final = ((array_agua == 1) | (array_constr == 1)).astype(rasterio.uint8)
-
-    # 5. RECORTAR CON EL POLÍGONO DEL ÁREA DE ESTUDIO
-    # (Para que lo de afuera del contorno sea NoData/0)
-    print("5. Recortando bordes externos...")
-    
-    # Usamos MemoryFile para hacer el recorte en memoria antes de guardar
-    from rasterio.io import MemoryFile
-    
-    meta_temp = {
+    # Reproyectamos el agua para que calce EXACTAMENTE en la grilla base
+    # Usamos 'nearest' para mantener el valor 1 puro (sin interpolar decimales)
+    # (se reproyecta por franjas a un .npy en disco y se lee por ventanas; si el
+    # archivo de agua y la grilla no cambiaron, se reutiliza de la caché)
+    ruta_agua_alineada = cache_alineado.obtener_alineado(
+        ruta_raster_agua,
+        dst_transform=transform_base,
+        dst_shape=(height, width),
+        dst_crs=f'EPSG:{EPSG_OBJETIVO}',
+        resampling=Resampling.nearest
+    )
+    array_agua = cache_alineado.cargar(ruta_agua_alineada)
+
+    # 4-5. FUSIONAR + RECORTAR CON EL ÁREA DE ESTUDIO, VENTANA POR VENTANA
+    # (Lógica: Agua OR Construcción; lo de afuera del contorno = NoData/0)
+    print(f"4. Fusionando capas y recortando por ventanas de {TAM_VENTANA} px...")
+    recorte = ventana_recorte(gdf_area.geometry.values, transform_base, height, width)
+    transform_salida = windows.transform(recorte, transform_base)
+    alto, ancho = int(recorte.height), int(recorte.width)
+    fila0, col0 = int(recorte.row_off), int(recorte.col_off)
+
+    area = shapely.union_all(gdf_area.geometry.values)
+    shapely.prepare(area)
+
+    out_meta = {
         'driver': 'GTiff',
-        'height': height,
-        'width': width,
+        'height': alto,
+        'width': ancho,
         'count': 1,
         'dtype': 'uint8',
         'crs': EPSG_OBJETIVO,
-        'transform': transform_base,
+        'transform': transform_salida,
         'nodata': 0,
-        'compress': 'lzw'
+        'compress': 'lzw',
+        'tiled': True,
+        'blockxsize': TAM_BLOQUE,
+        'blockysize': TAM_BLOQUE,
     }
 
-    with MemoryFile() as memfile:
-        with memfile.open(**meta_temp) as dataset_temp:
-            dataset_temp.write(array_final, 1)
-            
-            # Aplicamos la máscara del polígono Leoncio Prado
-            out_image, out_transform = mask.mask(
-                dataset_temp,
-                gdf_area.geometry,
-                crop=True, # Recorta al bounding box ajustado
-                nodata=0
-            )
-            
-            # Actualizamos metadata final
-            out_meta = dataset_temp.meta.copy()
-            out_meta.update({
-                "height": out_image.shape[1],
-                "width": out_image.shape[2],
-                "transform": out_transform
-            })
-
-    # 6. GUARDAR RESULTADO
-    print(f"6. Guardando en: {ruta_salida}")
+    print(f"5. Guardando en: {ruta_salida}")
+    e = instrumentacion.seccion('fusionar_recortar', YEAR, salida=alto * ancho, unidad='pixeles',
+                                poligonos_rasterizados=0)
     with rasterio.open(ruta_salida, "w", **out_meta) as dest:
-        dest.write(out_image)
+        for fila in range(0, alto, TAM_VENTANA):
+            for col in range(0, ancho, TAM_VENTANA):
+                ventana = Window(col, fila, min(TAM_VENTANA, ancho - col), min(TAM_VENTANA, alto - fila))
+                h, w = int(ventana.height), int(ventana.width)
+                t_ventana = windows.transform(ventana, transform_salida)
+                caja = shapely.box(*windows.bounds(ventana, transform_salida))
+
+                if not shapely.intersects(area, caja):
+                    dest.write(np.zeros((h, w), dtype=rasterio.uint8), 1, window=ventana)
+                    continue
+
+                # Construcciones que tocan la ventana
+                # all_touched=True asegura que si el polígono toca el pixel, se pinta
+                cercanas = arbol_constr.query(caja)
+                e['poligonos_rasterizados'] += len(cercanas)
+                if len(cercanas):
+                    bloque_constr = features.rasterize(
+                        shapes=((geom, 1) for geom in geoms_constr[np.sort(cercanas)]),
+                        out_shape=(h, w),
+                        transform=t_ventana,
+                        fill=0,
+                        all_touched=True,
+                        dtype=rasterio.uint8
+                    )
+                else:
+                    bloque_constr = np.zeros((h, w), dtype=rasterio.uint8)
+
+                bloque_agua = array_agua[fila0 + fila:fila0 + fila + h, col0 + col:col0 + col + w]
+                bloque = ((bloque_agua == 1) | (bloque_constr == 1)).astype(rasterio.uint8)
+
+                # Recorte con el polígono (mismo criterio que mask.mask: centro del píxel)
+                if not shapely.contains(area, caja):
+                    fuera = features.geometry_mask(
+                        gdf_area.geometry.values, out_shape=(h, w), transform=t_ventana)
+                    bloque[fuera] = 0
+
+                dest.write(bloque, 1, window=ventana)
+
+    # 6. PIRÁMIDE DE COBERTURA (fracción cubierta, no nearest)
+    niveles = []
+    if RESOLUCIONES_PIRAMIDE:
+        print(f"6. Generando niveles de cobertura a {', '.join(f'{r:g}m' for r in RESOLUCIONES_PIRAMIDE)}...")
+        instrumentacion.seccion('piramide', YEAR)
+        niveles = piramide_mascara.escribir_niveles(ruta_salida, RESOLUCIONES_PIRAMIDE)
+    instrumentacion.seccion(None)
 
     print("\n✅ ¡MÁSCARA CREADA CON ÉXITO!")
     print(f"   Archivo: {nombre_salida}")
     print("   Valores: 1 = Obstáculo (Agua o Casa), 0 = Terreno libre")
+    for ruta in niveles:
+        print(f"   Cobertura: {os.path.basename(ruta)} (0 a 1 = fracción de la celda cubierta)")
 
 if __name__ == "__main__":
+    instrumentacion.iniciar('2_mascara', [YEAR])
     try:
         generar_mascara_unificada()
     except Exception as e:
-        print(f"\n❌ ERROR FATAL: {e}")
\ No newline at end of file
+        print(f"\n❌ ERROR FATAL: {e}")
+        instrumentacion.marcar_error(e)
\ No newline at end of file
@@ -1,16 +1,21 @@
 import rasterio
 from rasterio import features
 from rasterio.features import shapes
+from rasterio.windows import Window
 import geopandas as gpd
 import pandas as pd
 import numpy as np
-from shapely.geometry import shape, Point
+import shapely
+from shapely.geometry import shape
 import os
-from datetime import datetime, timedelta
+import instrumentacion  # Tiempos / memoria / conteos por etapa (reporte JSON por año)
 
 # ================= CONFIGURACIÓN =================
 YEAR = 2022  # <--- ¡CAMBIA ESTO POR EL AÑO QUE QUIERAS! (2020, 2021, 2023...)
 
+# orquestador.py fija el año de cada tarea por entorno (ej: SIG_YEARS=2021)
+YEAR = int(os.environ.get('SIG_YEARS', YEAR))
+
 # Rutas dinámicas (fr'...' permite usar llaves {} dentro de rutas de Windows)
 input_raster = fr'D:\SIG\raster\{YEAR}\leoncio_prado_{YEAR}_mosaic.tif' 
 
@@ -24,8 +29,231 @@ umbral_ruido = 10
 epsg_origen = 32718         
 banda_mascara = 1
 banda_fecha = 2
+semilla = 42                # Semilla del muestreo (mismo resultado en cada corrida)
+intentos_por_punto = 50     # Candidatos máximos por punto pedido (en cada polígono)
+
+# Modo por tiles (mosaicos regionales que no caben en memoria).
+# None = una sola pasada sobre la banda completa; si no, tiles de tam_tile x tam_tile
+# píxeles leídos con un margen (halo) de halo_sieve píxeles para el sieve.
+tam_tile = None
+halo_sieve = 64             # Debe ser mayor que umbral_ruido (mismo resultado que en una pasada)
 # =================================================
 
+
+def muestrear_puntos_poisson(poligonos, cuotas, min_dist, rng, intentos_por_punto=50):
+    """Muestreo aleatorio con distancia mínima (Poisson-disk) sobre varios polígonos.
+
+    - Candidatos en lotes vectorizados, filtrados con shapely.contains_xy sobre
+      polígonos preparados.
+    - Grilla hash de celdas de lado min_dist/√2 (a lo más un punto por celda):
+      revisar vecinos cuesta O(1), no O(n) contra todos los puntos aceptados.
+    - La grilla es COMPARTIDA por todos los polígonos: la distancia mínima se
+      respeta también entre puntos de polígonos distintos.
+
+    Devuelve (x, y, faltantes) donde faltantes[i] = puntos que no se lograron en el polígono i.
+    """
+    celda = min_dist / np.sqrt(2)
+    min_dist2 = min_dist * min_dist
+    grilla = {}            # (columna, fila) -> (x, y)
+    xs, ys = [], []
+    faltantes = np.zeros(len(poligonos), dtype=int)
+
+    for i, (poly, n_needed) in enumerate(zip(poligonos, cuotas)):
+        if n_needed <= 0:
+            continue
+        shapely.prepare(poly)
+        minx, miny, maxx, maxy = poly.bounds
+        # Proporción del bounding box que cae dentro del polígono (para dimensionar lotes)
+        llenado = max(poly.area / max((maxx - minx) * (maxy - miny), 1e-12), 0.01)
+
+        aceptados = 0
+        intentos = 0
+        max_intentos = n_needed * intentos_por_punto
+        while aceptados < n_needed and intentos < max_intentos:
+            lote = int(min(max_intentos - intentos, max(64, 2 * (n_needed - aceptados) / llenado)))
+            intentos += lote
+            cx = rng.uniform(minx, maxx, lote)
+            cy = rng.uniform(miny, maxy, lote)
+            dentro = shapely.contains_xy(poly, cx, cy)
+
+            for x, y in zip(cx[dentro].tolist(), cy[dentro].tolist()):
+                gx, gy = int(x // celda), int(y // celda)
+                # Un punto a menos de min_dist solo puede estar a 2 celdas o menos
+                muy_cerca = False
+                for vx in range(gx - 2, gx + 3):
+                    for vy in range(gy - 2, gy + 3):
+                        vecino = grilla.get((vx, vy))
+                        if vecino is not None and (vecino[0] - x) ** 2 + (vecino[1] - y) ** 2 < min_dist2:
+                            muy_cerca = True; break
+                    if muy_cerca: break
+                if muy_cerca:
+                    continue
+
+                grilla[(gx, gy)] = (x, y)
+                xs.append(x); ys.append(y)
+                aceptados += 1
+                if aceptados == n_needed:
+                    break
+
+        faltantes[i] = n_needed - aceptados
+
+    return np.array(xs), np.array(ys), faltantes
+
+
+def muestrear_banda(banda, transform, xs, ys, fuera=0):
+    """Valor del píxel que contiene cada punto (igual que src.sample), indexando el arreglo en memoria."""
+    cols, filas = ~transform * (np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+    filas = np.floor(filas).astype(np.int64)
+    cols = np.floor(cols).astype(np.int64)
+    dentro = (filas >= 0) & (filas < banda.shape[0]) & (cols >= 0) & (cols < banda.shape[1])
+
+    valores = np.full(len(filas), fuera, dtype=banda.dtype)
+    valores[dentro] = banda[filas[dentro], cols[dentro]]
+    return valores
+
+
+def dias_a_fecha(dias, minimo=1000):
+    """Días desde 1970-01-01 -> datetime64 en una sola conversión. NaT si es nulo o < minimo (sin fecha)."""
+    dias = np.asarray(dias, dtype=float)
+    validos = np.isfinite(dias) & (dias >= minimo)
+    fechas = np.full(dias.shape, np.datetime64('NaT'), dtype='datetime64[D]')
+    fechas[validos] = np.datetime64('1970-01-01') + np.trunc(dias[validos]).astype('timedelta64[D]')
+    return fechas
+
+
+def _ordenar_poligonos(geoms, dns):
+    """Orden canónico: por el primer píxel de cada polígono (fila superior, luego columna).
+
+    El orden en que GDAL entrega los polígonos depende de su versión y, en el modo
+    por tiles, de los cortes; el muestreo aleatorio depende de ese orden, así que se
+    fija aquí para que ambos modos den exactamente los mismos puntos.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    dns = np.asarray(dns)
+    coords, idx = shapely.get_coordinates(geoms, return_index=True)
+    techo = shapely.bounds(geoms)[:, 3]
+    en_techo = coords[:, 1] == techo[idx]
+    x_techo = np.full(len(geoms), np.inf)
+    np.minimum.at(x_techo, idx[en_techo], coords[en_techo, 0])
+    orden = np.lexsort((x_techo, -techo))
+    return geoms[orden], dns[orden]
+
+
+def poligonizar(src):
+    """Sieve + poligonización de la banda completa (una sola pasada)."""
+    band_mask = src.read(banda_mascara)
+    with instrumentacion.etapa('sieve', YEAR, entrada=band_mask.size, unidad='pixeles'):
+        sieved_band = features.sieve(band_mask, size=umbral_ruido, connectivity=8)
+
+    geoms, dns = [], []
+    with instrumentacion.etapa('poligonizar', YEAR, entrada=int(np.count_nonzero(sieved_band)),
+                               unidad='pixeles') as e:
+        for s, v in shapes(sieved_band, mask=(sieved_band > 0), transform=src.transform):
+            geoms.append(shape(s)); dns.append(v)
+        e['salida'] = len(geoms)
+    return geoms, dns
+
+
+def poligonizar_por_tiles(src, tam, halo):
+    """Sieve + poligonización por ventanas, con el mismo resultado que poligonizar().
+
+    - Cada tile se lee con `halo` píxeles extra por lado: un grupo menor que
+      umbral_ruido cabe entero en el halo, y uno mayor nunca se ve recortado por
+      debajo del umbral, así el sieve del núcleo coincide con el de la imagen completa.
+    - Se poligoniza solo el núcleo. Los polígonos que no tocan un corte entre tiles
+      quedan listos al momento; los que lo tocan se guardan aparte y al final se unen
+      con sus vecinos del mismo valor que comparten un borde (conectividad 4, igual
+      que shapes).
+    """
+    if halo <= umbral_ruido:
+        raise ValueError(f"halo_sieve ({halo}) debe ser mayor que umbral_ruido ({umbral_ruido}).")
+
+    alto, ancho = src.height, src.width
+    geoms, dns = [], []
+    pendientes, dns_pendientes = [], []
+
+    for fila in range(0, alto, tam):
+        for col in range(0, ancho, tam):
+            h, w = min(tam, alto - fila), min(tam, ancho - col)
+            f0, c0 = max(fila - halo, 0), max(col - halo, 0)
+            f1, c1 = min(fila + h + halo, alto), min(col + w + halo, ancho)
+
+            bloque = src.read(banda_mascara, window=Window(c0, f0, c1 - c0, f1 - f0))
+            with instrumentacion.etapa('sieve', YEAR, entrada=bloque.size, unidad='pixeles'):
+                sieved = features.sieve(bloque, size=umbral_ruido, connectivity=8)
+            nucleo = sieved[fila - f0:fila - f0 + h, col - c0:col - c0 + w]
+
+            ventana = Window(col, fila, w, h)
+            x0, y1, x1, y0 = src.window_bounds(ventana)  # (izq, abajo, der, arriba)
+            with instrumentacion.etapa('poligonizar', YEAR, entrada=int(np.count_nonzero(nucleo)),
+                                       unidad='pixeles') as e:
+                antes = len(geoms) + len(pendientes)
+                for s, v in shapes(nucleo, mask=(nucleo > 0), transform=src.window_transform(ventana)):
+                    poly = shape(s)
+                    minx, miny, maxx, maxy = poly.bounds
+                    toca_corte = ((col > 0 and minx <= x0) or (col + w < ancho and maxx >= x1) or
+                                  (fila > 0 and maxy >= y0) or (fila + h < alto and miny <= y1))
+                    if toca_corte:
+                        pendientes.append(poly); dns_pendientes.append(v)
+                    else:
+                        geoms.append(poly); dns.append(v)
+                e['salida'] = len(geoms) + len(pendientes) - antes
+
+    # Coser los polígonos cortados: mismo valor + borde compartido de largo > 0
+    # (si solo se tocan en una esquina son polígonos distintos)
+    if pendientes:
+        with instrumentacion.etapa('coser_tiles', YEAR, entrada=len(pendientes), unidad='poligonos') as e:
+            pendientes = np.asarray(pendientes, dtype=object)
+            dns_pendientes = np.asarray(dns_pendientes)
+            padre = np.arange(len(pendientes))
+
+            def raiz(i):
+                while padre[i] != i:
+                    padre[i] = padre[padre[i]]
+                    i = padre[i]
+                return i
+
+            arbol = shapely.STRtree(pendientes)
+            a, b = arbol.query(pendientes, predicate='intersects')
+            par = (a < b) & (dns_pendientes[a] == dns_pendientes[b])
+            a, b = a[par], b[par]
+            comparten = shapely.length(shapely.intersection(pendientes[a], pendientes[b])) > 0
+            for i, j in zip(a[comparten], b[comparten]):
+                ri, rj = raiz(i), raiz(j)
+                if ri != rj:
+                    padre[max(ri, rj)] = min(ri, rj)
+
+            grupos = {}
+            for i in range(len(pendientes)):
+                grupos.setdefault(raiz(i), []).append(i)
+            for miembros in grupos.values():
+                # simplify(0) quita los vértices colineales que deja la unión sobre el corte
+                geoms.append(pendientes[miembros[0]] if len(miembros) == 1
+                             else shapely.simplify(shapely.union_all(pendientes[miembros]), 0))
+                dns.append(dns_pendientes[miembros[0]])
+            e['salida'] = len(grupos)
+
+    return geoms, dns
+
+
+def leer_fechas_por_tiles(src, xs, ys, tam):
+    """Muestrea la banda de fechas leyendo solo los tiles que contienen puntos."""
+    cols, filas = ~src.transform * (np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+    filas = np.floor(filas).astype(np.int64)
+    cols = np.floor(cols).astype(np.int64)
+    dentro = (filas >= 0) & (filas < src.height) & (cols >= 0) & (cols < src.width)
+
+    valores = np.zeros(len(filas), dtype=src.dtypes[banda_fecha - 1])
+    tile = (filas // tam) * (-(-src.width // tam)) + cols // tam
+    for t in np.unique(tile[dentro]):
+        sel = dentro & (tile == t)
+        fila, col = int(filas[sel][0] // tam * tam), int(cols[sel][0] // tam * tam)
+        ventana = Window(col, fila, min(tam, src.width - col), min(tam, src.height - fila))
+        bloque = src.read(banda_fecha, window=ventana)
+        valores[sel] = muestrear_banda(bloque, src.window_transform(ventana), np.asarray(xs)[sel], np.asarray(ys)[sel])
+    return valores
+
+
 def procesar_incendios():
     print(f"--- Procesando Año {YEAR} con Tipos de Datos Correctos ---")
     
@@ -43,74 +271,69 @@ def procesar_incendios():
         print(f"❌ ERROR: No se encuentra el archivo de entrada: {input_raster}")
         return
 
-    # 1. LEER MÁSCARA
-    print(f"1. Leyendo raster...")
+    # 1-2. LEER MÁSCARA Y POLIGONIZAR
+    instrumentacion.seccion('leer_y_poligonizar', YEAR)
     with rasterio.open(input_raster) as src:
-        band_mask = src.read(banda_mascara)
-        transform = src.transform
-        sieved_band = features.sieve(band_mask, size=umbral_ruido, connectivity=8)
+        if tam_tile is None:
+            print(f"1. Leyendo raster...")
+            # La banda de fechas se lee aquí mismo (una sola apertura del mosaico)
+            band_fecha = src.read(banda_fecha)
+            print("2. Poligonizando áreas de quema...")
+            geoms, dns = poligonizar(src)
+        else:
+            print(f"1-2. Leyendo y poligonizando por tiles de {tam_tile} px (halo {halo_sieve} px)...")
+            geoms, dns = poligonizar_por_tiles(src, tam_tile, halo_sieve)
 
-    # 2. POLIGONIZAR
-    print("2. Poligonizando áreas de quema...")
-    results = (
-        {'properties': {'DN': v}, 'geometry': s}
-        for i, (s, v) in enumerate(
-            shapes(sieved_band, mask=(sieved_band > 0), transform=transform))
-    )
-    geoms = list(results)
-    if not geoms: 
-        print("⚠️ No se encontraron polígonos de quema.")
-        return
+        if not geoms: 
+            print("⚠️ No se encontraron polígonos de quema.")
+            return
 
-    gdf = gpd.GeoDataFrame.from_features(geoms, crs=f"EPSG:{epsg_origen}")
-    gdf['geometry'] = gdf.geometry.buffer(0)
-    gdf['area'] = gdf.area
+        geoms, dns = _ordenar_poligonos(geoms, dns)
+        gdf = gpd.GeoDataFrame({'DN': dns}, geometry=list(geoms), crs=f"EPSG:{epsg_origen}")
+        # normalize: mismo vértice inicial y sentido de anillos en ambos modos
+        gdf['geometry'] = shapely.normalize(gdf.geometry.buffer(0).values)
+        gdf['area'] = gdf.area
 
-    # 3. GENERAR PUNTOS
-    print("3. Generando puntos aleatorios...")
-    total_area = gdf['area'].sum()
-    gdf['num_puntos'] = (gdf['area'] / total_area * num_puntos_objetivo).round().astype(int)
+        # 3. GENERAR PUNTOS
+        print("3. Generando puntos aleatorios...")
+        e = instrumentacion.seccion('muestreo_puntos', YEAR, entrada=len(gdf), unidad='poligonos')
+        total_area = gdf['area'].sum()
+        gdf['num_puntos'] = (gdf['area'] / total_area * num_puntos_objetivo).round().astype(int)
     
-    diff = num_puntos_objetivo - gdf['num_puntos'].sum()
-    if diff != 0 and len(gdf) > 0:
-        gdf.loc[gdf['area'].idxmax(), 'num_puntos'] += diff
+        diff = num_puntos_objetivo - gdf['num_puntos'].sum()
+        if diff != 0 and len(gdf) > 0:
+            gdf.loc[gdf['area'].idxmax(), 'num_puntos'] += diff
 
-    def get_points_with_min_dist(poly, n_needed, min_dist):
-        points = []
-        minx, miny, maxx, maxy = poly.bounds
-        max_intentos = n_needed * 50 
-        intentos = 0
-        while len(points) < n_needed and intentos < max_intentos:
-            intentos += 1
-            pnt = Point(np.random.uniform(minx, maxx), np.random.uniform(miny, maxy))
-            if not poly.contains(pnt): continue
-            
-            muy_cerca = False
-            for existing_p in points:
-                if pnt.distance(existing_p) < min_dist:
-                    muy_cerca = True; break
-            if not muy_cerca: points.append(pnt)
-        return points
-
-    lista_puntos_geom = []
-    subset = gdf[gdf['num_puntos'] > 0]
-    for idx, row in subset.iterrows():
-        pts = get_points_with_min_dist(row.geometry, row['num_puntos'], distancia_minima)
-        lista_puntos_geom.extend(pts)
-
-    if not lista_puntos_geom:
-        print("⚠️ No se generaron puntos.")
-        return
+        subset = gdf[gdf['num_puntos'] > 0]
+        rng = np.random.default_rng(semilla)
+        xs, ys, faltantes = muestrear_puntos_poisson(
+            subset.geometry.values, subset['num_puntos'].to_numpy(), distancia_minima, rng, intentos_por_punto)
+        lista_puntos_geom = list(shapely.points(xs, ys))
+        e['salida'] = len(lista_puntos_geom)
 
-    # 4. MUESTREO
-    print("4. Extrayendo fechas del raster...")
-    coords = [(p.x, p.y) for p in lista_puntos_geom]
-    valores_muestreados = []
-    with rasterio.open(input_raster) as src:
-        for val in src.sample(coords, indexes=banda_fecha):
-            valores_muestreados.append(val[0])
+        # Reporte de cuota: cuántos puntos no entraron respetando la distancia mínima
+        total_faltantes = int(faltantes.sum())
+        if total_faltantes > 0:
+            print(f"   ⚠️ Faltaron {total_faltantes} de {num_puntos_objetivo} puntos "
+                  f"({100 * total_faltantes / num_puntos_objetivo:.1f}%) en {int((faltantes > 0).sum())} polígonos "
+                  f"(no caben más con {distancia_minima} m de separación).")
+        else:
+            print(f"   -> {len(lista_puntos_geom)} puntos generados (cuota completa).")
+
+        if not lista_puntos_geom:
+            print("⚠️ No se generaron puntos.")
+            return
+
+        # 4. MUESTREO
+        print("4. Extrayendo fechas del raster...")
+        instrumentacion.seccion('muestreo_fechas', YEAR, entrada=len(xs), unidad='puntos')
+        if tam_tile is None:
+            valores_muestreados = muestrear_banda(band_fecha, src.transform, xs, ys)
+        else:
+            valores_muestreados = leer_fechas_por_tiles(src, xs, ys, tam_tile)
 
     # 5. CONSTRUIR RESULTADO
+    instrumentacion.seccion('construir_y_guardar', YEAR, entrada=len(xs), unidad='puntos')
     gdf_final = gpd.GeoDataFrame(
         {'dias_julianos': valores_muestreados}, 
         geometry=lista_puntos_geom, 
@@ -118,15 +341,8 @@ def procesar_incendios():
     )
 
     # --- A) FECHA (Tipo DATE) ---
-    base_date = datetime(1970, 1, 1)
-    def calcular_fecha(dias):
-        try:
-            dias_int = int(dias)
-            if dias_int < 1000: return None 
-            return base_date + timedelta(days=dias_int)
-        except: return None
-
-    gdf_final['fecha'] = gdf_final['dias_julianos'].apply(calcular_fecha)
+    # Días desde 1970-01-01 (menos de 1000 = sin fecha válida)
+    gdf_final['fecha'] = dias_a_fecha(gdf_final['dias_julianos'].to_numpy())
     gdf_final = gdf_final.dropna(subset=['fecha'])
     
     # Convertir explícitamente a formato datetime
@@ -155,6 +371,8 @@ def procesar_incendios():
         print(f"❌ Error al guardar shapefile: {e}")
         return
 
+    instrumentacion.seccion(None)
+
     if len(gdf_export) > 0:
         print("\n--- ¡ÉXITO! ---")
         print(f"Año: {YEAR}")
@@ -166,4 +384,5 @@ def procesar_incendios():
         print("Advertencia: El archivo final está vacío.")
 
 if __name__ == "__main__":
+    instrumentacion.iniciar('3_quema', [YEAR])
     procesar_incendios()
\ No newline at end of file
@@ -1,92 +1,187 @@
+import numpy as np
 import pandas as pd
 import os
-from sklearn.utils import shuffle
+import almacen_caracteristicas  # CSV de GEE -> Parquet (se parsea una sola vez)
+import instrumentacion  # Tiempos / memoria / conteos por etapa (reporte JSON por año)
 
 # ==========================================
 # 1. CONFIGURACIÓN
 # ==========================================
 YEAR = 2022  # <--- ¡CAMBIA ESTO POR EL AÑO QUE QUIERAS! (2020, 2021, etc.)
 
+# Varios años de una vez (ej: range(2020, 2025)). None = solo YEAR.
+YEARS = None
+
+# orquestador.py fija los años de cada tarea por entorno (ej: SIG_YEARS=2021)
+if os.environ.get('SIG_YEARS'):
+    YEARS = [int(y) for y in os.environ['SIG_YEARS'].split(',')]
+
+# Dónde se igualan las clases:
+#   'global' -> todas las filas de YEARS juntas (con un solo año, igual que antes)
+#   'anio'   -> cada año por separado (cada CSV de salida queda balanceado)
+#   'bloque' -> por celda de TAM_BLOQUE_GRADOS x TAM_BLOQUE_GRADOS (lat/lon), para
+#               que las zonas con muchos incendios no dominen la clase 0
+MODO_BALANCEO = 'global'
+TAM_BLOQUE_GRADOS = 0.5
+
+SEMILLA = 42        # Mismo resultado en cada corrida
+TAM_LOTE = 262_144  # Filas leídas del almacén a la vez (memoria acotada)
+
 # Rutas dinámicas (fr'...' permite usar llaves {} dentro de rutas de Windows)
-archivo_entrada = fr'D:\SIG\csv\{YEAR}\Dataset_Completo_{YEAR}.csv' 
-archivo_salida  = fr'D:\SIG\csv\{YEAR}\Dataset_{YEAR}_BALANCEADO_FINAL.csv'
+def archivo_entrada(year):
+    return fr'D:\SIG\csv\{year}\Dataset_Completo_{year}.csv'
+
+def archivo_salida(year):
+    return fr'D:\SIG\csv\{year}\Dataset_{year}_BALANCEADO_FINAL.csv'
+
+
+def grupos_de(lote, modo=MODO_BALANCEO, tam_bloque=TAM_BLOQUE_GRADOS):
+    """Grupo de balanceo (entero) de cada fila del lote."""
+    if modo == 'global':
+        return np.zeros(len(lote), dtype=np.int64)
+    if modo == 'anio':
+        return lote['year'].to_numpy(dtype=np.int64)
+    if modo == 'bloque':
+        return almacen_caracteristicas.bloque_espacial(lote['lat'], lote['lon'], tam_bloque)
+    raise ValueError(f"MODO_BALANCEO desconocido: {modo!r} (use 'global', 'anio' o 'bloque')")
+
+
+def _celdas(lote, modo):
+    # Una celda por (grupo, clase)
+    return grupos_de(lote, modo) * 2 + lote['class'].to_numpy(dtype=np.int64)
+
+
+def contar_validos(years, modo=MODO_BALANCEO, tam_lote=TAM_LOTE):
+    """Primera pasada: filas sin vacíos por (grupo, clase). Devuelve (conteos, total, nulos)."""
+    conteos = pd.Series(dtype=np.int64)
+    total = 0
+    for lote in almacen_caracteristicas.iterar_lotes('completo', years, tam_lote=tam_lote):
+        total += len(lote)
+        lote = lote[lote.notna().all(axis=1)]
+        conteos = conteos.add(pd.Series(_celdas(lote, modo)).value_counts(), fill_value=0)
+    conteos = conteos.astype(np.int64)
+    return conteos, total, total - int(conteos.sum())
+
+
+def balancear_por_lotes(years, cupos, modo=MODO_BALANCEO, semilla=SEMILLA, tam_lote=TAM_LOTE):
+    """Segunda pasada: muestreo de reservorio por (grupo, clase) con cupos conocidos.
+
+    Cada fila válida recibe una clave aleatoria fija (hash de año + fila + semilla)
+    y de cada celda se quedan las `cupos[celda]` filas de menor clave: es un
+    muestreo sin reemplazo uniforme, que no depende del tamaño de los lotes.
+    En memoria solo está el reservorio (tamaño de la salida) + un lote.
+    Devuelve el DataFrame ordenado por clave (ya mezclado).
+    """
+    reservorio = None
+    for lote in almacen_caracteristicas.iterar_lotes('completo', years, tam_lote=tam_lote):
+        lote = lote[lote.notna().all(axis=1)]
+        celdas = _celdas(lote, modo)
+        cupo = pd.Series(celdas).map(cupos).fillna(0).to_numpy()
+        lote = lote[cupo > 0].assign(
+            _celda=celdas[cupo > 0],
+            _clave=almacen_caracteristicas.clave_aleatoria(
+                lote['year'].to_numpy()[cupo > 0], lote['fila'].to_numpy()[cupo > 0], semilla),
+        )
+        if reservorio is not None:
+            lote = pd.concat([reservorio, lote], ignore_index=True)
+        lote = lote.sort_values('_clave', kind='stable', ignore_index=True)
+        rango = lote.groupby('_celda').cumcount().to_numpy()
+        reservorio = lote[rango < lote['_celda'].map(cupos).to_numpy()]
+
+    return reservorio.drop(columns=['_celda', '_clave', 'fila']).reset_index(drop=True)
+
 
 # ==========================================
 # 2. PROCESAMIENTO
 # ==========================================
-
-print(f"🚀 INICIANDO PROCESAMIENTO INTEGRAL AÑO {YEAR} (LIMPIEZA + BALANCEO)...\n")
-
-try:
-    # ---------------------------------------------------------
-    # FASE 1: CARGA Y LIMPIEZA BÁSICA
-    # ---------------------------------------------------------
-    if not os.path.exists(archivo_entrada):
-        raise FileNotFoundError(f"No se encuentra el archivo de entrada: {archivo_entrada}")
-    
-    df = pd.read_csv(archivo_entrada)
-    total_inicio = len(df)
-    print(f"1️⃣  Archivo cargado ({YEAR}). Filas totales: {total_inicio}")
-
-    # A. Eliminar Vacíos (Buena práctica general)
-    df_limpio = df.dropna()
-    eliminados_nulos = total_inicio - len(df_limpio)
-    
-    if eliminados_nulos > 0:
-        print(f"    ⚠️ Se eliminaron {eliminados_nulos} filas con datos vacíos (huecos por nubes/bordes).")
-    
-    print(f"    ✅ Fase de Limpieza completada. Filas útiles: {len(df_limpio)}")
-
-    # ---------------------------------------------------------
-    # FASE 2: BALANCEO DE CLASES (UNDERSAMPLING)
-    # ---------------------------------------------------------
-    print("\n2️⃣  Iniciando Balanceo de Clases...")
-    
-    if 'class' not in df_limpio.columns:
-        raise ValueError("El archivo no tiene la columna 'class'.")
-
-    conteo = df_limpio['class'].value_counts()
-    print(f"    Conteo previo:\n{conteo.to_string()}")
-
-    # Separar por clases
-    df_incendios = df_limpio[df_limpio['class'] == 1]
-    df_no_incendios = df_limpio[df_limpio['class'] == 0]
-
-    # Calcular el mínimo para igualar cantidades
-    n_muestras = min(len(df_incendios), len(df_no_incendios))
-    
-    print(f"    ✂️ Recortando ambas clases a {n_muestras} muestras exactas.")
-
-    # Muestreo aleatorio (semilla 42 para que sea repetible)
-    df_inc_bal = df_incendios.sample(n=n_muestras, random_state=42)
-    df_no_inc_bal = df_no_incendios.sample(n=n_muestras, random_state=42)
-
-    # Unir y Mezclar (Shuffle) para que no estén ordenados
-    df_final = pd.concat([df_inc_bal, df_no_inc_bal])
-    df_final = shuffle(df_final, random_state=42)
-
-    # ---------------------------------------------------------
-    # FASE 3: GUARDAR RESULTADO
-    # ---------------------------------------------------------
-    # Verificar que la carpeta de salida exista (por seguridad)
-    carpeta_salida = os.path.dirname(archivo_salida)
-    if not os.path.exists(carpeta_salida):
-        try:
-            os.makedirs(carpeta_salida)
-            print(f"    📁 Carpeta creada: {carpeta_salida}")
-        except:
-            pass
-
-    df_final.to_csv(archivo_salida, index=False)
-
-    print("\n" + "="*50)
-    print(f"🎉 PROCESO {YEAR} FINALIZADO CON ÉXITO")
-    print("="*50)
-    print(f"📂 Archivo de Salida: {archivo_salida}")
-    print(f"📊 Total de filas:    {len(df_final)}")
-    print(f"⚖️  Balance final:")
-    print(df_final['class'].value_counts().to_string())
-    print("="*50)
-
-except Exception as e:
-    print(f"\n❌ ERROR CRÍTICO: {e}")
\ No newline at end of file
+if __name__ == "__main__":
+    anios = list(YEARS) if YEARS is not None else [YEAR]
+    etiqueta = ', '.join(str(y) for y in anios)
+    instrumentacion.iniciar('4_balanceo', anios)
+    print(f"🚀 INICIANDO PROCESAMIENTO INTEGRAL AÑO {etiqueta} (LIMPIEZA + BALANCEO)...\n")
+
+    try:
+        # ---------------------------------------------------------
+        # FASE 1: INGESTA Y CONTEO (SIN CARGAR LA TABLA COMPLETA)
+        # ---------------------------------------------------------
+        instrumentacion.seccion('ingesta')
+        for year in anios:
+            if os.path.exists(archivo_entrada(year)):
+                if almacen_caracteristicas.ingestar_csv(archivo_entrada(year), 'completo', year):
+                    print(f"📦 CSV ingestado al almacén: {almacen_caracteristicas.ruta_dataset('completo')}")
+            elif not almacen_caracteristicas.disponible('completo', year):
+                raise FileNotFoundError(f"No se encuentra el archivo de entrada: {archivo_entrada(year)}")
+
+        e = instrumentacion.seccion('contar', unidad='filas')
+        conteos, total_inicio, eliminados_nulos = contar_validos(anios, MODO_BALANCEO)
+        e.update(entrada=total_inicio, salida=total_inicio - eliminados_nulos)
+        print(f"1️⃣  Almacén recorrido ({etiqueta}). Filas totales: {total_inicio}")
+
+        # A. Eliminar Vacíos (Buena práctica general), en el mismo recorrido
+        if eliminados_nulos > 0:
+            print(f"    ⚠️ Se descartan {eliminados_nulos} filas con datos vacíos (huecos por nubes/bordes).")
+
+        print(f"    ✅ Fase de Limpieza completada. Filas útiles: {total_inicio - eliminados_nulos}")
+
+        # ---------------------------------------------------------
+        # FASE 2: BALANCEO DE CLASES (UNDERSAMPLING POR RESERVORIO)
+        # ---------------------------------------------------------
+        print(f"\n2️⃣  Iniciando Balanceo de Clases (modo '{MODO_BALANCEO}')...")
+
+        por_clase = conteos.groupby(conteos.index % 2).sum().rename_axis('class')
+        print(f"    Conteo previo:\n{por_clase.to_string()}")
+
+        # Calcular, en cada grupo, el mínimo para igualar cantidades
+        grupos = conteos.groupby([conteos.index // 2, conteos.index % 2]).sum().unstack(fill_value=0)
+        n_muestras = grupos.reindex(columns=[0, 1], fill_value=0).min(axis=1)
+        cupos = {celda: int(n_muestras[celda // 2]) for celda in conteos.index}
+
+        if MODO_BALANCEO == 'global':
+            print(f"    ✂️ Recortando ambas clases a {int(n_muestras.sum())} muestras exactas.")
+        else:
+            print(f"    ✂️ {len(grupos)} grupos; {int((n_muestras == 0).sum())} sin alguna de las clases "
+                  f"(se descartan). {int(n_muestras.sum())} muestras por clase en total.")
+
+        if n_muestras.sum() == 0:
+            raise ValueError("No hay filas de ambas clases para balancear.")
+
+        # Muestreo aleatorio (semilla fija para que sea repetible); el orden por clave ya las mezcla
+        e = instrumentacion.seccion('balancear', entrada=total_inicio - eliminados_nulos, unidad='filas')
+        df_final = balancear_por_lotes(anios, cupos, MODO_BALANCEO, SEMILLA)
+        e['salida'] = len(df_final)
+
+        # ---------------------------------------------------------
+        # FASE 3: GUARDAR RESULTADO (UN ARCHIVO POR AÑO)
+        # ---------------------------------------------------------
+        for year in anios:
+            df_anio = df_final[df_final['year'] == year].reset_index(drop=True)
+            instrumentacion.seccion('guardar', year, salida=len(df_anio), unidad='filas')
+
+            # Verificar que la carpeta de salida exista (por seguridad)
+            carpeta_salida = os.path.dirname(archivo_salida(year))
+            if not os.path.exists(carpeta_salida):
+                try:
+                    os.makedirs(carpeta_salida)
+                    print(f"    📁 Carpeta creada: {carpeta_salida}")
+                except:
+                    pass
+
+            df_anio.to_csv(archivo_salida(year), index=False)
+            # 5, 6 y 7 leen el balanceado desde el almacén (mismo orden de filas que el CSV);
+            # con la firma del CSV recién escrito, ingestar_csv no lo vuelve a parsear
+            almacen_caracteristicas.escribir(df_anio, 'balanceado', year,
+                                             origen=almacen_caracteristicas.firma(archivo_salida(year)))
+            instrumentacion.seccion(None)
+
+            print("\n" + "="*50)
+            print(f"🎉 PROCESO {year} FINALIZADO CON ÉXITO")
+            print("="*50)
+            print(f"📂 Archivo de Salida: {archivo_salida(year)}")
+            print(f"📊 Total de filas:    {len(df_anio)}")
+            print(f"⚖️  Balance final:")
+            print(df_anio['class'].value_counts().to_string())
+            print("="*50)
+
+    except Exception as e:
+        print(f"\n❌ ERROR CRÍTICO: {e}")
+        instrumentacion.marcar_error(e)
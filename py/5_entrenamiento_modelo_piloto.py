@@ -1,49 +1,83 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import roc_auc_score
 import os
+import ajuste_hiperparametros  # Validación espacial / hiperparámetros (ver ajuste_hiperparametros.py)
+import importancia_variables  # SHAP / permutación y gráficos sin ventanas
+import almacen_caracteristicas  # Dataset balanceado en Parquet (ver almacen_caracteristicas.py)
+import instrumentacion  # Tiempos / memoria / conteos por etapa (reporte JSON por año)
+from almacen_caracteristicas import VARIABLES
 
 # ==========================================
 # 1. CONFIGURACIÓN
 # ==========================================
 YEAR = 2022  # <--- ¡CAMBIA ESTO POR EL AÑO QUE QUIERAS! (2020, 2021, etc.)
 
+# orquestador.py fija el año de cada tarea por entorno (ej: SIG_YEARS=2021)
+YEAR = int(os.environ.get('SIG_YEARS', YEAR))
+
 # Ruta dinámica del archivo
 archivo = fr'D:\SIG\csv\{YEAR}\Dataset_{YEAR}_BALANCEADO_FINAL.csv'
 
+# Validación: True = división por bloques espaciales (puntos vecinos no quedan a
+# ambos lados); False = train_test_split aleatorio (AUC optimista).
+VALIDACION_ESPACIAL = True
+
+# Si ajuste_hiperparametros.py guardó hiperparámetros para este año, usarlos
+USAR_HIPERPARAMETROS_AJUSTADOS = True
+
+# Importancia sobre el conjunto de prueba (ver importancia_variables.py).
+# Tablas y gráficos se guardan en carpeta_resultados, sin abrir ventanas.
+IMPORTANCIA_PERMUTACION = True  # Caída del AUC al desordenar cada variable
+carpeta_resultados = fr'D:\SIG\resultados\{YEAR}'
+
 # ==========================================
 # 2. CARGAR Y ENTRENAR
 # ==========================================
 print(f"--- Procesando Año: {YEAR} ---")
+instrumentacion.iniciar('5_piloto_rf', [YEAR])
 
-if not os.path.exists(archivo):
+if not almacen_caracteristicas.disponible('balanceado', YEAR) and not os.path.exists(archivo):
     print(f"❌ ERROR: No se encuentra el archivo: {archivo}")
     exit()
 
-df = pd.read_csv(archivo)
+# Solo las columnas que se usan (la primera vez se ingesta el CSV al almacén)
+e = instrumentacion.seccion('cargar', YEAR, unidad='filas')
+df = almacen_caracteristicas.cargar_anio('balanceado', YEAR, archivo, columnas=VARIABLES + ['class', 'lat', 'lon'])
 
-# Eliminamos las columnas que no son variables predictoras
-# Nota: Pandas es inteligente, si 'year' es una columna, la borra.
-X = df.drop(columns=['class', 'year', 'fecha_txt', 'lat', 'lon'])
+e['salida'] = len(df)
+
+# Solo variables predictoras (el almacén ya trae los nombres sin año)
+X = df[VARIABLES]
 y = df['class']
 
 # División Train/Test
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.3, random_state=42, stratify=y
-)
+if VALIDACION_ESPACIAL:
+    # Bloques espaciales enteros de cada lado (ver ajuste_hiperparametros.py)
+    idx_train, idx_test = ajuste_hiperparametros.division_espacial(ajuste_hiperparametros.bloques(df))
+    X_train, X_test, y_train, y_test = X.iloc[idx_train], X.iloc[idx_test], y.iloc[idx_train], y.iloc[idx_test]
+else:
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.3, random_state=42, stratify=y
+    )
 
 # Entrenar Modelo
 print("Entrenando Random Forest...")
+instrumentacion.seccion('entrenar', YEAR, entrada=len(X_train), unidad='filas')
 modelo = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
+ajustados = ajuste_hiperparametros.cargar_parametros('rf', [YEAR]) if USAR_HIPERPARAMETROS_AJUSTADOS else None
+if ajustados:
+    print(f"   Hiperparámetros ajustados: {ajustados}")
+    modelo.set_params(**ajustados)
 modelo.fit(X_train, y_train)
 
 # ==========================================
 # 3. CALCULAR MÉTRICAS
 # ==========================================
+instrumentacion.seccion('predict_proba', YEAR, entrada=len(X_test), unidad='filas')
 y_prob = modelo.predict_proba(X_test)[:, 1]
+instrumentacion.seccion(None)
 auc = roc_auc_score(y_test, y_prob)
 
 print("\n" + "="*40)
@@ -63,16 +97,25 @@ print("-" * 50)
 print(importancia.to_string(index=False))
 print("-" * 50)
 
+if IMPORTANCIA_PERMUTACION:
+    print("\nCalculando importancia por permutación (caída del AUC en prueba)...")
+    instrumentacion.seccion('permutacion', YEAR, entrada=len(X_test), unidad='filas')
+    permutacion = importancia_variables.importancia_permutacion(modelo, X_test, y_test)
+    print(permutacion.to_string(index=False))
+    importancia = importancia.merge(permutacion, on='Variable')
+
 # ==========================================
-# 5. GRÁFICOS
+# 5. GRÁFICOS (SE GUARDAN EN DISCO)
 # ==========================================
-print("\nGenerando gráfico de barras... (Se abrirá en una ventana)")
-
-plt.figure(figsize=(10, 6))
-sns.barplot(x='Importancia', y='Variable', data=importancia, hue='Variable', legend=False, palette='viridis')
+print("\nGenerando gráfico de barras...")
+instrumentacion.seccion('graficos', YEAR)
 
 # Título dinámico con el año
-plt.title(f'¿Qué variables causan más incendios en Leoncio Prado? ({YEAR})')
-plt.xlabel('Nivel de Importancia (0-1)')
-plt.tight_layout()
-plt.show()
\ No newline at end of file
+ruta_grafico = importancia_variables.graficar(
+    importancia, 'Importancia', f'¿Qué variables causan más incendios en Leoncio Prado? ({YEAR})',
+    os.path.join(carpeta_resultados, f'Importancia_RF_{YEAR}.png'),
+    etiqueta_x='Nivel de Importancia (0-1)', paleta='viridis')
+ruta_tabla = importancia_variables.guardar_tabla(
+    importancia, os.path.join(carpeta_resultados, f'Importancia_RF_{YEAR}.csv'))
+print(f"📊 Gráfico: {ruta_grafico}")
+print(f"📄 Tabla:   {ruta_tabla}")
\ No newline at end of file
@@ -1,7 +1,10 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import os
+import ajuste_hiperparametros  # Validación espacial / hiperparámetros (ver ajuste_hiperparametros.py)
+import importancia_variables  # SHAP / permutación y gráficos sin ventanas
+import almacen_caracteristicas  # Dataset balanceado en Parquet (ver almacen_caracteristicas.py)
+import instrumentacion  # Tiempos / memoria / conteos por etapa (reporte JSON por año)
+from almacen_caracteristicas import VARIABLES
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_auc_score, confusion_matrix, classification_report
 from xgboost import XGBClassifier # <--- LA ESTRELLA DEL SHOW
@@ -11,29 +14,55 @@ from xgboost import XGBClassifier # <--- LA ESTRELLA DEL SHOW
 # ==========================================
 YEAR = 2020  # <--- CAMBIA EL AÑO AQUÍ
 
+# orquestador.py fija el año de cada tarea por entorno (ej: SIG_YEARS=2021)
+YEAR = int(os.environ.get('SIG_YEARS', YEAR))
+
 # Ruta dinámica
 archivo = fr'D:\SIG\csv\{YEAR}\Dataset_{YEAR}_BALANCEADO_FINAL.csv'
 
+# Validación: True = división por bloques espaciales (puntos vecinos no quedan a
+# ambos lados); False = train_test_split aleatorio (AUC optimista).
+VALIDACION_ESPACIAL = True
+
+# Si ajuste_hiperparametros.py guardó hiperparámetros para este año, usarlos
+USAR_HIPERPARAMETROS_AJUSTADOS = True
+
+# Importancia sobre el conjunto de prueba (ver importancia_variables.py).
+# Tablas y gráficos se guardan en carpeta_resultados, sin abrir ventanas.
+IMPORTANCIA_SHAP = True         # TreeSHAP exacto (pred_contribs), en caché por modelo + datos
+IMPORTANCIA_PERMUTACION = True  # Caída del AUC al desordenar cada variable
+carpeta_resultados = fr'D:\SIG\resultados\{YEAR}'
+
 # ==========================================
 # 2. CARGAR DATOS
 # ==========================================
 print(f"🔥 Procesando con XGBoost - Año: {YEAR}")
+instrumentacion.iniciar('6_xgboost_importancia', [YEAR])
 
-if not os.path.exists(archivo):
+if not almacen_caracteristicas.disponible('balanceado', YEAR) and not os.path.exists(archivo):
     print(f"❌ ERROR: No se encuentra: {archivo}")
     exit()
 
-df = pd.read_csv(archivo)
+# Solo las columnas que se usan (la primera vez se ingesta el CSV al almacén)
+e = instrumentacion.seccion('cargar', YEAR, unidad='filas')
+df = almacen_caracteristicas.cargar_anio('balanceado', YEAR, archivo, columnas=VARIABLES + ['class', 'lat', 'lon'])
+
+e['salida'] = len(df)
 
 # Definir X (Variables) e y (Objetivo)
-# Eliminamos columnas que no son predictoras
-X = df.drop(columns=['class', 'year', 'fecha_txt', 'lat', 'lon'])
+# Solo variables predictoras (el almacén ya trae los nombres sin año)
+X = df[VARIABLES]
 y = df['class']
 
 # División Train/Test (70% entrenar, 30% validar)
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.3, random_state=42, stratify=y
-)
+if VALIDACION_ESPACIAL:
+    # Bloques espaciales enteros de cada lado (ver ajuste_hiperparametros.py)
+    idx_train, idx_test = ajuste_hiperparametros.division_espacial(ajuste_hiperparametros.bloques(df))
+    X_train, X_test, y_train, y_test = X.iloc[idx_train], X.iloc[idx_test], y.iloc[idx_train], y.iloc[idx_test]
+else:
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.3, random_state=42, stratify=y
+    )
 
 # ==========================================
 # 3. ENTRENAMIENTO XGBOOST
@@ -51,15 +80,22 @@ modelo_xgb = XGBClassifier(
     random_state=42,
     n_jobs=-1              # Usar todos los núcleos del CPU
 )
+ajustados = ajuste_hiperparametros.cargar_parametros('xgb', [YEAR]) if USAR_HIPERPARAMETROS_AJUSTADOS else None
+if ajustados:
+    print(f"   Hiperparámetros ajustados: {ajustados}")
+    modelo_xgb.set_params(**ajustados)
 
+instrumentacion.seccion('entrenar', YEAR, entrada=len(X_train), unidad='filas')
 modelo_xgb.fit(X_train, y_train)
 
 # ==========================================
 # 4. EVALUACIÓN
 # ==========================================
 # Probabilidad de clase 1 (Incendio)
+instrumentacion.seccion('predict_proba', YEAR, entrada=len(X_test), unidad='filas')
 y_prob = modelo_xgb.predict_proba(X_test)[:, 1]
 y_pred = modelo_xgb.predict(X_test)
+instrumentacion.seccion(None)
 
 # Calcular AUC
 auc = roc_auc_score(y_test, y_prob)
@@ -80,18 +116,41 @@ importancia = pd.DataFrame({
     'Importancia': modelo_xgb.feature_importances_
 }).sort_values('Importancia', ascending=False)
 
+if IMPORTANCIA_SHAP:
+    # Media del |SHAP| en prueba: cuánto mueve cada variable la predicción (en log-odds)
+    instrumentacion.seccion('shap', YEAR, entrada=len(X_test), unidad='filas')
+    shap = importancia_variables.importancia_shap(
+        importancia_variables.shap_en_cache(modelo_xgb, X_test), X_test.columns)
+    importancia = importancia.merge(shap, on='Variable')
+if IMPORTANCIA_PERMUTACION:
+    instrumentacion.seccion('permutacion', YEAR, entrada=len(X_test), unidad='filas')
+    permutacion = importancia_variables.importancia_permutacion(modelo_xgb, X_test, y_test)
+    importancia = importancia.merge(permutacion, on='Variable')
+
 print(f"\nRANKING VARIABLES (XGBoost {YEAR}):")
 print("-" * 50)
 print(importancia.to_string(index=False))
 print("-" * 50)
 
 # ==========================================
-# 6. GRÁFICO
+# 6. GRÁFICOS (SE GUARDAN EN DISCO)
 # ==========================================
-print("\nGenerando gráfico...")
-plt.figure(figsize=(10, 6))
-sns.barplot(x='Importancia', y='Variable', data=importancia, hue='Variable', legend=False, palette='magma')
-plt.title(f'Importancia de Variables (XGBoost) - {YEAR}')
-plt.xlabel('Importancia Relativa')
-plt.tight_layout()
-plt.show()
\ No newline at end of file
+instrumentacion.seccion(None)
+
+print("\nGenerando gráficos...")
+instrumentacion.seccion('graficos', YEAR)
+graficos = [importancia_variables.graficar(
+    importancia, 'Importancia', f'Importancia de Variables (XGBoost) - {YEAR}',
+    os.path.join(carpeta_resultados, f'Importancia_XGBoost_{YEAR}.png'),
+    etiqueta_x='Importancia Relativa', paleta='magma')]
+if IMPORTANCIA_SHAP:
+    graficos.append(importancia_variables.graficar(
+        importancia.sort_values('SHAP_medio_abs', ascending=False), 'SHAP_medio_abs',
+        f'Importancia SHAP (XGBoost) - {YEAR}',
+        os.path.join(carpeta_resultados, f'SHAP_XGBoost_{YEAR}.png'),
+        etiqueta_x='Media |SHAP| (log-odds)', paleta='magma'))
+ruta_tabla = importancia_variables.guardar_tabla(
+    importancia, os.path.join(carpeta_resultados, f'Importancia_XGBoost_{YEAR}.csv'))
+for ruta in graficos:
+    print(f"📊 Gráfico: {ruta}")
+print(f"📄 Tabla:   {ruta_tabla}")
\ No newline at end of file
@@ -1,4 +1,3 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
@@ -6,77 +5,185 @@ import joblib  # <--- LIBRERÍA PARA GUARDAR EL MODELO
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_auc_score, classification_report
 from xgboost import XGBClassifier
+import modelo_compilado  # Exporta el modelo a arreglos planos para 8_generar_mapa.py
+import entrenamiento_lotes  # Modo multi-año por lotes (ver entrenamiento_lotes.py)
+import ajuste_hiperparametros  # Validación espacial / hiperparámetros (ver ajuste_hiperparametros.py)
+import registro_modelos  # Versiones del modelo en UBJSON + manifiesto (ver registro_modelos.py)
+import almacen_caracteristicas  # Dataset balanceado en Parquet (ver almacen_caracteristicas.py)
+import instrumentacion  # Tiempos / memoria / conteos por etapa (reporte JSON por año)
+from almacen_caracteristicas import VARIABLES
 
 # ==========================================
 # 1. CONFIGURACIÓN
 # ==========================================
 YEAR = 2020  # Usa el año con el que quieras entrenar (o une varios años)
 
+# Varios años a la vez (ej: range(2020, 2024)): se entrena por lotes desde el
+# almacén, sin unir los años en memoria. None = solo YEAR.
+YEARS = None
+
+# orquestador.py fija los años por entorno (ej: SIG_YEARS=2020,2021); con uno solo, modo de un año
+if os.environ.get('SIG_YEARS'):
+    _anios = [int(y) for y in os.environ['SIG_YEARS'].split(',')]
+    YEAR, YEARS = _anios[0], (_anios if len(_anios) > 1 else None)
+
+# Con YEARS: si el modelo guardado ya se entrenó con parte de esos años (mismos
+# datos, división e hiperparámetros, ver entrenamiento_lotes.motivo_reentrenar),
+# solo se le agregan RONDAS_INCREMENTO árboles con los años nuevos (False = desde cero).
+INCREMENTAL = True
+RONDAS_INCREMENTO = 50
+
+# orquestador.py corre con SIG_INCREMENTAL=0: su huella solo mira las entradas
+# declaradas, así que el modelo no puede depender del .pkl de la corrida anterior
+if os.environ.get('SIG_INCREMENTAL'):
+    INCREMENTAL = os.environ['SIG_INCREMENTAL'] != '0'
+
+# Validación: True = división por bloques espaciales (puntos vecinos no quedan a
+# ambos lados); False = train_test_split aleatorio (AUC optimista). En el modo
+# multi-año lo controla entrenamiento_lotes.DIVISION_ESPACIAL.
+VALIDACION_ESPACIAL = True
+
+# Si ajuste_hiperparametros.py guardó hiperparámetros para estos años, usarlos
+USAR_HIPERPARAMETROS_AJUSTADOS = True
+
 # Archivo de entrada (CSV Balanceado)
-archivo = fr'D:\SIG\csv\{YEAR}\Dataset_{YEAR}_BALANCEADO_FINAL.csv'
+def archivo_anio(year):
+    return fr'D:\SIG\csv\{year}\Dataset_{year}_BALANCEADO_FINAL.csv'
+
+archivo = archivo_anio(YEAR)
 
 # Archivo de SALIDA (El modelo guardado)
 # Nota: Lo guardamos en una carpeta general "modelos"
 ruta_modelo_salida = r'D:\SIG\modelos\Modelo_Incendios_XGBoost_Entrenado.pkl'
 
-# ==========================================
-# 2. CARGAR Y PREPARAR DATOS
-# ==========================================
-print(f"🔥 Cargando datos del año: {YEAR}")
-
-if not os.path.exists(archivo):
-    print(f"❌ ERROR: No se encuentra el archivo: {archivo}")
-    exit()
-
-df = pd.read_csv(archivo)
-
-# --- PASO CRUCIAL: ESTANDARIZAR NOMBRES ---
-# Quitamos el "_2020" para que el modelo sea universal y sirva para 2021, 2022...
-mapa_nombres = {
-    f'dist_vias_{YEAR}': 'dist_vias',
-    f'dist_water_{YEAR}': 'dist_water',
-    f'dist_built_{YEAR}': 'dist_built'
-}
-df = df.rename(columns=mapa_nombres)
-print("✅ Nombres de columnas estandarizados (sin año).")
-
-# Definir X e y
-# Borramos las columnas que no sirven para predecir
-X = df.drop(columns=['class', 'year', 'fecha_txt', 'lat', 'lon'])
-y = df['class']
-
-# División Train/Test
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.3, random_state=42, stratify=y
-)
-
-# ==========================================
-# 3. ENTRENAMIENTO
-# ==========================================
-print("🚀 Entrenando XGBoost...")
-
-modelo = XGBClassifier(
-    n_estimators=100,
-    learning_rate=0.1,
-    max_depth=5,
-    random_state=42,
-    n_jobs=-1
-)
-
-modelo.fit(X_train, y_train)
+# Versión compilada del mismo modelo (arreglos de nodos, ver modelo_compilado.py)
+ruta_modelo_compilado = r'D:\SIG\modelos\Modelo_Incendios_XGBoost_Compilado.npz'
 
 # ==========================================
-# 4. EVALUACIÓN (Opcional, para verificar)
+# 2. CARGAR Y PREPARAR DATOS
 # ==========================================
-y_prob = modelo.predict_proba(X_test)[:, 1]
-auc = roc_auc_score(y_test, y_prob)
-print(f"⭐ AUC-ROC Score: {auc:.4f}")
+instrumentacion.iniciar('7_modelo', sorted(set(YEARS)) if YEARS is not None else [YEAR])
+
+if YEARS is None:
+    print(f"🔥 Cargando datos del año: {YEAR}")
+
+    if not almacen_caracteristicas.disponible('balanceado', YEAR) and not os.path.exists(archivo):
+        print(f"❌ ERROR: No se encuentra el archivo: {archivo}")
+        exit()
+
+    # Solo las columnas que se usan (la primera vez se ingesta el CSV al almacén)
+    e = instrumentacion.seccion('cargar', YEAR, unidad='filas')
+    df = almacen_caracteristicas.cargar_anio('balanceado', YEAR, archivo, columnas=VARIABLES + ['class', 'lat', 'lon'])
+    e['salida'] = len(df)
+
+    # Los nombres ya vienen estandarizados desde el almacén (dist_vias_2020 -> dist_vias):
+    # así el modelo es universal y sirve para 2021, 2022...
+
+    # Definir X e y (solo variables predictoras)
+    X = df[VARIABLES]
+    y = df['class']
+
+    # División Train/Test
+    if VALIDACION_ESPACIAL:
+        # Bloques espaciales enteros de cada lado (ver ajuste_hiperparametros.py)
+        idx_train, idx_test = ajuste_hiperparametros.division_espacial(ajuste_hiperparametros.bloques(df))
+        X_train, X_test, y_train, y_test = X.iloc[idx_train], X.iloc[idx_test], y.iloc[idx_train], y.iloc[idx_test]
+    else:
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=0.3, random_state=42, stratify=y
+        )
+
+    # ==========================================
+    # 3. ENTRENAMIENTO
+    # ==========================================
+    print("🚀 Entrenando XGBoost...")
+
+    modelo = XGBClassifier(
+        n_estimators=100,
+        learning_rate=0.1,
+        max_depth=5,
+        random_state=42,
+        n_jobs=-1
+    )
+    ajustados = ajuste_hiperparametros.cargar_parametros('xgb', [YEAR]) if USAR_HIPERPARAMETROS_AJUSTADOS else None
+    if ajustados:
+        print(f"   Hiperparámetros ajustados: {ajustados}")
+        modelo.set_params(**ajustados)
+
+    instrumentacion.seccion('entrenar', YEAR, entrada=len(X_train), unidad='filas')
+    modelo.fit(X_train, y_train)
+    # Con qué se entrenó (el modo incremental solo continúa modelos de su misma división)
+    entrenamiento_lotes.firmar(
+        modelo.get_booster(), [YEAR], 'un_anio_espacial' if VALIDACION_ESPACIAL else 'un_anio_aleatoria',
+        modelo.get_xgb_params())
+
+    # ==========================================
+    # 4. EVALUACIÓN (Opcional, para verificar)
+    # ==========================================
+    instrumentacion.seccion('predict_proba', YEAR, entrada=len(X_test), unidad='filas')
+    y_prob = modelo.predict_proba(X_test)[:, 1]
+    auc = roc_auc_score(y_test, y_prob)
+    print(f"⭐ AUC-ROC Score: {auc:.4f}")
+
+else:
+    years = sorted(set(YEARS))
+    print(f"🔥 Entrenamiento multi-año por lotes: {years}")
+
+    # Los años que aún no están en el almacén se ingestan desde su CSV (7 no
+    # reescribe particiones: si el CSV cambió, lo actualiza 4_dataset_balanceado_final.py)
+    instrumentacion.seccion('ingesta')
+    for year in years:
+        if not almacen_caracteristicas.disponible('balanceado', year) and not os.path.exists(archivo_anio(year)):
+            print(f"❌ ERROR: No se encuentra el archivo: {archivo_anio(year)}")
+            exit()
+        almacen_caracteristicas.ingestar_si_falta('balanceado', year, archivo_anio(year))
+
+    ajustados = ajuste_hiperparametros.cargar_parametros('xgb', years) if USAR_HIPERPARAMETROS_AJUSTADOS else None
+    if ajustados:
+        print(f"   Hiperparámetros ajustados: {ajustados}")
+        ajustados = dict(ajustados)
+        entrenamiento_lotes.N_ARBOLES = ajustados.pop('n_estimators', entrenamiento_lotes.N_ARBOLES)
+        entrenamiento_lotes.PARAMETROS.update(ajustados)
+
+    modelo_previo = None
+    if INCREMENTAL and os.path.exists(ruta_modelo_salida):
+        modelo_previo = joblib.load(ruta_modelo_salida).get_booster()
+        vistos = entrenamiento_lotes.anios_entrenados(modelo_previo)
+        nuevos = [y for y in years if y not in vistos]
+        print(f"   Modelo previo entrenado con: {vistos or 'años desconocidos'}")
+        motivo = entrenamiento_lotes.motivo_reentrenar(modelo_previo, years)
+        if motivo is not None:
+            print(f"   -> No se puede continuar ({motivo}): se reentrena desde cero.")
+            modelo_previo = None
+        elif not nuevos:
+            print("   -> Ya incluye todos los años pedidos: no se agregan árboles.")
+        else:
+            print(f"   -> Se agregan {RONDAS_INCREMENTO} árboles con los años nuevos: {nuevos}")
+
+    # ==========================================
+    # 3. ENTRENAMIENTO (QuantileDMatrix alimentada por lotes)
+    # ==========================================
+    print("🚀 Entrenando XGBoost...")
+    instrumentacion.seccion('entrenar')
+    booster = entrenamiento_lotes.entrenar(
+        years, modelo_previo,
+        n_arboles=RONDAS_INCREMENTO if modelo_previo is not None else entrenamiento_lotes.N_ARBOLES)
+    modelo = entrenamiento_lotes.a_clasificador(booster)
+
+    # ==========================================
+    # 4. EVALUACIÓN (prueba = 30% de cada año, fija por fila)
+    # ==========================================
+    e = instrumentacion.seccion('evaluar', unidad='filas')
+    auc, X_test = entrenamiento_lotes.evaluar(booster, years)
+    e['entrada'] = len(X_test)
+    print(f"⭐ AUC-ROC Score ({years[0]}-{years[-1]}): {auc:.4f}")
 
 # ==========================================
 # 5. GUARDAR EL MODELO (EL PASO QUE FALTABA)
 # ==========================================
 print("-" * 30)
 print("💾 GUARDANDO MODELO EN DISCO...")
+instrumentacion.seccion('guardar')
 
 # Crear carpeta si no existe
 carpeta_modelos = os.path.dirname(ruta_modelo_salida)
@@ -89,4 +196,39 @@ joblib.dump(modelo, ruta_modelo_salida)
 print(f"✅ ¡LISTO! Modelo guardado exitosamente en:")
 print(ruta_modelo_salida)
 print("-" * 30)
-print("Ahora puedes usar este archivo .pkl para generar mapas en cualquier script.")
\ No newline at end of file
+print("Ahora puedes usar este archivo .pkl para generar mapas en cualquier script.")
+
+# ==========================================
+# 6. EXPORTAR MODELO COMPILADO
+# ==========================================
+print("\n🔧 Compilando modelo (árboles -> arreglos de nodos)...")
+instrumentacion.seccion('compilar')
+compilado = modelo_compilado.compilar(modelo)
+
+# Debe dar las mismas probabilidades que predict_proba (tolerancia 1e-6)
+diferencia = modelo_compilado.verificar(modelo, compilado, X_test)
+modelo_compilado.guardar(compilado, ruta_modelo_compilado)
+
+print(f"✅ Modelo compilado guardado en: {ruta_modelo_compilado}")
+print(f"   Diferencia máxima contra predict_proba: {diferencia:.2e}")
+
+# ==========================================
+# 7. REGISTRAR VERSIÓN (UBJSON + MANIFIESTO)
+# ==========================================
+# 8_generar_mapa.py elige la versión por año y valida el orden de bandas con el manifiesto
+instrumentacion.seccion('registrar')
+anios_modelo = entrenamiento_lotes.anios_entrenados(modelo.get_booster())
+huella_datos = almacen_caracteristicas.huella('balanceado', anios_modelo)
+# Un modelo idéntico (mismos árboles) con los mismos datos no se registra dos veces
+igual = registro_modelos.version_igual(modelo, huella_datos)
+if igual is not None:
+    print(f"\n📚 Mismo modelo y datos que la versión {igual['version']}: no se registra de nuevo.")
+else:
+    manifiesto = registro_modelos.registrar(
+        modelo, VARIABLES, anios_modelo, auc=auc,
+        huella_datos=huella_datos,
+        compilado=compilado,
+        extra={'validacion_espacial': VALIDACION_ESPACIAL if YEARS is None else entrenamiento_lotes.DIVISION_ESPACIAL},
+    )
+    print(f"\n📚 Registrado como versión {manifiesto['version']} (años {manifiesto['years']}):")
+    print(registro_modelos.ruta_version(manifiesto['version']))
\ No newline at end of file
@@ -1,150 +1,679 @@
 import rasterio
-from rasterio.warp import reproject, Resampling
+from rasterio.warp import Resampling
+from rasterio.windows import Window
 import numpy as np
-import pandas as pd
 import joblib
+import multiprocessing
 import os
+from collections import deque
+import time
+import modelo_compilado
+import cubo_caracteristicas
+import cache_alineado
+import piramide_mascara
+import registro_modelos
+import instrumentacion  # Tiempos / memoria / conteos por etapa (reporte JSON por año)
+import xgboost as xgb
 
 # ==============================================================================
 # 1. CONFIGURACIÓN (INPUTS)
 # ==============================================================================
 YEAR = 2020  # <--- CAMBIA EL AÑO AQUÍ (2020, 2021, 2022...)
 
+# Varios años en una sola corrida (ej: range(2020, 2025)). None = solo YEAR.
+YEARS = None
+
+# orquestador.py fija los años de cada tarea por entorno (ej: SIG_YEARS=2021)
+if os.environ.get('SIG_YEARS'):
+    YEARS = [int(y) for y in os.environ['SIG_YEARS'].split(',')]
+
 # A. Ruta del Modelo Entrenado (.pkl)
 # Este archivo es único (o puedes tener uno por año si entrenaste separado)
 ruta_modelo = r'D:\SIG\modelos\Modelo_Incendios_XGBoost_Entrenado.pkl'
 
-# B. Ruta del Stack de Variables (Descargado de GEE)
-input_stack = fr'D:\SIG\raster\{YEAR}\Stack_Susceptibilidad_{YEAR}_Estandarizado.tif'
+# A.2 Modelo compilado (lo exporta 7_generar_modelo.py junto al .pkl)
+# Actívalo solo si `python modelo_compilado.py` muestra que es más rápido en tu equipo
+USAR_MODELO_COMPILADO = False
+ruta_modelo_compilado = r'D:\SIG\modelos\Modelo_Incendios_XGBoost_Compilado.npz'
 
-# C. Ruta de la Máscara de Exclusión (Agua/Construcciones)
-# Se asume que está en la carpeta del año correspondiente
-ruta_mascara = fr'D:\SIG\raster\{YEAR}\Mascara_Agua_Construcciones_{YEAR}.tif'
+# A.3 Registro de modelos (ver registro_modelos.py)
+# Si hay versiones registradas, cada año se predice con la más nueva entrenada con
+# ese año (o con VERSION_MODELO si se fija, ej: 'v003'), y el orden de bandas del
+# stack se compara con su manifiesto. Sin registro se usan las dos rutas de arriba.
+USAR_REGISTRO = True
+VERSION_MODELO = None
 
-# D. Ruta de Salida (Mapa Final)
-output_map = fr'D:\SIG\raster\{YEAR}\Mapa_Susceptibilidad_Final_{YEAR}.tif'
+def rutas_anio(year):
+    """Rutas de entrada/salida de un año (mismo esquema de carpetas para todos)."""
+    return {
+        # B. Ruta del Stack de Variables (Descargado de GEE)
+        'stack': fr'D:\SIG\raster\{year}\Stack_Susceptibilidad_{year}_Estandarizado.tif',
+        # C. Ruta de la Máscara de Exclusión (Agua/Construcciones)
+        # Se asume que está en la carpeta del año correspondiente
+        'mascara': fr'D:\SIG\raster\{year}\Mascara_Agua_Construcciones_{year}.tif',
+        # D. Ruta de Salida (Mapa Final)
+        'salida': fr'D:\SIG\raster\{year}\Mapa_Susceptibilidad_Final_{year}.tif',
+        # D.1 Explicación por píxel (solo con UMBRAL_EXPLICACION)
+        'contribuciones': fr'D:\SIG\raster\{year}\Mapa_Contribuciones_SHAP_{year}.tif',
+        'dominante': fr'D:\SIG\raster\{year}\Mapa_Variable_Dominante_{year}.tif',
+        # D.2 Cubo memory-mapped del stack + máscara (lo genera cubo_caracteristicas.py)
+        'cubo': cubo_caracteristicas.rutas_anio(year)['cubo'],
+    }
 
 # E. Definición de Bandas (Orden EXACTO del script de GEE)
 # El modelo espera los nombres estandarizados (sin _2020)
 nombres_bandas = [
     'elev', 'slope', 'aspect',      # Topografía
     'dist_vias',                    # Distancias
-    'dist_water', 
+    'dist_water',
     'dist_built',
     'precip_60d',                   # Clima
     'temp_mean',
     'ndvi_mean'                     # Vegetación
 ]
 
+# F. Presupuesto de memoria por tile (MB)
+# El stack se procesa por ventanas alineadas a sus bloques internos (block_windows),
+# agrupando tantos bloques como quepan en este presupuesto.
+# None = leer la imagen completa de una sola vez (comportamiento antiguo).
+# Es por proceso: con el pool, el pico es ~ N_PROCESOS x PRESUPUESTO_TILE_MB, más
+# los resultados aún sin escribir (a lo sumo 2 x N_PROCESOS tiles, ver _en_orden_acotado).
+PRESUPUESTO_TILE_MB = 256
+
+# G. Cubo de variables pre-tileado (ver cubo_caracteristicas.py)
+# Si existe y está al día con el stack y la máscara, se lee de él en vez de
+# descomprimir el GeoTIFF y reproyectar la máscara en cada corrida.
+USAR_CUBO = True
+
+# H. Paralelismo
+# Número de procesos del pool (cada uno carga el modelo una sola vez).
+# 1 = modo secuencial (XGBoost usa sus propios hilos).
+N_PROCESOS = os.cpu_count() or 1
+
+# I. Umbral de cobertura de la máscara: se define una sola vez en piramide_mascara.py
+# (el mismo que usa cubo_caracteristicas.py)
+from piramide_mascara import UMBRAL_COBERTURA
+
+# J. Explicación por píxel (TreeSHAP del booster, en la misma pasada por tiles)
+# Para los píxeles con probabilidad >= umbral (ej: 0.7) se escriben dos rasters más:
+#   Mapa_Contribuciones_SHAP: una banda por variable, contribución en log-odds
+#   Mapa_Variable_Dominante:  uint8, 1..9 = variable (orden de nombres_bandas) que
+#                             más SUBE el riesgo en ese píxel; 0 = sin explicar
+# None = solo el mapa de probabilidad (comportamiento antiguo).
+UMBRAL_EXPLICACION = None
+
+NODATA_SALIDA = -9999.0
+
+# ==============================================================================
+# 2. FUNCIONES DE PROCESAMIENTO POR VENTANAS
 # ==============================================================================
-# 2. PROCESAMIENTO
+def ventanas_por_bloques(src, presupuesto_mb):
+    """Genera ventanas alineadas a los bloques internos del stack.
+
+    Cada ventana es un rectángulo de bloques completos cuyo costo en memoria
+    (bandas leídas + _BUFFER de filas válidas + salida, ver predecir_ventana)
+    no supera `presupuesto_mb`.
+    """
+    if presupuesto_mb is None:
+        yield Window(0, 0, src.width, src.height)
+        return
+
+    alto_bloque, ancho_bloque = src.block_shapes[0]
+    # Bytes por píxel (peor caso: todos válidos):
+    #   bandas leídas (float32) + _BUFFER compactado (float32, mismas bandas)
+    #   + mapa_tile y predicción (float32) + índices válidos (int64) + máscaras (3 x 1 byte)
+    bytes_pixel = src.count * 4 * 2 + 4 * 2 + 8 + 3
+    if UMBRAL_EXPLICACION is not None:
+        # Contribuciones del tile + salida de TreeSHAP (float32 por banda) + variable dominante
+        bytes_pixel += src.count * 4 * 2 + 1
+    max_pixeles = max(alto_bloque * ancho_bloque, int(presupuesto_mb * 1024 ** 2) // bytes_pixel)
+
+    # Primero se ensancha la ventana (filas completas leen mejor), luego se alarga
+    bloques_por_fila = int(np.ceil(src.width / ancho_bloque))
+    n_ancho = max(1, min(bloques_por_fila, max_pixeles // (alto_bloque * ancho_bloque)))
+    ancho_ventana = min(src.width, n_ancho * ancho_bloque)
+    n_alto = max(1, max_pixeles // (ancho_ventana * alto_bloque))
+    alto_ventana = min(src.height, n_alto * alto_bloque)
+
+    for fila in range(0, src.height, alto_ventana):
+        for col in range(0, src.width, ancho_ventana):
+            yield Window(col, fila,
+                         min(ancho_ventana, src.width - col),
+                         min(alto_ventana, src.height - fila))
+
+
+def mascara_validez(datos, nodata, mascara_tile=None, eje_bandas=0):
+    """Máscara 2D de píxeles a predecir: sin NaN/NoData en ninguna banda y fuera de la exclusión.
+
+    `datos` viene como (Bandas, Y, X) desde rasterio, o (Y, X, Bandas) desde el
+    cubo (eje_bandas=-1).
+
+    Devuelve (validos, n_nulos, n_excluidos). Un píxel nulo que además cae en la
+    máscara de exclusión se cuenta como nulo.
+    """
+    # Filtro de Nulos (Para no predecir en bordes o nubes)
+    if np.issubdtype(datos.dtype, np.floating):
+        nulos = np.isnan(datos).any(axis=eje_bandas)
+    else:
+        nulos = np.zeros(np.delete(datos.shape, eje_bandas), dtype=bool)
+    if nodata is not None and not np.isnan(nodata):
+        nulos |= (datos == nodata).any(axis=eje_bandas)
+
+    validos = ~nulos
+    n_excluidos = 0
+    if mascara_tile is not None:
+        # 1 en máscara = Agua/Construcción -> no se predice
+        excluidos = (mascara_tile == 1) & validos
+        n_excluidos = int(excluidos.sum())
+        validos &= ~excluidos
+
+    return validos, int(nulos.sum()), n_excluidos
+
+
+def validar_variables(nombres_modelo):
+    if nombres_modelo is not None and len(nombres_modelo) and list(nombres_modelo) != nombres_bandas:
+        raise ValueError(f"El modelo espera las variables {list(nombres_modelo)}, "
+                         f"pero el stack define {nombres_bandas}")
+
+
+def preparar_predictor(modelo):
+    """Valida el orden de variables UNA sola vez y devuelve una función X(float32) -> probabilidades.
+
+    Para XGBoost se predice directo sobre el booster (inplace_predict), sin
+    DataFrame ni copias intermedias; otros modelos usan predict_proba.
+    Acepta también un xgb.Booster suelto (versiones del registro).
+    """
+    if isinstance(modelo, xgb.Booster):
+        validar_variables(modelo.feature_names)
+        rango = modelo_compilado.rango_arboles(modelo)
+        return lambda X: modelo.inplace_predict(X, iteration_range=rango, predict_type='value')
+
+    nombres_modelo = getattr(modelo, 'feature_names_in_', None)
+    if hasattr(modelo, 'get_booster') and modelo.get_booster().feature_names is not None:
+        nombres_modelo = modelo.get_booster().feature_names
+    validar_variables(nombres_modelo)
+
+    if not hasattr(modelo, 'get_booster'):
+        return lambda X: modelo.predict_proba(X)[:, 1]
+
+    booster = modelo.get_booster()
+    rango = modelo_compilado.rango_arboles(booster)
+    return lambda X: booster.inplace_predict(X, iteration_range=rango, predict_type='value')
+
+
+def preparar_explicador(booster):
+    """Función X(float32) -> contribuciones SHAP (Pixeles, Bandas), sin la columna de sesgo."""
+    validar_variables(booster.feature_names)
+    rango = modelo_compilado.rango_arboles(booster)
+    return lambda X: booster.predict(xgb.DMatrix(X, feature_names=nombres_bandas), pred_contribs=True,
+                                     iteration_range=rango)[:, :-1]
+
+
+# Buffer de compactación (Pixeles, Bandas) float32 reutilizado entre tiles del mismo proceso
+_BUFFER = np.empty((0, len(nombres_bandas)), dtype=np.float32)
+
+
+def predecir_ventana(predictor, datos, validos, intercalado=False, explicador=None):
+    """Devuelve la probabilidad de incendio (float32, -9999 fuera de `validos`) de un bloque.
+
+    `datos` es (Bandas, Y, X), o (Y, X, Bandas) contiguo si `intercalado`.
+    Con `explicador` devuelve (mapa_tile, (contribuciones (Bandas, Y, X), dominante (Y, X))):
+    las contribuciones se calculan sobre las mismas filas ya compactadas, solo
+    para los píxeles con probabilidad >= UMBRAL_EXPLICACION.
+    """
+    global _BUFFER
+    if intercalado:
+        alto, ancho, n_bandas = datos.shape
+    else:
+        n_bandas, alto, ancho = datos.shape
+
+    # Array base lleno de -9999 (NoData)
+    mapa_tile = np.full((alto, ancho), NODATA_SALIDA, dtype=np.float32)
+
+    indices = np.flatnonzero(validos)
+    n = indices.size
+    if n > 0:
+        if _BUFFER.shape[0] < n:
+            _BUFFER = np.empty((n, n_bandas), dtype=np.float32)
+
+        X_validos = _BUFFER[:n]
+        if intercalado:
+            # Cada píxel ya es una fila contigua: se copian las filas válidas de una vez
+            np.take(datos.reshape(alto * ancho, n_bandas), indices, axis=0, out=X_validos)
+        else:
+            # Compactar solo los píxeles que sobreviven, banda por banda, dentro del buffer:
+            # (Bandas, Y*X) es una vista del tile, no una copia
+            planos = datos.reshape(n_bandas, alto * ancho)
+            for b in range(n_bandas):
+                np.take(planos[b], indices, out=X_validos[:, b])
+
+        mapa_tile.ravel()[indices] = predictor(X_validos) # Probabilidad de Incendio
+
+    if explicador is None:
+        return mapa_tile
+
+    contribuciones = np.full((n_bandas, alto * ancho), NODATA_SALIDA, dtype=np.float32)
+    dominante = np.zeros(alto * ancho, dtype=np.uint8)
+    if n > 0:
+        riesgo = np.flatnonzero(mapa_tile.ravel()[indices] >= UMBRAL_EXPLICACION)
+        if riesgo.size:
+            valores = explicador(X_validos[riesgo])
+            contribuciones[:, indices[riesgo]] = valores.T
+            dominante[indices[riesgo]] = np.argmax(valores, axis=1) + 1
+    return mapa_tile, (contribuciones.reshape(n_bandas, alto, ancho), dominante.reshape(alto, ancho))
+
+
+def procesar_ventana(predictor, src, mascara_alineada, ventana, explicador=None):
+    """Lee, filtra y predice un tile. Devuelve (mapa_tile, explicacion o None, estadisticas).
+
+    `mascara_alineada` es la máscara de exclusión ya en la grilla del stack
+    (memory-mapped desde la caché de alineados) o None.
+    """
+    datos = src.read(window=ventana, out_dtype='float32')
+
+    # Máscara de exclusión (Agua/Construcciones) ANTES de predecir
+    mascara_tile = None
+    if mascara_alineada is not None:
+        (fila_ini, fila_fin), (col_ini, col_fin) = ventana.toranges()
+        mascara_tile = np.asarray(mascara_alineada[fila_ini:fila_fin, col_ini:col_fin])
+        if np.issubdtype(mascara_tile.dtype, np.floating):
+            # Fracción de cobertura (nivel de la pirámide): se excluye desde el umbral
+            mascara_tile = (mascara_tile >= UMBRAL_COBERTURA).astype(np.uint8)
+
+    validos, n_nulos, n_excluidos = mascara_validez(datos, src.nodata, mascara_tile)
+
+    t0 = time.perf_counter()
+    resultado = predecir_ventana(predictor, datos, validos, explicador=explicador)
+    mapa_tile, explicacion = resultado if explicador is not None else (resultado, None)
+    t_prediccion = time.perf_counter() - t0
+
+    estadisticas = {
+        'pixeles': int(validos.size),
+        'predichos': int(validos.sum()),
+        'nulos': n_nulos,
+        'excluidos': n_excluidos,
+        't_prediccion': t_prediccion,
+        'explicados': int((explicacion[1] > 0).sum()) if explicacion is not None else 0,
+    }
+    return mapa_tile, explicacion, estadisticas
+
+
+def procesar_tile_cubo(predictor, cubo, ventana, explicador=None):
+    """Igual que procesar_ventana, pero leyendo el tile ya alineado desde el cubo memory-mapped."""
+    datos, mascara_tile = cubo_caracteristicas.leer_tile(cubo, ventana)
+    alto, ancho = int(ventana.height), int(ventana.width)
+
+    # Las estadísticas se cuentan sin el relleno del borde del tile
+    validos, n_nulos, n_excluidos = mascara_validez(
+        datos[:alto, :ancho], None,
+        mascara_tile[:alto, :ancho] if mascara_tile is not None else None, eje_bandas=-1)
+    validos_tile = np.zeros(datos.shape[:2], dtype=bool)
+    validos_tile[:alto, :ancho] = validos
+
+    t0 = time.perf_counter()
+    resultado = predecir_ventana(predictor, datos, validos_tile, intercalado=True, explicador=explicador)
+    mapa_tile, explicacion = resultado if explicador is not None else (resultado, None)
+    mapa_tile = mapa_tile[:alto, :ancho]
+    if explicacion is not None:
+        # Sin el relleno del borde del tile
+        explicacion = (explicacion[0][:, :alto, :ancho], explicacion[1][:alto, :ancho])
+    t_prediccion = time.perf_counter() - t0
+
+    estadisticas = {
+        'pixeles': int(validos.size),
+        'predichos': int(validos.sum()),
+        'nulos': n_nulos,
+        'excluidos': n_excluidos,
+        't_prediccion': t_prediccion,
+        'explicados': int((explicacion[1] > 0).sum()) if explicacion is not None else 0,
+    }
+    return mapa_tile, explicacion, estadisticas
+
+
 # ==============================================================================
-print(f"🌍 Generando Mapa de Susceptibilidad para el año {YEAR}...")
-
-# --- PASO 1: CARGAR MODELO ---
-if not os.path.exists(ruta_modelo):
-    print(f"❌ ERROR: No se encuentra el modelo: {ruta_modelo}")
-    exit()
-
-print("1. Cargando cerebro digital (Modelo XGBoost)...")
-modelo = joblib.load(ruta_modelo)
-
-# --- PASO 2: LEER STACK DE VARIABLES ---
-if not os.path.exists(input_stack):
-    print(f"❌ ERROR: No se encuentra el Stack Tiff: {input_stack}")
-    exit()
-
-print(f"2. Leyendo imagen satelital: {os.path.basename(input_stack)}")
-with rasterio.open(input_stack) as src:
-    meta = src.meta.copy()
-    height = src.height
-    width = src.width
-    crs_stack = src.crs
-    transform_stack = src.transform
-    
-    # Leer datos (Bandas, Filas, Columnas)
-    img_data = src.read()
-    
-    # Verificación de seguridad
-    if img_data.shape[0] != len(nombres_bandas):
-        print(f"❌ ERROR: El Tiff tiene {img_data.shape[0]} bandas, pero se definieron {len(nombres_bandas)} nombres.")
-        exit()
-
-# --- PASO 3: PREPARAR DATOS ---
-print("3. Preparando matriz de datos...")
-n_pixels = height * width
-
-# Aplanar: (Bandas, Y, X) -> (Pixeles, Bandas)
-X_flat = img_data.reshape(img_data.shape[0], n_pixels).T 
-df_map = pd.DataFrame(X_flat, columns=nombres_bandas)
-
-# Filtro de Nulos (Para no predecir en bordes o nubes)
-valid_pixels_mask = ~df_map.isnull().any(axis=1)
-
-# --- PASO 4: PREDICCIÓN (INFERENCIA) ---
-print("4. Realizando predicción (Calculando probabilidades)...")
-
-# Array base lleno de -9999 (NoData)
-mapa_plano = np.full(n_pixels, -9999.0, dtype=np.float32)
-
-if valid_pixels_mask.sum() > 0:
-    # Predecir solo datos válidos
-    datos_validos = df_map.loc[valid_pixels_mask]
-    probs = modelo.predict_proba(datos_validos)[:, 1] # Columna 1 = Probabilidad de Incendio
-    mapa_plano[valid_pixels_mask] = probs
-else:
-    print("⚠️ ADVERTENCIA: La imagen parece estar vacía o llena de nulos.")
-
-# Reconstruir imagen 2D
-mapa_final_2d = mapa_plano.reshape(height, width)
-
-# --- PASO 5: APLICAR MÁSCARA DE EXCLUSIÓN (Agua/Construcciones) ---
-print("5. Aplicando máscara de exclusión (Limpiando ríos y zonas urbanas)...")
-
-if os.path.exists(ruta_mascara):
-    with rasterio.open(ruta_mascara) as src_mask:
-        # Crear array vacío del tamaño del MAPA FINAL (probablemente 20m)
-        mascara_ajustada = np.zeros((height, width), dtype=np.uint8)
-        
-        # Reproyectar/Remuestrear la máscara (de 10m a 20m) al vuelo
-        reproject(
-            source=rasterio.band(src_mask, 1),
-            destination=mascara_ajustada,
-            src_transform=src_mask.transform,
-            src_crs=src_mask.crs,
-            dst_transform=transform_stack,
-            dst_crs=crs_stack,
-            resampling=Resampling.nearest # Nearest conserva los valores 0 y 1 puros
-        )
-        
-        # Aplicar el borrado: Donde máscara es 1, poner NoData (-9999)
-        # 1 en máscara = Agua/Construcción
-        pixeles_a_borrar = (mascara_ajustada == 1)
-        mapa_final_2d[pixeles_a_borrar] = -9999.0
-        
-        count_borrados = np.sum(pixeles_a_borrar)
-        print(f"   -> Se enmascararon {count_borrados} píxeles (Ríos/Casas eliminados).")
-else:
-    print(f"⚠️ ALERTA: No se encontró la máscara en: {ruta_mascara}")
-    print("   -> El mapa se guardará sin limpiar los ríos (puede haber falsos positivos).")
-
-# --- PASO 6: GUARDAR RESULTADO ---
-print(f"6. Guardando archivo final...")
-
-# Actualizar metadata para 1 sola banda float
-meta.update({
-    'count': 1,
-    'dtype': 'float32',
-    'nodata': -9999
-})
-
-# Crear carpeta de salida si no existe
-os.makedirs(os.path.dirname(output_map), exist_ok=True)
-
-with rasterio.open(output_map, 'w', **meta) as dst:
-    dst.write(mapa_final_2d, 1)
-
-print("\n" + "="*50)
-print(f"✅ ¡ÉXITO! Mapa de Susceptibilidad {YEAR} generado.")
-print(f"📂 Archivo: {output_map}")
-print("="*50)
\ No newline at end of file
+# 3. WORKERS DEL POOL DE PROCESOS
+# ==============================================================================
+# Estado propio de cada proceso: cada modelo se carga (y valida) una vez y los
+# rasters/cubos se abren una vez por proceso (los handles de GDAL no se pueden compartir).
+_PREDICTORES_WORKER = {}
+_EXPLICADORES_WORKER = {}
+_RASTERS_WORKER = {}
+_CUBOS_WORKER = {}
+_ALINEADOS_WORKER = {}
+
+
+def _cargar_predictor(ruta, ruta_compilado, n_jobs=1):
+    if USAR_MODELO_COMPILADO:
+        compilado = modelo_compilado.cargar(ruta_compilado)
+        validar_variables(compilado['nombres'])
+        if modelo_compilado.numba is not None and n_jobs > 0:
+            modelo_compilado.numba.set_num_threads(n_jobs)
+        return lambda X: modelo_compilado.predecir(compilado, X)
+
+    if ruta.endswith('.ubj'):
+        # Versión del registro: booster nativo de XGBoost, sin unpickling ni el wrapper de sklearn
+        booster = xgb.Booster(model_file=ruta)
+        booster.set_param({'nthread': n_jobs})
+        return preparar_predictor(booster)
+
+    modelo = joblib.load(ruta)
+    # Un hilo por proceso: el paralelismo lo pone el pool (evita sobre-suscripción)
+    try:
+        modelo.set_params(n_jobs=n_jobs)
+    except (AttributeError, ValueError):
+        pass
+    return preparar_predictor(modelo)
+
+
+def _cargar_explicador(ruta, n_jobs=1):
+    # SHAP necesita el booster aunque se prediga con el modelo compilado
+    if ruta.endswith('.ubj'):
+        booster = xgb.Booster(model_file=ruta)
+    else:
+        modelo = joblib.load(ruta)
+        if not hasattr(modelo, 'get_booster'):
+            raise ValueError("UMBRAL_EXPLICACION requiere un modelo XGBoost (TreeSHAP del booster).")
+        booster = modelo.get_booster()
+    booster.set_param({'nthread': n_jobs})
+    return preparar_explicador(booster)
+
+
+def _inicializar_worker(modelos, n_jobs=1):
+    """Carga cada modelo usado en la corrida: {clave: (ruta, ruta_compilado)}."""
+    _PREDICTORES_WORKER.clear()
+    _EXPLICADORES_WORKER.clear()
+    for clave, (ruta, ruta_compilado) in modelos.items():
+        _PREDICTORES_WORKER[clave] = _cargar_predictor(ruta, ruta_compilado, n_jobs)
+        if UMBRAL_EXPLICACION is not None:
+            _EXPLICADORES_WORKER[clave] = _cargar_explicador(ruta, n_jobs)
+
+
+def _abrir_en_worker(ruta):
+    if ruta is None:
+        return None
+    if ruta not in _RASTERS_WORKER:
+        _RASTERS_WORKER[ruta] = rasterio.open(ruta)
+    return _RASTERS_WORKER[ruta]
+
+
+def _procesar_ventana_worker(tarea):
+    year, clave_modelo, ruta_stack, ruta_mask_alineada, ruta_cubo, (col, fila, ancho, alto) = tarea
+    ventana = Window(col, fila, ancho, alto)
+    predictor = _PREDICTORES_WORKER[clave_modelo]
+    explicador = _EXPLICADORES_WORKER.get(clave_modelo)
+
+    if ruta_cubo is not None:
+        if ruta_cubo not in _CUBOS_WORKER:
+            _CUBOS_WORKER[ruta_cubo] = cubo_caracteristicas.abrir(ruta_cubo)
+        mapa_tile, explicacion, estadisticas = procesar_tile_cubo(
+            predictor, _CUBOS_WORKER[ruta_cubo], ventana, explicador)
+        return year, (col, fila, ancho, alto), mapa_tile, explicacion, estadisticas
+
+    src = _abrir_en_worker(ruta_stack)
+    mascara_alineada = None
+    if ruta_mask_alineada is not None:
+        if ruta_mask_alineada not in _ALINEADOS_WORKER:
+            _ALINEADOS_WORKER[ruta_mask_alineada] = cache_alineado.cargar(ruta_mask_alineada)
+        mascara_alineada = _ALINEADOS_WORKER[ruta_mask_alineada]
+    mapa_tile, explicacion, estadisticas = procesar_ventana(predictor, src, mascara_alineada, ventana, explicador)
+    return year, (col, fila, ancho, alto), mapa_tile, explicacion, estadisticas
+
+
+# ==============================================================================
+# 4. PROCESAMIENTO
+# ==============================================================================
+def modelo_de_anio(year):
+    """Modelo con que se predice `year`: versión del registro o, si no hay, el .pkl."""
+    if USAR_REGISTRO:
+        manifiesto = registro_modelos.seleccionar(year, VERSION_MODELO)
+        if manifiesto is not None:
+            return {'clave': manifiesto['version'], 'ruta': registro_modelos.ruta_modelo(manifiesto),
+                    'compilado': registro_modelos.ruta_compilado(manifiesto), 'manifiesto': manifiesto}
+    return {'clave': 'pkl', 'ruta': ruta_modelo, 'compilado': ruta_modelo_compilado, 'manifiesto': None}
+
+
+def preparar_anio(year):
+    """Valida las entradas de un año y calcula su metadata de salida y sus ventanas."""
+    rutas = rutas_anio(year)
+
+    if not os.path.exists(rutas['stack']):
+        print(f"❌ ERROR ({year}): No se encuentra el Stack Tiff: {rutas['stack']}")
+        return None
+
+    if not os.path.exists(rutas['mascara']):
+        print(f"⚠️ ALERTA ({year}): No se encontró la máscara en: {rutas['mascara']}")
+        print("   -> El mapa se guardará sin limpiar los ríos (puede haber falsos positivos).")
+        rutas['mascara'] = None
+
+    with rasterio.open(rutas['stack']) as src:
+        # Verificación de seguridad
+        if src.count != len(nombres_bandas):
+            print(f"❌ ERROR ({year}): El Tiff tiene {src.count} bandas, pero se definieron {len(nombres_bandas)} nombres.")
+            return None
+
+        # Orden de bandas contra el manifiesto del modelo, antes de leer píxeles
+        # (nombres del GeoTIFF si los trae; si no, los definidos arriba)
+        try:
+            modelo = modelo_de_anio(year)
+        except ValueError as e:
+            print(f"❌ ERROR ({year}): {e}")
+            return None
+        if modelo['manifiesto'] is not None:
+            nombres = registro_modelos.nombres_stack(src.descriptions, year) or nombres_bandas
+            try:
+                registro_modelos.validar_orden(modelo['manifiesto'], nombres)
+            except ValueError as e:
+                print(f"❌ ERROR ({year}): {e}")
+                return None
+            m = modelo['manifiesto']
+            auc = f"{m['auc']:.4f}" if m['auc'] is not None else '-'
+            print(f"   ({year}) Modelo {m['version']} del registro (años {m['years']}, AUC {auc})")
+
+        # Actualizar metadata para 1 sola banda float
+        # (se conserva el tileado del stack para escribir ventana por ventana)
+        meta = src.profile.copy()
+        meta.update({
+            'count': 1,
+            'dtype': 'float32',
+            'nodata': NODATA_SALIDA
+        })
+        ventanas = list(ventanas_por_bloques(src, PRESUPUESTO_TILE_MB))
+
+        # Cubo memory-mapped: solo si fue generado con estos mismos stack y máscara
+        usar_cubo = USAR_CUBO and cubo_caracteristicas.cubo_vigente(
+            rutas['cubo'], rutas['stack'], rutas['mascara'], UMBRAL_COBERTURA)
+        rutas['mascara_alineada'] = None
+        if usar_cubo:
+            meta_cubo = cubo_caracteristicas.abrir(rutas['cubo'])['meta']
+            ventanas = cubo_caracteristicas.ventanas_cubo(meta_cubo)
+            print(f"   ({year}) Usando cubo pre-tileado: {rutas['cubo']}")
+        else:
+            if USAR_CUBO:
+                print(f"   ({year}) Sin cubo al día (ejecuta cubo_caracteristicas.py para acelerar las próximas corridas).")
+            rutas['cubo'] = None
+
+            if rutas['mascara'] is not None and UMBRAL_COBERTURA is not None:
+                # Nivel de cobertura a la resolución del stack (sin tocar la máscara de 10m)
+                rutas['mascara_alineada'] = piramide_mascara.cobertura_alineada(
+                    rutas['mascara'], src.transform, (src.height, src.width), src.crs)
+                if rutas['mascara_alineada'] is None:
+                    print(f"⚠️ ALERTA ({year}): No hay nivel de cobertura a {abs(src.transform.a):g}m "
+                          f"(o es anterior a la máscara); se usa la máscara con nearest.")
+
+            if rutas['mascara'] is not None and rutas['mascara_alineada'] is None:
+                # Reproyectar/Remuestrear la máscara (de 10m a 20m) a la grilla del stack,
+                # o reutilizarla de la caché si ya se alineó antes a esta misma grilla
+                rutas['mascara_alineada'] = cache_alineado.obtener_alineado(
+                    rutas['mascara'], src.transform, (src.height, src.width), src.crs,
+                    resampling=Resampling.nearest # Nearest conserva los valores 0 y 1 puros
+                )
+
+    estadisticas = dict.fromkeys(['pixeles', 'predichos', 'nulos', 'excluidos', 't_prediccion', 'explicados'], 0)
+    return {'year': year, 'rutas': rutas, 'meta': meta, 'ventanas': ventanas,
+            'modelo': modelo, 'estadisticas': estadisticas}
+
+
+def abrir_explicaciones(t):
+    """Abre (para escribir) los rasters de contribuciones y de variable dominante de un año."""
+    perfil_contribuciones = {**t['meta'], 'count': len(nombres_bandas)}
+    perfil_dominante = {**t['meta'], 'dtype': 'uint8', 'nodata': 0}
+    perfil_dominante.pop('predictor', None)  # El predictor de punto flotante no aplica a enteros
+
+    contribuciones = rasterio.open(t['rutas']['contribuciones'], 'w', **perfil_contribuciones)
+    dominante = rasterio.open(t['rutas']['dominante'], 'w', **perfil_dominante)
+    for b, nombre in enumerate(nombres_bandas, start=1):
+        contribuciones.set_band_description(b, nombre)
+    dominante.set_band_description(1, 'variable_dominante')
+    # Leyenda de los códigos (1..9 -> variable) en los metadatos del GeoTIFF
+    dominante.update_tags(**{str(b): nombre for b, nombre in enumerate(nombres_bandas, start=1)},
+                          umbral_explicacion=str(UMBRAL_EXPLICACION))
+    return contribuciones, dominante
+
+
+def _tareas(trabajos):
+    """Lista plana (año, modelo, ventana) en orden: el pool la reparte entre los procesos."""
+    for t in trabajos:
+        for v in t['ventanas']:
+            yield (t['year'], t['modelo']['clave'],
+                   t['rutas']['stack'], t['rutas']['mascara_alineada'], t['rutas']['cubo'],
+                   (v.col_off, v.row_off, v.width, v.height))
+
+
+def _en_orden_acotado(pool, funcion, tareas, max_en_curso):
+    """Como pool.imap (resultados en orden), con a lo sumo `max_en_curso` tiles pedidos a la vez.
+
+    imap encola todas las tareas de entrada de golpe y acumula los tiles
+    terminados mientras el proceso principal escribe; aquí se lanza un tile
+    nuevo solo cuando se entrega el más antiguo.
+    """
+    pendientes = deque()
+    for tarea in tareas:
+        pendientes.append(pool.apply_async(funcion, (tarea,)))
+        if len(pendientes) >= max_en_curso:
+            yield pendientes.popleft().get()
+    while pendientes:
+        yield pendientes.popleft().get()
+
+
+def generar_mapas(years, n_procesos=N_PROCESOS):
+    print(f"🌍 Generando Mapas de Susceptibilidad para: {', '.join(map(str, years))}")
+    t_inicio = time.perf_counter()
+
+    # --- PASO 1: PREPARAR CADA AÑO (modelo + validación + ventanas) ---
+    print("1. Revisando stacks de cada año...")
+    trabajos = []
+    for y in years:
+        with instrumentacion.etapa('preparar', y):
+            t = preparar_anio(y)
+        if t is not None:
+            trabajos.append(t)
+    if not trabajos:
+        return
+
+    # --- PASO 2: VERIFICAR MODELOS ---
+    modelos = {t['modelo']['clave']: (t['modelo']['ruta'], t['modelo']['compilado']) for t in trabajos}
+    for ruta, ruta_compilado in modelos.values():
+        if not os.path.exists(ruta):
+            print(f"❌ ERROR: No se encuentra el modelo: {ruta}")
+            return
+        if USAR_MODELO_COMPILADO and (ruta_compilado is None or not os.path.exists(ruta_compilado)):
+            print(f"❌ ERROR: No se encuentra el modelo compilado: {ruta_compilado or ruta}")
+            print("   -> Ejecuta 7_generar_modelo.py o modelo_compilado.py para exportarlo.")
+            return
+
+    # Validar el orden de variables antes de lanzar procesos (una sola vez)
+    print("2. Cargando cerebro digital (Modelo XGBoost)...")
+    try:
+        with instrumentacion.etapa('cargar_modelos', entrada=len(modelos)):
+            _inicializar_worker(modelos, n_jobs=-1)
+    except ValueError as e:
+        print(f"❌ ERROR: {e}")
+        return
+    total_tiles = sum(len(t['ventanas']) for t in trabajos)
+    por_anio = {t['year']: t for t in trabajos}
+
+    # Crear carpetas de salida si no existen
+    for t in trabajos:
+        os.makedirs(os.path.dirname(t['rutas']['salida']), exist_ok=True)
+
+    print(f"3. Prediciendo {total_tiles} tiles "
+          f"(presupuesto: {PRESUPUESTO_TILE_MB} MB por tile, procesos: {n_procesos})")
+
+    instrumentacion.seccion('predecir_y_escribir', entrada=total_tiles, unidad='tiles')
+    salidas = {}
+    explicaciones = {}
+    try:
+        # Un archivo de salida abierto por año; las ventanas se escriben en orden
+        for t in trabajos:
+            salidas[t['year']] = rasterio.open(t['rutas']['salida'], 'w', **t['meta'])
+            if UMBRAL_EXPLICACION is not None:
+                explicaciones[t['year']] = abrir_explicaciones(t)
+
+        if n_procesos <= 1:
+            # El proceso principal ya tiene el predictor cargado
+            resultados = map(_procesar_ventana_worker, _tareas(trabajos))
+            pool = None
+        else:
+            pool = multiprocessing.Pool(n_procesos, initializer=_inicializar_worker,
+                                        initargs=(modelos, 1))
+            # En orden, sin acumular más tiles en memoria que los que el pool puede atender
+            resultados = _en_orden_acotado(pool, _procesar_ventana_worker, _tareas(trabajos), 2 * n_procesos)
+
+        try:
+            for i, (year, v, mapa_tile, explicacion, estadisticas) in enumerate(resultados, start=1):
+                salidas[year].write(mapa_tile, 1, window=Window(*v))
+                if explicacion is not None:
+                    explicaciones[year][0].write(explicacion[0], window=Window(*v))
+                    explicaciones[year][1].write(explicacion[1], 1, window=Window(*v))
+                for clave, valor in estadisticas.items():
+                    por_anio[year]['estadisticas'][clave] += valor
+
+                if i % 50 == 0 or i == total_tiles:
+                    print(f"   -> Tile {i}/{total_tiles} escrito")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    finally:
+        for dst in salidas.values():
+            dst.close()
+        for contribuciones, dominante in explicaciones.values():
+            contribuciones.close()
+            dominante.close()
+
+    instrumentacion.seccion(None)
+    t_total = time.perf_counter() - t_inicio
+    print("\n" + "="*50)
+    for t in trabajos:
+        est = t['estadisticas']
+        # Tiempo de predicción sumado en los workers (la memoria de cada worker no se mide)
+        instrumentacion.registrar('prediccion_workers', t['year'], segundos=est['t_prediccion'],
+                                  entrada=est['predichos'], unidad='pixeles', tiles=len(t['ventanas']),
+                                  **{k: v for k, v in est.items() if k != 't_prediccion'})
+        if est['predichos'] == 0:
+            print(f"⚠️ ADVERTENCIA ({t['year']}): La imagen parece estar vacía o llena de nulos.")
+        print(f"✅ ¡ÉXITO! Mapa de Susceptibilidad {t['year']} generado.")
+        print(f"📂 Archivo: {t['rutas']['salida']}")
+        omitidos = est['nulos'] + est['excluidos']
+        print(f"   Píxeles totales:   {est['pixeles']}")
+        print(f"   Predichos:         {est['predichos']}")
+        print(f"   Omitidos:          {omitidos} "
+              f"({100 * omitidos / max(est['pixeles'], 1):.1f}%) -> "
+              f"{est['nulos']} NoData/nulos + {est['excluidos']} Ríos/Casas (máscara)")
+        print(f"   Tiempo predicción: {est['t_prediccion']:.1f} s "
+              f"({est['predichos'] / max(est['t_prediccion'], 1e-9):,.0f} px/s por proceso)")
+        if UMBRAL_EXPLICACION is not None:
+            print(f"   Explicados (SHAP): {est['explicados']} píxeles con probabilidad >= {UMBRAL_EXPLICACION}")
+            print(f"   📂 {t['rutas']['contribuciones']}")
+            print(f"   📂 {t['rutas']['dominante']}")
+
+    total_predichos = sum(t['estadisticas']['predichos'] for t in trabajos)
+    print(f"⏱️ Tiempo total: {t_total:.1f} s | Píxeles predichos: {total_predichos} "
+          f"({total_predichos / max(t_total, 1e-9):,.0f} px/s)")
+    print("="*50)
+
+
+if __name__ == "__main__":
+    anios = list(YEARS) if YEARS is not None else [YEAR]
+    instrumentacion.iniciar('8_mapa', anios)
+    generar_mapas(anios)
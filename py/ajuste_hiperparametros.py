@@ -0,0 +1,254 @@
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import GroupShuffleSplit, ParameterGrid, ParameterSampler, StratifiedGroupKFold
+import almacen_caracteristicas
+from almacen_caracteristicas import VARIABLES
+
+# ==============================================================================
+# VALIDACIÓN CRUZADA POR BLOQUES ESPACIALES + BÚSQUEDA DE HIPERPARÁMETROS
+# ==============================================================================
+# 5, 6 y 7 evaluaban con un train_test_split aleatorio: puntos separados por
+# 250 m caen unos en entrenamiento y otros en prueba, y el AUC sale optimista
+# (el modelo "reconoce" el lugar, no el patrón). Aquí:
+#   - Los puntos se agrupan en bloques de TAM_BLOQUE_GRADOS x TAM_BLOQUE_GRADOS
+#     (lat/lon) y un bloque entero cae siempre del mismo lado de la división.
+#   - La búsqueda evalúa cada combinación de ESPACIO_XGB / ESPACIO_RF con
+#     N_PLIEGUES pliegues espaciales, en un pool de procesos.
+#   - XGBoost usa parada temprana (el número de árboles sale de la búsqueda) y
+#     cada proceso discretiza los datos de cada pliegue UNA sola vez
+#     (QuantileDMatrix en caché), no en cada combinación.
+# El resultado se guarda en un JSON que 5, 6 y 7 leen al construir el modelo.
+
+# ================= CONFIGURACIÓN =================
+YEAR = 2020     # <--- CAMBIA EL AÑO AQUÍ
+YEARS = None    # Varios años juntos (ej: range(2020, 2023)). None = solo YEAR.
+MODELO = 'xgb'  # 'xgb' (6 y 7) o 'rf' (5)
+
+TAM_BLOQUE_GRADOS = 0.05  # ~5.5 km de lado: los puntos vecinos quedan en el mismo bloque
+N_PLIEGUES = 5
+SEMILLA = 42
+
+N_PROCESOS = os.cpu_count() or 1  # 1 = secuencial, en este mismo proceso
+N_CANDIDATOS = None               # None = grilla completa; un número = muestra aleatoria de la grilla
+
+RONDAS_MAX = 1000       # Tope de árboles de XGBoost
+PARADA_TEMPRANA = 50    # Rondas sin mejorar el AUC del pliegue antes de cortar
+MAX_BIN = 256
+
+# Parámetros fijos de XGBoost (los de 6/7), los del espacio se suman encima
+BASE_XGB = {
+    'objective': 'binary:logistic',
+    'eval_metric': 'auc',
+    'tree_method': 'hist',
+    'max_bin': MAX_BIN,
+    'seed': 42,
+}
+ESPACIO_XGB = {
+    'learning_rate': [0.05, 0.1],
+    'max_depth': [3, 5, 7],
+    'subsample': [0.8, 1.0],
+    'colsample_bytree': [0.8, 1.0],
+    'min_child_weight': [1, 5],
+}
+ESPACIO_RF = {
+    'n_estimators': [100, 300],
+    'max_depth': [None, 10, 20],
+    'min_samples_leaf': [1, 5],
+    'max_features': ['sqrt', 0.5],
+}
+
+
+def ruta_parametros(modelo, years):
+    years = sorted(set(years))
+    etiqueta = str(years[0]) if len(years) == 1 else f"{years[0]}-{years[-1]}"
+    return fr'D:\SIG\modelos\Hiperparametros_{modelo}_{etiqueta}.json'
+# =================================================
+
+# Estado de cada proceso del pool (se carga una vez en _inicializar_worker)
+_DATOS_WORKER = {}
+
+
+def bloques(df, tam_grados=TAM_BLOQUE_GRADOS):
+    """Bloque espacial de cada fila (necesita las columnas lat / lon)."""
+    return almacen_caracteristicas.bloque_espacial(df['lat'], df['lon'], tam_grados)
+
+
+def division_espacial(grupos, fraccion_prueba=0.3, semilla=SEMILLA):
+    """(índices de entrenamiento, índices de prueba) con bloques enteros de cada lado."""
+    division = GroupShuffleSplit(n_splits=1, test_size=fraccion_prueba, random_state=semilla)
+    return next(division.split(np.zeros(len(grupos)), groups=grupos))
+
+
+def pliegues_espaciales(grupos, y, n_pliegues=N_PLIEGUES, semilla=SEMILLA):
+    """Lista de (entrenamiento, validación) con bloques enteros y clases parejas por pliegue."""
+    validacion = StratifiedGroupKFold(n_splits=n_pliegues, shuffle=True, random_state=semilla)
+    return list(validacion.split(np.zeros(len(grupos)), np.asarray(y), groups=grupos))
+
+
+def candidatos(espacio, n_candidatos=N_CANDIDATOS, semilla=SEMILLA):
+    """Combinaciones a evaluar: la grilla completa o n_candidatos de ella al azar."""
+    if n_candidatos is None:
+        return list(ParameterGrid(espacio))
+    return list(ParameterSampler(espacio, n_iter=n_candidatos, random_state=semilla))
+
+
+def _inicializar_worker(X, y, pliegues, n_hilos):
+    _DATOS_WORKER.clear()
+    _DATOS_WORKER.update(X=X, y=y, pliegues=pliegues, n_hilos=n_hilos, matrices={})
+
+
+def _matrices_pliegue(i):
+    """(dtrain, dval) del pliegue i, discretizados la primera vez que se piden."""
+    cache = _DATOS_WORKER['matrices']
+    if i not in cache:
+        X, y = _DATOS_WORKER['X'], _DATOS_WORKER['y']
+        entrenamiento, validacion = _DATOS_WORKER['pliegues'][i]
+        dtrain = xgb.QuantileDMatrix(X[entrenamiento], y[entrenamiento], max_bin=MAX_BIN,
+                                     nthread=_DATOS_WORKER['n_hilos'])
+        # Mismos cortes que el entrenamiento (ref)
+        dval = xgb.QuantileDMatrix(X[validacion], y[validacion], ref=dtrain,
+                                   nthread=_DATOS_WORKER['n_hilos'])
+        cache[i] = (dtrain, dval)
+    return cache[i]
+
+
+def _evaluar_xgb(parametros):
+    aucs, rondas = [], []
+    for i in range(len(_DATOS_WORKER['pliegues'])):
+        dtrain, dval = _matrices_pliegue(i)
+        booster = xgb.train({**BASE_XGB, **parametros, 'nthread': _DATOS_WORKER['n_hilos']}, dtrain,
+                            num_boost_round=RONDAS_MAX, evals=[(dval, 'val')],
+                            early_stopping_rounds=PARADA_TEMPRANA, verbose_eval=False)
+        aucs.append(booster.best_score)
+        rondas.append(booster.best_iteration + 1)
+    return aucs, rondas
+
+
+def _evaluar_rf(parametros):
+    X, y = _DATOS_WORKER['X'], _DATOS_WORKER['y']
+    aucs = []
+    for entrenamiento, validacion in _DATOS_WORKER['pliegues']:
+        modelo = RandomForestClassifier(**parametros, random_state=42, n_jobs=_DATOS_WORKER['n_hilos'])
+        modelo.fit(X[entrenamiento], y[entrenamiento])
+        aucs.append(roc_auc_score(y[validacion], modelo.predict_proba(X[validacion])[:, 1]))
+    return aucs, None
+
+
+def _evaluar_candidato(tarea):
+    i, modelo, parametros = tarea
+    t0 = time.perf_counter()
+    aucs, rondas = (_evaluar_xgb if modelo == 'xgb' else _evaluar_rf)(parametros)
+    if rondas is not None:
+        # Árboles para el modelo final: promedio del mejor corte de cada pliegue
+        parametros = {**parametros, 'n_estimators': int(round(np.mean(rondas)))}
+    return {'candidato': i, **parametros,
+            'auc_medio': float(np.mean(aucs)), 'auc_std': float(np.std(aucs)),
+            'segundos': time.perf_counter() - t0, 'parametros': parametros}
+
+
+def buscar(X, y, grupos, modelo=MODELO, espacio=None, n_candidatos=N_CANDIDATOS,
+           n_pliegues=N_PLIEGUES, n_procesos=N_PROCESOS, semilla=SEMILLA):
+    """Evalúa cada combinación con validación cruzada espacial. DataFrame de mejor a peor AUC."""
+    if modelo not in ('xgb', 'rf'):
+        raise ValueError(f"MODELO desconocido: {modelo!r} (use 'xgb' o 'rf')")
+    if espacio is None:
+        espacio = ESPACIO_XGB if modelo == 'xgb' else ESPACIO_RF
+
+    X = np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+    y = np.asarray(y)
+    pliegues = pliegues_espaciales(grupos, y, n_pliegues, semilla)
+    tareas = [(i, modelo, p) for i, p in enumerate(candidatos(espacio, n_candidatos, semilla))]
+    n_procesos = max(1, min(n_procesos, len(tareas)))
+    # Hilos por proceso: el paralelismo lo pone el pool (evita sobre-suscripción)
+    n_hilos = max(1, (os.cpu_count() or 1) // n_procesos)
+
+    resultados = []
+    if n_procesos == 1:
+        _inicializar_worker(X, y, pliegues, n_hilos)
+        iterador = map(_evaluar_candidato, tareas)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(n_procesos, initializer=_inicializar_worker,
+                                    initargs=(X, y, pliegues, n_hilos))
+        iterador = pool.imap_unordered(_evaluar_candidato, tareas)
+    try:
+        for k, resultado in enumerate(iterador, start=1):
+            resultados.append(resultado)
+            print(f"   -> {k}/{len(tareas)} combinaciones (AUC {resultado['auc_medio']:.4f})")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return (pd.DataFrame(resultados)
+            .sort_values(['auc_medio', 'candidato'], ascending=[False, True], ignore_index=True))
+
+
+def mejores_parametros(resultados):
+    """Hiperparámetros de la mejor combinación, listos para XGBClassifier / RandomForestClassifier."""
+    return dict(resultados['parametros'].iloc[0])
+
+
+def guardar_parametros(parametros, modelo, years, resultados):
+    ruta = ruta_parametros(modelo, years)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump({
+            'modelo': modelo,
+            'years': sorted(set(years)),
+            'parametros': parametros,
+            'auc_cv': float(resultados['auc_medio'].iloc[0]),
+            'auc_std': float(resultados['auc_std'].iloc[0]),
+            'tam_bloque_grados': TAM_BLOQUE_GRADOS,
+            'n_pliegues': N_PLIEGUES,
+        }, f, indent=2)
+    return ruta
+
+
+def cargar_parametros(modelo, years):
+    """Hiperparámetros guardados por la búsqueda para (modelo, años), o None si no hay."""
+    ruta = ruta_parametros(modelo, years)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding='utf-8') as f:
+        return json.load(f)['parametros']
+
+
+def archivo_anio(year):
+    return fr'D:\SIG\csv\{year}\Dataset_{year}_BALANCEADO_FINAL.csv'
+
+
+if __name__ == "__main__":
+    years = sorted(set(YEARS)) if YEARS is not None else [YEAR]
+    print(f"🔎 Búsqueda de hiperparámetros ({MODELO}) - Años: {', '.join(map(str, years))}")
+
+    for year in years:
+        if not almacen_caracteristicas.disponible('balanceado', year):
+            if not os.path.exists(archivo_anio(year)):
+                print(f"❌ ERROR: No se encuentra el archivo: {archivo_anio(year)}")
+                exit()
+            almacen_caracteristicas.ingestar_csv(archivo_anio(year), 'balanceado', year)
+
+    df = almacen_caracteristicas.cargar('balanceado', years, columnas=VARIABLES + ['class', 'lat', 'lon'])
+    grupos = bloques(df)
+    print(f"   {len(df)} puntos en {len(np.unique(grupos))} bloques de {TAM_BLOQUE_GRADOS}° "
+          f"| {N_PLIEGUES} pliegues | procesos: {N_PROCESOS}")
+
+    t0 = time.perf_counter()
+    resultados = buscar(df[VARIABLES], df['class'], grupos, MODELO)
+    parametros = mejores_parametros(resultados)
+    ruta = guardar_parametros(parametros, MODELO, years, resultados)
+
+    print("\n" + "="*50)
+    print(f"🏆 Mejores combinaciones (AUC validación espacial, {time.perf_counter() - t0:.1f} s):")
+    print(resultados.drop(columns=['candidato', 'parametros']).head(5).to_string(index=False))
+    print("="*50)
+    print(f"💾 Hiperparámetros guardados en: {ruta}")
+    print("   -> 5, 6 y 7 los usan automáticamente (USAR_HIPERPARAMETROS_AJUSTADOS).")
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+# ==============================================================================
+# ALMACÉN DE VARIABLES (Parquet particionado por año y clase)
+# ==============================================================================
+# Los CSV exportados de GEE (Dataset_Completo_{YEAR}.csv) y el balanceado se
+# volvían a parsear como texto en 4, 5, 6 y 7, y cada script renombraba y
+# borraba las mismas columnas. Aquí se ingestan UNA vez a Parquet con un
+# esquema normalizado:
+#   - dist_vias_2020 -> dist_vias (igual para dist_water / dist_built)
+#   - fecha_txt -> fecha (tipo date)
+#   - year / class como particiones: <almacén>/<dataset>/year=2020/class=1/...
+#   - fila: posición en el CSV original (se conserva el orden al cargar, así
+#     los muestreos y divisiones con semilla dan lo mismo que con el CSV)
+# Los scripts cargan solo las columnas que usan (proyección) y los años que piden.
+#
+# Cada partición year=Y se escribe aparte (carpeta con prefijo '_', que pyarrow
+# ignora) y se cambia por la anterior con un rename: quien la lea nunca ve una a
+# medias. La firma del CSV de origen va en un archivo por año (_firmas/<year>.json),
+# así dos años pueden ingestarse a la vez sin pisarse. Solo el dueño de cada
+# dataset lo reescribe (4_dataset_balanceado_final.py: completo y balanceado); los
+# lectores (5, 6, 7) ingestan un año solo si todavía no está.
+
+# ================= CONFIGURACIÓN =================
+CARPETA_ALMACEN = r'D:\SIG\almacen'
+
+# Variables predictoras, en el orden del stack de 8_generar_mapa.py
+VARIABLES = [
+    'elev', 'slope', 'aspect',
+    'dist_vias', 'dist_water', 'dist_built',
+    'precip_60d', 'temp_mean', 'ndvi_mean'
+]
+# =================================================
+
+# Variables que GEE exporta con el año como sufijo (dist_vias_2020)
+_CON_SUFIJO = ('dist_vias', 'dist_water', 'dist_built')
+
+_PARTICIONES = ds.partitioning(pa.schema([('year', pa.int16()), ('class', pa.int8())]), flavor='hive')
+
+
+def ruta_dataset(nombre):
+    return os.path.join(CARPETA_ALMACEN, nombre)
+
+
+def firma(ruta):
+    """Identifica la versión de un CSV de origen (si cambia, se vuelve a ingestar)."""
+    info = os.stat(ruta)
+    return {'ruta': os.path.abspath(ruta), 'tamano': info.st_size, 'mtime': info.st_mtime}
+
+
+def _ruta_firma(nombre, year):
+    # El prefijo '_' hace que pyarrow lo ignore al leer el dataset
+    return os.path.join(ruta_dataset(nombre), '_firmas', f'{year}.json')
+
+
+def _leer_firma(nombre, year):
+    ruta = _ruta_firma(nombre, year)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _guardar_firma(nombre, year, origen):
+    ruta = _ruta_firma(nombre, year)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(origen, f, indent=2)
+    os.replace(temporal, ruta)
+
+
+def normalizar(df, year):
+    """Esquema común: nombres sin año y fecha tipada. Devuelve un DataFrame nuevo."""
+    df = df.rename(columns={f'{v}_{year}': v for v in _CON_SUFIJO})
+    if 'fecha_txt' in df.columns:
+        # Misma posición que la columna de texto original
+        df.insert(df.columns.get_loc('fecha_txt'), 'fecha',
+                  pd.to_datetime(df['fecha_txt'], errors='coerce').dt.date)
+        df = df.drop(columns=['fecha_txt'])
+    df['year'] = year
+    return df
+
+
+def escribir(df, nombre, year, origen=None):
+    """Reemplaza la partición de `year` del dataset `nombre` con el DataFrame (ya normalizado).
+
+    El orden de las filas se guarda en la columna `fila` y se respeta al cargar.
+    La partición nueva se escribe aparte y reemplaza a la anterior con renames.
+    """
+    carpeta = ruta_dataset(nombre)
+    particion = os.path.join(carpeta, f'year={year}')
+    temporal = os.path.join(carpeta, f'_nueva_{year}_{os.getpid()}')
+    if os.path.exists(temporal):
+        shutil.rmtree(temporal)
+    os.makedirs(temporal)
+
+    tabla = pa.Table.from_pandas(df.assign(year=year, fila=range(len(df))), preserve_index=False)
+    tabla = tabla.set_column(tabla.schema.get_field_index('year'), 'year', tabla['year'].cast(pa.int16()))
+    tabla = tabla.set_column(tabla.schema.get_field_index('class'), 'class', tabla['class'].cast(pa.int8()))
+    ds.write_dataset(tabla, temporal, format='parquet', partitioning=_PARTICIONES,
+                     basename_template='parte-{i}.parquet', existing_data_behavior='overwrite_or_ignore')
+
+    # En Windows un rename no pisa una carpeta: la anterior se aparta primero
+    anterior = None
+    if os.path.exists(particion):
+        anterior = os.path.join(carpeta, f'_anterior_{year}_{os.getpid()}')
+        os.rename(particion, anterior)
+    try:
+        os.rename(os.path.join(temporal, f'year={year}'), particion)
+    except OSError:
+        if anterior is not None or not os.path.isdir(particion):
+            raise
+        # Otro proceso ingestó el mismo año primero (desde el mismo CSV): se usa la suya
+    shutil.rmtree(temporal, ignore_errors=True)
+    if anterior is not None:
+        shutil.rmtree(anterior, ignore_errors=True)
+
+    _guardar_firma(nombre, year, origen)
+
+
+def disponible(nombre, year):
+    return os.path.isdir(os.path.join(ruta_dataset(nombre), f'year={year}'))
+
+
+def huella(nombre, years):
+    """sha256 del contenido de las particiones de `years` (cambia si cambia cualquier fila)."""
+    h = hashlib.sha256()
+    for year in sorted(set(years)):
+        particion = os.path.join(ruta_dataset(nombre), f'year={year}')
+        for raiz, _, archivos in sorted(os.walk(particion)):
+            for archivo in sorted(archivos):
+                ruta = os.path.join(raiz, archivo)
+                h.update(os.path.relpath(ruta, ruta_dataset(nombre)).replace(os.sep, '/').encode())
+                with open(ruta, 'rb') as f:
+                    for bloque in iter(lambda: f.read(1 << 20), b''):
+                        h.update(bloque)
+    return h.hexdigest()
+
+
+def ingestar_csv(ruta_csv, nombre, year):
+    """Pasa un CSV de GEE al almacén, solo si no se ingestó antes (o si el CSV cambió).
+
+    Devuelve True si se ingestó ahora, False si ya estaba al día.
+    """
+    actual = firma(ruta_csv)
+    if disponible(nombre, year) and _leer_firma(nombre, year) == actual:
+        return False
+    escribir(normalizar(pd.read_csv(ruta_csv), year), nombre, year, origen=actual)
+    return True
+
+
+def clave_aleatoria(year, fila, semilla):
+    """Número pseudoaleatorio en [0, 1) fijo para cada fila (hash splitmix64 de año + fila).
+
+    No depende del orden ni del tamaño de los lotes en que se recorran las filas.
+    """
+    with np.errstate(over='ignore'):
+        z = (np.asarray(fila, dtype=np.uint64) + np.asarray(year, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+             + np.uint64(semilla))
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / 2.0 ** 53
+
+
+def bloque_espacial(lat, lon, tam_grados):
+    """Id (entero >= 0) de la celda de tam_grados x tam_grados (lat/lon) de cada punto."""
+    fy = np.floor((np.asarray(lat, dtype=np.float64) + 90.0) / tam_grados).astype(np.int64)
+    fx = np.floor((np.asarray(lon, dtype=np.float64) + 180.0) / tam_grados).astype(np.int64)
+    return fy * 10_000_000 + fx
+
+
+def _abrir(nombre):
+    return ds.dataset(ruta_dataset(nombre), format='parquet', partitioning=_PARTICIONES,
+                      filesystem=fs.LocalFileSystem(use_mmap=True))
+
+
+def _todas_las_columnas(dataset):
+    # Con class / year al inicio como en el CSV de GEE
+    return ['class', 'year'] + [c for c in dataset.schema.names if c not in ('class', 'year', 'fila')]
+
+
+def cargar(nombre, years, columnas=None):
+    """Filas de los años pedidos (en el orden original de cada año), solo con `columnas`.
+
+    Los archivos se leen con memory mapping y solo se decodifican las columnas pedidas.
+    """
+    dataset = _abrir(nombre)
+    if columnas is None:
+        columnas = _todas_las_columnas(dataset)
+    pedidas = list(columnas)
+    leer = list(dict.fromkeys(pedidas + ['year', 'fila']))
+
+    tabla = dataset.to_table(columns=leer, filter=ds.field('year').isin(list(years)))
+    tabla = tabla.sort_by([('year', 'ascending'), ('fila', 'ascending')])
+    return tabla.select(pedidas).to_pandas(date_as_object=False)  # fecha -> datetime64
+
+
+def ingestar_si_falta(nombre, year, ruta_csv):
+    """Para los lectores (5, 6, 7): ingesta el año solo si no está en el almacén.
+
+    Nunca reescribe una partición existente (eso le toca al paso que la produce);
+    si el CSV cambió desde la ingesta, solo avisa.
+    """
+    if not disponible(nombre, year):
+        ingestar_csv(ruta_csv, nombre, year)
+    elif os.path.exists(ruta_csv) and _leer_firma(nombre, year) != firma(ruta_csv):
+        print(f"⚠️ {ruta_csv} cambió desde que se ingestó: se usa el almacén "
+              f"(vuelve a correr 4_dataset_balanceado_final.py para actualizarlo).")
+
+
+def cargar_anio(nombre, year, ruta_csv, columnas=None):
+    """Carga un año del almacén; si todavía no está, lo ingesta antes desde su CSV."""
+    ingestar_si_falta(nombre, year, ruta_csv)
+    return cargar(nombre, [year], columnas)
+
+
+def iterar_lotes(nombre, years, columnas=None, tam_lote=262_144):
+    """Recorre los años pedidos por lotes de hasta `tam_lote` filas, sin cargarlos completos.
+
+    Cada lote es un DataFrame con `columnas` (None = todas) + year + fila (para
+    divisiones deterministas por fila). El orden es el de los archivos, no el del CSV.
+    """
+    dataset = _abrir(nombre)
+    if columnas is None:
+        columnas = _todas_las_columnas(dataset)
+    leer = list(dict.fromkeys(list(columnas) + ['year', 'fila']))
+    for lote in dataset.to_batches(columns=leer, filter=ds.field('year').isin(list(years)),
+                                   batch_size=tam_lote):
+        if lote.num_rows:
+            yield lote.to_pandas(date_as_object=False)
@@ -0,0 +1,739 @@
+import glob
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+import shapely
+from pyproj import Transformer
+from rasterio import features, windows
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+import almacen_caracteristicas
+import orquestador
+from almacen_caracteristicas import VARIABLES
+
+# ==============================================================================
+# BENCHMARK DE LOS PASOS 1-8 CON DATOS SINTÉTICOS (escala Leoncio Prado)
+# ==============================================================================
+# Los datos reales están en D:\SIG y en GEE, así que no había forma de saber si
+# un cambio hacía más rápido o más lento el flujo. Aquí:
+#
+#   1. Se generan entradas sintéticas con la forma de las reales, a ESCALA
+#      (fracción del área de la provincia, ~4 800 km² con 1.0), siempre iguales
+#      para la misma SEMILLA:
+#        - AOI (polígono irregular, EPSG:4326)
+#        - CSV de FIRMS con detecciones MODIS y VIIRS (confidence numérica y l/n/h)
+#        - construcciones (rectángulos agrupados en centros poblados)
+#        - cobertura de agua (ríos y lagunas)
+#        - mosaico de quemas: banda 1 = máscara, banda 2 = fecha (días desde 1970)
+#        - stack de 9 variables estandarizadas y máscara de exclusión
+#        - Dataset_Completo y Dataset_BALANCEADO_FINAL (CSV como los de GEE)
+#      Los rasters se escriben por franjas (memoria acotada con ESCALA = 1).
+#   2. Se copia py/ a la carpeta del benchmark cambiando el prefijo D:\SIG de
+#      las rutas por la carpeta de los datos sintéticos (el resto del código es
+#      el mismo que se está midiendo).
+#   3. La copia de orquestador.py corre los pasos de a UNA tarea a la vez
+#      (forzados, con cachés, almacén y modelos vacíos), REPETICIONES veces.
+#   4. De los reportes de instrumentacion.py se toman tiempo, CPU, pico de
+#      memoria y conteos por paso, año y etapa; se guarda la mediana en
+#      <CARPETA_BENCHMARK>/resultados/<fecha>.json (con commit y máquina).
+#   5. Se compara con BASE (por defecto la corrida anterior con la misma escala,
+#      años y pasos) y se marcan las regresiones. Si hay alguna, sale con código 1.
+#
+# La memoria de los procesos de un pool no entra en el pico (ver instrumentacion.py).
+#
+# Uso directo:
+#   python benchmark.py
+
+# ================= CONFIGURACIÓN =================
+ESCALA = 0.1         # Fracción del área real (1.0 = provincia completa; tamaños de abajo x ESCALA)
+YEARS = [2020]       # Años sintéticos (una tarea por paso y año, como en orquestador.py)
+PASOS = (1, 2, 3, 4, 5, 6, 7, 8)
+REPETICIONES = 3     # Corridas por medición (se guarda la mediana)
+SEMILLA = 42         # Mismos datos en cada máquina y en cada corrida
+ETIQUETA = None      # Texto libre para reconocer la corrida (ej: 'sieve por tiles')
+
+CARPETA_BENCHMARK = r'D:\SIG\benchmark'
+RAIZ_DATOS = r'D:\SIG'  # Prefijo de las rutas de los scripts que se cambia por los datos sintéticos
+
+# Comparación
+BASE = None          # None = última corrida comparable; o el nombre de un resultado (ej: '20240301-101500')
+TOLERANCIA = 0.15    # Regresión si la mediana sube más de un 15 %...
+MIN_SEGUNDOS = 0.5   # ...y al menos esto (las etapas muy cortas son ruido)
+MIN_MB = 50          # Ídem para el pico de memoria
+
+# Datos sintéticos a escala 1.0
+CENTRO_UTM = (390_000, 8_975_000)  # Tingo María (UTM 18S)
+LADO_X_KM, LADO_Y_KM = 80, 115     # Rectángulo que contiene a la provincia
+RESOLUCION = 30                    # Metros (mosaico, agua, stack y máscara, como los exportes de GEE)
+N_FIRMS = 250_000                  # Filas del CSV anual (la descarga trae más que la provincia)
+FRACCION_FIRMS_AOI = 0.1           # El resto cae en el resto del Perú
+FRACCION_MODIS = 0.15
+N_QUEMAS = 3000                    # Parches quemados en el mosaico
+FRACCION_QUEMAS_SIN_FECHA = 0.05
+FRACCION_RUIDO = 0.001             # Píxeles sueltos marcados como quema (los quita el sieve)
+N_CONSTRUCCIONES = 40_000
+N_CENTROS_POBLADOS = 25
+N_RIOS = 4
+N_LAGUNAS = 30
+N_COMPLETO = 60_000                # Filas de Dataset_Completo por año
+FRACCION_CLASE_1 = 0.15
+FRACCION_NULOS = 0.01
+
+FILAS_POR_FRANJA = 1024            # Filas de raster generadas a la vez
+# =================================================
+
+VERSION_DATOS = 1  # Subir si cambia la forma de generar los datos (invalida los ya generados)
+
+EPSG_UTM = 32718
+_DESCARGA_PERU = (-81.4, -18.4, -68.6, -0.0)  # lon/lat mín y máx de la descarga de FIRMS
+_NODATA_STACK = -9999.0
+_CON_SUFIJO = ('dist_vias', 'dist_water', 'dist_built')  # GEE las exporta con el año (dist_vias_2020)
+
+_ORQUESTAR = (
+    "import json, sys\n"
+    "import orquestador\n"
+    "a = json.loads(sys.argv[1])\n"
+    "resultados = orquestador.ejecutar(orquestador.tareas(a['years'], None, a['pasos']), n_procesos=1,\n"
+    "                                  forzar=a['pasos'])\n"
+    "with open(a['salida'], 'w', encoding='utf-8') as f:\n"
+    "    json.dump(resultados, f, ensure_ascii=False)\n"
+)
+
+
+# ------------------------------------------------------------------------------
+# Carpetas y rutas
+# ------------------------------------------------------------------------------
+def carpeta_escala(escala=ESCALA):
+    return os.path.join(CARPETA_BENCHMARK, f'escala_{escala:g}')
+
+
+def raiz_sintetica(escala=ESCALA):
+    """Carpeta que reemplaza a RAIZ_DATOS en la copia de los scripts."""
+    return os.path.join(carpeta_escala(escala), 'SIG')
+
+
+def redirigir(ruta, raiz):
+    """Ruta de un script (bajo RAIZ_DATOS) -> la misma ruta bajo `raiz`."""
+    if not ruta.lower().startswith(RAIZ_DATOS.lower()):
+        return ruta
+    return os.path.normpath(raiz + ruta[len(RAIZ_DATOS):].replace('\\', '/'))
+
+
+def espejar_codigo(destino, raiz):
+    """Copia los .py de esta carpeta a `destino` con las rutas r'D:\\SIG...' apuntando a `raiz`."""
+    os.makedirs(destino, exist_ok=True)
+    patron = re.compile(r"""(\b[rR][fF]?|\b[fF][rR])'""" + re.escape(RAIZ_DATOS) + r"""([^']*)'""")
+    nueva_raiz = raiz.replace('\\', '/')
+    fuentes = sorted(glob.glob(os.path.join(orquestador.CARPETA_PY, '*.py')))
+    for ruta in fuentes:
+        with open(ruta, encoding='utf-8') as f:
+            codigo = f.read()
+        codigo = patron.sub(lambda m: f"{m.group(1)}'{nueva_raiz}{m.group(2).replace(chr(92), '/')}'", codigo)
+        with open(os.path.join(destino, os.path.basename(ruta)), 'w', encoding='utf-8') as f:
+            f.write(codigo)
+    # Scripts borrados de py/ desde la última copia
+    nombres = {os.path.basename(r) for r in fuentes}
+    for ruta in glob.glob(os.path.join(destino, '*.py')):
+        if os.path.basename(ruta) not in nombres:
+            os.remove(ruta)
+
+
+def rutas_sinteticas(year, raiz):
+    """rutas_anio de orquestador.py (las mismas de cada script) bajo la raíz sintética."""
+    return {clave: redirigir(ruta, raiz) for clave, ruta in orquestador.rutas_anio(year).items()}
+
+
+# ------------------------------------------------------------------------------
+# Generación de datos sintéticos
+# ------------------------------------------------------------------------------
+def _n(valor, escala):
+    return max(1, int(round(valor * escala)))
+
+
+def grilla(escala=ESCALA):
+    """(transform, alto, ancho) de la grilla común de los rasters sintéticos."""
+    f = np.sqrt(escala)
+    ancho = int(round(LADO_X_KM * 1000 * f / RESOLUCION))
+    alto = int(round(LADO_Y_KM * 1000 * f / RESOLUCION))
+    x0 = CENTRO_UTM[0] - ancho * RESOLUCION / 2
+    y0 = CENTRO_UTM[1] + alto * RESOLUCION / 2
+    return from_origin(x0, y0, RESOLUCION, RESOLUCION), alto, ancho
+
+
+def generar_aoi(escala, rng):
+    """Polígono irregular (UTM) inscrito en la grilla: ~52 % del rectángulo, como la provincia."""
+    transform, alto, ancho = grilla(escala)
+    cx, cy = transform * (ancho / 2, alto / 2)
+    theta = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+    fases = rng.uniform(0, 2 * np.pi, 2)
+    r = 0.85 + 0.08 * np.sin(3 * theta + fases[0]) + 0.05 * np.sin(7 * theta + fases[1])
+    x = cx + 0.48 * ancho * RESOLUCION * r * np.cos(theta)
+    y = cy + 0.48 * alto * RESOLUCION * r * np.sin(theta)
+    return shapely.Polygon(np.column_stack([x, y]))
+
+
+def puntos_en(poligono, n, rng):
+    """n puntos uniformes dentro del polígono (x, y)."""
+    minx, miny, maxx, maxy = poligono.bounds
+    shapely.prepare(poligono)
+    xs, ys = [], []
+    faltan = n
+    while faltan > 0:
+        x = rng.uniform(minx, maxx, 2 * faltan + 64)
+        y = rng.uniform(miny, maxy, 2 * faltan + 64)
+        dentro = shapely.contains_xy(poligono, x, y)
+        xs.append(x[dentro][:faltan])
+        ys.append(y[dentro][:faltan])
+        faltan -= len(xs[-1])
+    return np.concatenate(xs), np.concatenate(ys)
+
+
+def poligonos_irregulares(x, y, radio, rng, vertices=12):
+    """Un polígono estrellado por centro, con radio entre 0.6 y 1 veces `radio`."""
+    theta = np.sort(rng.uniform(0, 2 * np.pi, (len(x), vertices)), axis=1)
+    r = radio[:, None] * rng.uniform(0.6, 1.0, (len(x), vertices))
+    anillo = np.stack([x[:, None] + r * np.cos(theta), y[:, None] + r * np.sin(theta)], axis=-1)
+    return shapely.polygons(np.concatenate([anillo, anillo[:, :1]], axis=1))
+
+
+def fechas_temporada(year, n, rng):
+    """Días desde 1970 de n fechas de `year`, concentradas en la temporada seca (ago-sep)."""
+    inicio = (np.datetime64(f'{year}-01-01') - np.datetime64('1970-01-01')).astype(int)
+    largo = 366 if year % 4 == 0 else 365
+    dia = np.clip(rng.normal(235, 35, n), 0, largo - 1).astype(int)
+    return inicio + dia
+
+
+def generar_quemas(year, aoi, escala):
+    """Parches quemados del año: (polígonos, días desde 1970; 0 = sin fecha)."""
+    rng = np.random.default_rng([SEMILLA, year, 1])
+    n = _n(N_QUEMAS, escala)
+    x, y = puntos_en(aoi, n, rng)
+    # Quema de chacras: la mayoría de unas pocas hectáreas, algunas grandes
+    radio = np.clip(rng.lognormal(np.log(150), 0.7, n), 40, 1500)
+    dias = fechas_temporada(year, n, rng)
+    dias[rng.random(n) < FRACCION_QUEMAS_SIN_FECHA] = 0
+    return poligonos_irregulares(x, y, radio, rng), dias
+
+
+def generar_construcciones(year, aoi, escala):
+    """Rectángulos de 6 a 25 m (UTM): la mayoría alrededor de centros poblados, el resto dispersos."""
+    rng = np.random.default_rng([SEMILLA, year, 2])
+    n = _n(N_CONSTRUCCIONES, escala)
+    n_centros = _n(N_CENTROS_POBLADOS, escala)
+    cx, cy = puntos_en(aoi, n_centros, rng)
+    peso = rng.pareto(1.2, n_centros) + 1  # Un par de pueblos grandes (Tingo María) y muchos chicos
+    centro = rng.choice(n_centros, int(n * 0.8), p=peso / peso.sum())
+    dispersion = 200 + 600 * np.sqrt(peso / peso.max())
+    sueltos_x, sueltos_y = puntos_en(aoi, n - len(centro), rng)
+    x = np.concatenate([cx[centro] + rng.normal(0, 1, len(centro)) * dispersion[centro], sueltos_x])
+    y = np.concatenate([cy[centro] + rng.normal(0, 1, len(centro)) * dispersion[centro], sueltos_y])
+    ancho, largo = rng.uniform(6, 25, (2, n))
+    angulo = rng.uniform(0, np.pi, n)
+    esquinas = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1], [-1, -1]]) / 2
+    dx = esquinas[:, 0] * ancho[:, None]
+    dy = esquinas[:, 1] * largo[:, None]
+    cos, sin = np.cos(angulo)[:, None], np.sin(angulo)[:, None]
+    anillo = np.stack([x[:, None] + dx * cos - dy * sin, y[:, None] + dx * sin + dy * cos], axis=-1)
+    geoms = shapely.polygons(anillo)
+    return gpd.GeoDataFrame({'confidence': np.round(rng.uniform(0.65, 0.95, n), 4),
+                             'area_in_me': np.round(ancho * largo, 2)},
+                            geometry=geoms, crs=EPSG_UTM)
+
+
+def generar_agua(year, aoi, escala):
+    """Ríos (franjas que serpentean de norte a sur, como el Huallaga) y lagunas, en UTM."""
+    rng = np.random.default_rng([SEMILLA, year, 3])
+    minx, miny, maxx, maxy = aoi.bounds
+    geoms = []
+    for _ in range(_n(N_RIOS, np.sqrt(escala))):
+        y = np.arange(maxy + 500, miny - 500, -200.0)
+        x = rng.uniform(minx, maxx) + np.cumsum(rng.normal(0, 60, len(y)))
+        geoms.append(shapely.buffer(shapely.linestrings(x, y), rng.uniform(20, 75)))
+    n = _n(N_LAGUNAS, escala)
+    x, y = puntos_en(aoi, n, rng)
+    geoms.extend(poligonos_irregulares(x, y, rng.uniform(50, 400, n), rng))
+    return np.asarray(geoms, dtype=object)
+
+
+def campos(x, y, year):
+    """Valores estandarizados (media 0, desvío ~1) de las 9 variables en las coordenadas UTM (x, y).
+
+    Suma de ondas con longitudes de 2 a 40 km: varían suave en el espacio y se
+    pueden evaluar en cualquier franja o punto sin guardar nada. Las variables
+    de clima y vegetación cambian con el año.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    salida = {}
+    for k, variable in enumerate(VARIABLES):
+        rng = np.random.default_rng([SEMILLA, k, year if k >= 6 else 0])
+        valor = np.zeros(np.broadcast(x, y).shape, dtype=np.float64)
+        for _ in range(6):
+            longitud = rng.uniform(2_000, 40_000)
+            angulo = rng.uniform(0, np.pi)
+            valor += np.sin(2 * np.pi * (x * np.cos(angulo) + y * np.sin(angulo)) / longitud + rng.uniform(0, 2 * np.pi))
+        salida[variable] = (valor / np.sqrt(3)).astype(np.float32)
+    return salida
+
+
+def escribir_por_franjas(ruta, perfil, generar):
+    """Escribe un GeoTIFF llamando generar(ventana, transform_ventana) -> (bandas, filas, columnas) por franja."""
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with rasterio.open(ruta, 'w', **perfil) as destino:
+        for fila in range(0, perfil['height'], FILAS_POR_FRANJA):
+            ventana = Window(0, fila, perfil['width'], min(FILAS_POR_FRANJA, perfil['height'] - fila))
+            destino.write(generar(ventana, windows.transform(ventana, perfil['transform'])), window=ventana)
+
+
+def _unos(geoms):
+    return np.ones(len(geoms), dtype=np.uint8)
+
+
+def _rasterizar(geoms, valores, ventana, transform, dtype, arbol=None, todos_tocados=False):
+    # Solo las geometrías que tocan la franja
+    if arbol is not None:
+        caja = shapely.box(*windows.bounds(ventana, transform))
+        idx = arbol.query(caja, predicate='intersects')
+        geoms, valores = geoms[idx], valores[idx]
+    salida = np.zeros((ventana.height, ventana.width), dtype=dtype)
+    if len(geoms):
+        features.rasterize(zip(geoms, valores), out=salida, transform=transform, all_touched=todos_tocados)
+    return salida
+
+
+def generar_rasters(year, rutas, aoi, quemas, fechas, construcciones, agua, escala):
+    """Cobertura de agua, mosaico de quemas, máscara de exclusión y stack del año, todos en la misma grilla."""
+    transform, alto, ancho = grilla(escala)
+    base = {'driver': 'GTiff', 'height': alto, 'width': ancho, 'crs': f'EPSG:{EPSG_UTM}', 'transform': transform,
+            'tiled': True, 'blockxsize': 256, 'blockysize': 256}
+    arbol_quemas = shapely.STRtree(quemas)
+    arbol_agua = shapely.STRtree(agua)
+    geoms_constr = np.asarray(construcciones.geometry.values, dtype=object)
+    arbol_constr = shapely.STRtree(geoms_constr)
+    aoi_arr = np.asarray([aoi], dtype=object)
+
+    def dentro_aoi(ventana, t):
+        return _rasterizar(aoi_arr, _unos(aoi_arr), ventana, t, np.uint8).astype(bool)
+
+    def cobertura_agua(ventana, t):
+        return _rasterizar(agua, _unos(agua), ventana, t, np.uint8, arbol_agua)[None]
+
+    def mosaico(ventana, t):
+        idx = _rasterizar(quemas, np.arange(1, len(quemas) + 1), ventana, t, np.int32, arbol_quemas)
+        rng = np.random.default_rng([SEMILLA, year, 4, ventana.row_off])
+        ruido = (rng.random(idx.shape) < FRACCION_RUIDO) & (idx == 0)
+        fecha = np.where(idx > 0, np.concatenate([[0], fechas])[idx], 0)
+        fecha[ruido] = fechas_temporada(year, int(ruido.sum()), rng)
+        mascara = (idx > 0) | ruido
+        fuera = ~dentro_aoi(ventana, t)
+        mascara[fuera] = False
+        fecha[fuera] = 0
+        return np.stack([mascara.astype(np.uint16), fecha.astype(np.uint16)])
+
+    def stack(ventana, t):
+        filas, cols = np.mgrid[0:ventana.height, 0:ventana.width]
+        x, y = t * (cols + 0.5, filas + 0.5)
+        rng = np.random.default_rng([SEMILLA, year, 5, ventana.row_off])
+        valores = campos(x, y, year)
+        datos = np.stack([valores[v] + rng.normal(0, 0.05, x.shape).astype(np.float32) for v in VARIABLES])
+        datos[:, ~dentro_aoi(ventana, t)] = _NODATA_STACK
+        return datos
+
+    def mascara(ventana, t):
+        excluido = _rasterizar(agua, _unos(agua), ventana, t, np.uint8, arbol_agua)
+        excluido |= _rasterizar(geoms_constr, _unos(geoms_constr), ventana, t, np.uint8, arbol_constr,
+                                todos_tocados=True)
+        excluido[~dentro_aoi(ventana, t)] = 0
+        return excluido[None]
+
+    escribir_por_franjas(rutas['agua'], {**base, 'count': 1, 'dtype': 'uint8'}, cobertura_agua)
+    escribir_por_franjas(rutas['mosaico'], {**base, 'count': 2, 'dtype': 'uint16'}, mosaico)
+    escribir_por_franjas(rutas['mascara'], {**base, 'count': 1, 'dtype': 'uint8'}, mascara)
+    escribir_por_franjas(rutas['stack'], {**base, 'count': len(VARIABLES), 'dtype': 'float32',
+                                          'nodata': _NODATA_STACK}, stack)
+    # Nombres de banda como en el exporte de GEE (dist_vias_2020, ...)
+    with rasterio.open(rutas['stack'], 'r+') as destino:
+        for i, variable in enumerate(VARIABLES, start=1):
+            sufijo = f'_{year}' if variable in _CON_SUFIJO else ''
+            destino.set_band_description(i, variable + sufijo)
+
+
+def generar_firms(year, aoi_geo, escala):
+    """CSV anual de FIRMS (columnas del archivo de descarga), MODIS y VIIRS mezclados."""
+    rng = np.random.default_rng([SEMILLA, year, 6])
+    n = _n(N_FIRMS, escala)
+    n_aoi = int(n * FRACCION_FIRMS_AOI)
+    minx, miny, maxx, maxy = aoi_geo.bounds
+    lon = np.concatenate([rng.uniform(minx, maxx, n_aoi), rng.uniform(_DESCARGA_PERU[0], _DESCARGA_PERU[2], n - n_aoi)])
+    lat = np.concatenate([rng.uniform(miny, maxy, n_aoi), rng.uniform(_DESCARGA_PERU[1], _DESCARGA_PERU[3], n - n_aoi)])
+    orden = np.argsort(rng.random(n))
+    modis = rng.random(n) < FRACCION_MODIS
+    confianza = np.where(modis, rng.integers(0, 101, n).astype(str), rng.choice(['l', 'n', 'h'], n, p=[0.1, 0.8, 0.1]))
+    dias = np.sort(fechas_temporada(year, n, rng))
+    return pd.DataFrame({
+        'latitude': np.round(lat[orden], 5), 'longitude': np.round(lon[orden], 5),
+        'brightness': np.round(np.where(modis, rng.uniform(300, 360, n), rng.uniform(295, 367, n)), 2),
+        'scan': np.round(np.where(modis, rng.uniform(1, 4.8, n), rng.uniform(0.32, 0.8, n)), 2),
+        'track': np.round(np.where(modis, rng.uniform(1, 2, n), rng.uniform(0.36, 0.78, n)), 2),
+        'acq_date': (np.datetime64('1970-01-01') + dias.astype('timedelta64[D]')).astype(str),
+        'acq_time': rng.integers(0, 2400, n),
+        'satellite': np.where(modis, rng.choice(['Terra', 'Aqua'], n), rng.choice(['N', '1'], n)),
+        'instrument': np.where(modis, 'MODIS', 'VIIRS'),
+        'confidence': confianza,
+        'version': np.where(modis, '6.1', '2.0NRT'),
+        'bright_t31': np.round(rng.uniform(280, 310, n), 2),
+        'frp': np.round(rng.lognormal(2, 1, n), 2),
+        'daynight': rng.choice(['D', 'N'], n, p=[0.7, 0.3]),
+        'type': 0,
+    })
+
+
+def generar_tablas(year, aoi, quemas, fechas, escala):
+    """(Dataset_Completo, Dataset_BALANCEADO_FINAL) del año, con las columnas del exporte de GEE.
+
+    Clase 1 = puntos dentro de parches quemados; clase 0 = puntos al azar en el AOI.
+    Las variables salen de campos() (las mismas del stack), con un corrimiento en
+    la clase 1 para que el modelo tenga algo que aprender.
+    """
+    rng = np.random.default_rng([SEMILLA, year, 7])
+    n = _n(N_COMPLETO, escala)
+    n1 = max(2, int(n * FRACCION_CLASE_1))
+    centros = shapely.centroid(quemas)
+    radios = np.sqrt(shapely.area(quemas) / np.pi)
+    elegidas = rng.choice(len(quemas), n1, p=radios ** 2 / (radios ** 2).sum())
+    angulo, dist = rng.uniform(0, 2 * np.pi, n1), rng.uniform(0, 0.5, n1) * radios[elegidas]
+    x1 = shapely.get_x(centros)[elegidas] + dist * np.cos(angulo)
+    y1 = shapely.get_y(centros)[elegidas] + dist * np.sin(angulo)
+    dias1 = np.where(fechas[elegidas] > 0, fechas[elegidas], fechas_temporada(year, n1, rng))
+    x0, y0 = puntos_en(aoi, n - n1, rng)
+
+    x, y = np.concatenate([x1, x0]), np.concatenate([y1, y0])
+    clase = np.repeat([1, 0], [n1, n - n1])
+    lon, lat = Transformer.from_crs(EPSG_UTM, 4326, always_xy=True).transform(x, y)
+    valores = campos(x, y, year)
+    for variable, corrimiento in (('ndvi_mean', -0.6), ('dist_vias', -0.4), ('precip_60d', -0.3), ('temp_mean', 0.3)):
+        valores[variable] = valores[variable] + corrimiento * clase
+    dias = np.concatenate([dias1, fechas_temporada(year, n - n1, rng)])
+
+    df = pd.DataFrame({'class': clase,
+                       'fecha_txt': (np.datetime64('1970-01-01') + dias.astype('timedelta64[D]')).astype(str),
+                       'lat': lat, 'lon': lon})
+    for variable in VARIABLES:
+        nombre = f'{variable}_{year}' if variable in _CON_SUFIJO else variable
+        columna = valores[variable].astype(np.float64)
+        columna[rng.random(n) < FRACCION_NULOS / len(VARIABLES)] = np.nan
+        df[nombre] = columna
+
+    completos = df.notna().all(axis=1).to_numpy()
+    n_bal = min(int((completos & (clase == 1)).sum()), int((completos & (clase == 0)).sum()))
+    fila_0 = np.flatnonzero(completos & (clase == 0))
+    filas = np.sort(np.concatenate([np.flatnonzero(completos & (clase == 1))[:n_bal],
+                                    rng.choice(fila_0, n_bal, replace=False)]))
+    return df, df.iloc[filas].reset_index(drop=True)
+
+
+def parametros_datos(escala=ESCALA, years=YEARS):
+    """Todo lo que define los datos sintéticos (si cambia algo, se generan de nuevo)."""
+    return {'version': VERSION_DATOS, 'escala': escala, 'years': sorted(years), 'semilla': SEMILLA,
+            'centro_utm': list(CENTRO_UTM), 'lado_km': [LADO_X_KM, LADO_Y_KM], 'resolucion': RESOLUCION,
+            'n_firms': N_FIRMS, 'fraccion_firms_aoi': FRACCION_FIRMS_AOI, 'fraccion_modis': FRACCION_MODIS,
+            'n_quemas': N_QUEMAS, 'fraccion_quemas_sin_fecha': FRACCION_QUEMAS_SIN_FECHA,
+            'fraccion_ruido': FRACCION_RUIDO, 'n_construcciones': N_CONSTRUCCIONES,
+            'n_centros_poblados': N_CENTROS_POBLADOS, 'n_rios': N_RIOS, 'n_lagunas': N_LAGUNAS,
+            'n_completo': N_COMPLETO, 'fraccion_clase_1': FRACCION_CLASE_1, 'fraccion_nulos': FRACCION_NULOS}
+
+
+def generar_datos(escala=ESCALA, years=YEARS):
+    """Genera las entradas sintéticas bajo raiz_sintetica(escala), salvo que ya estén con los mismos parámetros."""
+    raiz = raiz_sintetica(escala)
+    ruta_parametros = os.path.join(carpeta_escala(escala), 'datos.json')
+    parametros = parametros_datos(escala, years)
+    if os.path.exists(ruta_parametros):
+        with open(ruta_parametros, encoding='utf-8') as f:
+            if json.load(f) == parametros:
+                print(f"✅ Datos sintéticos al día: {raiz}")
+                return raiz
+    if os.path.exists(raiz):
+        shutil.rmtree(raiz)
+
+    t0 = time.time()
+    transform, alto, ancho = grilla(escala)
+    print(f"🧪 Generando datos sintéticos (escala {escala:g}: {ancho} x {alto} píxeles de {RESOLUCION} m)...")
+    aoi = generar_aoi(escala, np.random.default_rng([SEMILLA, 0]))
+    gdf_aoi = gpd.GeoDataFrame({'NOMBDEP': ['HUANUCO'], 'NOMBPROV': ['LEONCIO PRADO']},
+                               geometry=[aoi], crs=EPSG_UTM).to_crs(4326)
+    ruta_aoi = redirigir(orquestador.aoi_shp, raiz)
+    os.makedirs(os.path.dirname(ruta_aoi), exist_ok=True)
+    gdf_aoi.to_file(ruta_aoi)
+    print(f"   AOI: {aoi.area / 1e6:,.0f} km²")
+
+    for year in years:
+        rutas = rutas_sinteticas(year, raiz)
+        for clave in ('firms', 'construcciones', 'completo'):
+            os.makedirs(os.path.dirname(rutas[clave]), exist_ok=True)
+
+        firms = generar_firms(year, gdf_aoi.geometry.iloc[0], escala)
+        firms.to_csv(rutas['firms'], index=False)
+        quemas, fechas = generar_quemas(year, aoi, escala)
+        construcciones = generar_construcciones(year, aoi, escala)
+        construcciones.to_crs(4326).to_file(rutas['construcciones'])  # Open Buildings viene en EPSG:4326
+        agua = generar_agua(year, aoi, escala)
+        generar_rasters(year, rutas, aoi, quemas, fechas, construcciones, agua, escala)
+        completo, balanceado = generar_tablas(year, aoi, quemas, fechas, escala)
+        completo.to_csv(rutas['completo'], index=False)
+        balanceado.to_csv(rutas['balanceado'], index=False)
+        print(f"   ({year}) FIRMS: {len(firms):,} filas | quemas: {len(quemas):,} | "
+              f"construcciones: {len(construcciones):,} | completo: {len(completo):,} | "
+              f"balanceado: {len(balanceado):,}")
+
+    with open(ruta_parametros, 'w', encoding='utf-8') as f:
+        json.dump(parametros, f, indent=2)
+    print(f"✅ Datos sintéticos en {time.time() - t0:.1f} s: {raiz}")
+    return raiz
+
+
+# ------------------------------------------------------------------------------
+# Medición
+# ------------------------------------------------------------------------------
+def preparar_repeticion(raiz, years, pasos):
+    """Deja la raíz sintética en frío: sin cachés, almacén, modelos, reportes ni estado del orquestador."""
+    for carpeta in ('cache', 'almacen', 'orquestador', 'reportes'):
+        shutil.rmtree(os.path.join(raiz, carpeta), ignore_errors=True)
+    if 7 in pasos:
+        # .pkl, compilado, registro e hiperparámetros: nada de la corrida anterior llega a 7
+        # (sin 7, 8 usa el modelo que ya está; ningún otro paso escribe en modelos/)
+        shutil.rmtree(os.path.join(raiz, 'modelos'), ignore_errors=True)
+    if 4 not in pasos:
+        # 5, 6 y 7 leen el almacén: sin el paso 4, se ingesta el balanceado sintético
+        almacen_caracteristicas.CARPETA_ALMACEN = redirigir(almacen_caracteristicas.CARPETA_ALMACEN, raiz)
+        for year in years:
+            almacen_caracteristicas.ingestar_csv(rutas_sinteticas(year, raiz)['balanceado'], 'balanceado', year)
+
+
+def leer_reportes(raiz):
+    """{clave: medidas} de los reportes de instrumentacion.py de una corrida.
+
+    Claves: '<year> <paso> total' (desde instrumentacion.iniciar) y '<year> <paso> <etapa>'.
+    """
+    medidas = {}
+    for ruta in sorted(glob.glob(os.path.join(raiz, 'reportes', '*', '*.json'))):
+        with open(ruta, encoding='utf-8') as f:
+            reporte = json.load(f)
+        prefijo = f"{reporte['year']} {reporte['paso']}"
+        medidas[f"{prefijo} total"] = {k: reporte.get(k) for k in ('segundos', 'cpu_s', 'cpu_hijos_s', 'rss_pico_mb')}
+        medidas[f"{prefijo} total"]['estado'] = reporte['estado']
+        for etapa, r in reporte['resumen'].items():
+            medidas[f"{prefijo} {etapa}"] = {k: r[k] for k in ('segundos', 'cpu_s', 'rss_pico_mb', 'entrada', 'salida')
+                                            if k in r}
+    return medidas
+
+
+def tiempos_tareas(raiz):
+    """{'tarea <id>': {'segundos': ...}} del estado del orquestador: el proceso completo (con los imports)."""
+    ruta = os.path.join(raiz, 'orquestador', 'estado.json')
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, encoding='utf-8') as f:
+        estado = json.load(f)
+    return {f"tarea {id_tarea}": {'segundos': t['segundos']} for id_tarea, t in estado.get('tareas', {}).items()
+            if 'segundos' in t}
+
+
+def medir(raiz, carpeta_py, years=YEARS, pasos=PASOS, repeticiones=REPETICIONES):
+    """Corre los pasos `repeticiones` veces con la copia del orquestador. Devuelve (corridas, tareas)."""
+    corridas, tareas = [], []
+    salida = os.path.join(os.path.dirname(raiz), 'tareas.json')
+    for i in range(1, repeticiones + 1):
+        preparar_repeticion(raiz, years, pasos)
+        print(f"\n⏱️ Repetición {i}/{repeticiones} (pasos {', '.join(map(str, pasos))}; años {years})")
+        t0 = time.perf_counter()
+        argumentos = json.dumps({'years': list(years), 'pasos': list(pasos), 'salida': salida})
+        subprocess.run([sys.executable, '-c', _ORQUESTAR, argumentos], cwd=carpeta_py,
+                       env=dict(os.environ, PYTHONIOENCODING='utf-8'))
+        segundos = time.perf_counter() - t0
+        resultados = {}
+        if os.path.exists(salida):
+            with open(salida, encoding='utf-8') as f:
+                resultados = json.load(f)
+            os.remove(salida)
+        tareas.append(resultados)
+        corridas.append({'segundos': segundos, 'medidas': {**tiempos_tareas(raiz), **leer_reportes(raiz)}})
+        print(f"   -> {segundos:.1f} s")
+    return corridas, tareas
+
+
+def resumir_corridas(corridas):
+    """Mediana (y mínimo/máximo de segundos) de cada medida en todas las corridas."""
+    resumen = {}
+    claves = sorted({c for corrida in corridas for c in corrida['medidas']})
+    for clave in claves:
+        valores = [corrida['medidas'][clave] for corrida in corridas if clave in corrida['medidas']]
+        r = {'corridas': len(valores)}
+        for medida in ('segundos', 'cpu_s', 'cpu_hijos_s', 'rss_pico_mb', 'entrada', 'salida'):
+            serie = [v[medida] for v in valores if v.get(medida) is not None]
+            if serie:
+                r[medida] = statistics.median(serie)
+        segundos = [v['segundos'] for v in valores if v.get('segundos') is not None]
+        if segundos:
+            r['segundos_min'], r['segundos_max'] = min(segundos), max(segundos)
+        estados = {v['estado'] for v in valores if 'estado' in v}
+        if estados:
+            r['estado'] = 'ok' if estados == {'ok'} else ' | '.join(sorted(estados - {'ok'}))
+        resumen[clave] = r
+    return resumen
+
+
+def _git(*args):
+    try:
+        salida = subprocess.run(['git', *args], cwd=orquestador.CARPETA_PY, capture_output=True, text=True)
+    except OSError:
+        return None
+    return salida.stdout.strip() if salida.returncode == 0 else None
+
+
+def maquina():
+    return {'plataforma': platform.platform(), 'procesador': platform.processor() or platform.machine(),
+            'nucleos': os.cpu_count(), 'python': platform.python_version()}
+
+
+# ------------------------------------------------------------------------------
+# Resultados y comparación
+# ------------------------------------------------------------------------------
+def carpeta_resultados():
+    return os.path.join(CARPETA_BENCHMARK, 'resultados')
+
+
+def guardar_resultado(resultado):
+    os.makedirs(carpeta_resultados(), exist_ok=True)
+    ruta = os.path.join(carpeta_resultados(), f"{resultado['marca']}.json")
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    return ruta
+
+
+def cargar_resultados():
+    """Resultados guardados, del más viejo al más nuevo."""
+    resultados = []
+    for ruta in sorted(glob.glob(os.path.join(carpeta_resultados(), '*.json'))):
+        with open(ruta, encoding='utf-8') as f:
+            resultados.append(json.load(f))
+    return resultados
+
+
+def comparable(a, b):
+    """Mismos datos sintéticos, años y pasos (los tiempos se pueden comparar)."""
+    return a['datos'] == b['datos'] and a['pasos'] == b['pasos']
+
+
+def buscar_base(resultado, base=BASE):
+    """Resultado contra el cual comparar: `base` por nombre, o el último comparable anterior."""
+    anteriores = [r for r in cargar_resultados() if r['marca'] != resultado['marca']]
+    if base is not None:
+        elegidos = [r for r in anteriores if r['marca'] == base]
+        if not elegidos:
+            raise ValueError(f"No existe el resultado {base!r} en {carpeta_resultados()}")
+        return elegidos[0]
+    anteriores = [r for r in anteriores if comparable(r, resultado)]
+    return anteriores[-1] if anteriores else None
+
+
+def _cambio(antes, ahora, tolerancia, minimo):
+    if antes is None or ahora is None:
+        return None, ''
+    relativo = (ahora - antes) / antes if antes else 0.0
+    if relativo > tolerancia and ahora - antes >= minimo:
+        return relativo, '⚠️ REGRESIÓN'
+    if relativo < -tolerancia and antes - ahora >= minimo:
+        return relativo, '✅ mejora'
+    return relativo, ''
+
+
+def comparar(base, resultado, tolerancia=TOLERANCIA, min_segundos=MIN_SEGUNDOS, min_mb=MIN_MB):
+    """Imprime la tabla de cambios (tiempo y memoria) por medida. Devuelve la lista de regresiones."""
+    print(f"\n📈 Comparación con {base['marca']} (commit {base.get('commit') or '?'}"
+          f"{', ' + base['etiqueta'] if base.get('etiqueta') else ''})")
+    if base['maquina'] != resultado['maquina']:
+        print(f"⚠️ Otra máquina ({base['maquina']['plataforma']}, {base['maquina']['nucleos']} núcleos): "
+              f"los tiempos pueden no ser comparables.")
+    if not comparable(base, resultado):
+        print("⚠️ Datos sintéticos, años o pasos distintos: se comparan solo las medidas en común.")
+
+    regresiones = []
+    filas = []
+    for clave, ahora in resultado['mediciones'].items():
+        antes = base['mediciones'].get(clave)
+        if antes is None:
+            filas.append((clave, '', f"{ahora.get('segundos', 0):.2f}", 'nueva', '', ''))
+            continue
+        if antes.get('entrada') is not None and antes.get('entrada') != ahora.get('entrada'):
+            filas.append((clave, '', '', '', '', f"⚠️ entrada distinta ({antes['entrada']} -> {ahora.get('entrada')})"))
+        rel_t, marca_t = _cambio(antes.get('segundos'), ahora.get('segundos'), tolerancia, min_segundos)
+        rel_m, marca_m = _cambio(antes.get('rss_pico_mb'), ahora.get('rss_pico_mb'), tolerancia, min_mb)
+        if 'REGRESIÓN' in marca_t:
+            regresiones.append((clave, 'segundos', antes['segundos'], ahora['segundos']))
+        if 'REGRESIÓN' in marca_m:
+            regresiones.append((clave, 'rss_pico_mb', antes['rss_pico_mb'], ahora['rss_pico_mb']))
+        filas.append((clave,
+                      f"{antes['segundos']:.2f}" if antes.get('segundos') is not None else '',
+                      f"{ahora['segundos']:.2f}" if ahora.get('segundos') is not None else '',
+                      f"{rel_t:+.0%}" if rel_t is not None else '',
+                      f"{rel_m:+.0%}" if rel_m is not None else '',
+                      ' '.join(m for m in (marca_t, marca_m and f"memoria: {marca_m}") if m)))
+    for clave in base['mediciones'].keys() - resultado['mediciones'].keys():
+        filas.append((clave, f"{base['mediciones'][clave].get('segundos', 0):.2f}", '', 'ya no está', '', ''))
+
+    ancho = max(len(f[0]) for f in filas) if filas else 10
+    print(f"   {'medida':<{ancho}} {'base s':>9} {'ahora s':>9} {'tiempo':>8} {'memoria':>8}")
+    for clave, antes, ahora, rel_t, rel_m, nota in filas:
+        print(f"   {clave:<{ancho}} {antes:>9} {ahora:>9} {rel_t:>8} {rel_m:>8}  {nota}")
+
+    if regresiones:
+        print(f"\n❌ {len(regresiones)} regresión(es) (más de {tolerancia:.0%} y de {min_segundos} s / {min_mb} MB):")
+        for clave, medida, antes, ahora in regresiones:
+            print(f"   - {clave} [{medida}]: {antes:.2f} -> {ahora:.2f}")
+    else:
+        print(f"\n✅ Sin regresiones (tolerancia {tolerancia:.0%}).")
+    return regresiones
+
+
+if __name__ == "__main__":
+    raiz = generar_datos(ESCALA, YEARS)
+    carpeta_py = os.path.join(carpeta_escala(), 'py')
+    espejar_codigo(carpeta_py, raiz)
+
+    inicio = datetime.now()
+    corridas, tareas = medir(raiz, carpeta_py, YEARS, PASOS, REPETICIONES)
+    resultado = {
+        'marca': inicio.strftime('%Y%m%d-%H%M%S'), 'fecha': inicio.isoformat(timespec='seconds'),
+        'etiqueta': ETIQUETA, 'commit': _git('rev-parse', '--short', 'HEAD'),
+        'cambios_sin_commit': bool(_git('status', '--porcelain', '--', '.')),
+        'datos': parametros_datos(ESCALA, YEARS), 'pasos': list(PASOS), 'repeticiones': REPETICIONES,
+        'maquina': maquina(), 'perfil': os.environ.get('SIG_PERFIL'),
+        'tareas': tareas, 'segundos_corrida': [c['segundos'] for c in corridas],
+        'mediciones': resumir_corridas(corridas),
+    }
+    print(f"\n💾 Resultado: {guardar_resultado(resultado)}")
+
+    fallidas = sorted({t for corrida in tareas for t, r in corrida.items() if r not in ('ejecutada', 'al día')})
+    if fallidas or not all(tareas):
+        print(f"❌ Tareas con problemas: {', '.join(fallidas) or 'el orquestador no terminó'} "
+              f"(logs en {os.path.join(raiz, 'orquestador', 'logs')})")
+
+    base = buscar_base(resultado)
+    regresiones = comparar(base, resultado) if base is not None else []
+    if base is None:
+        print("ℹ️ No hay una corrida anterior comparable: esta queda como base.")
+    if regresiones or fallidas:
+        exit(1)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+from rasterio.warp import reproject, Resampling
+
+# ==============================================================================
+# CACHÉ DE RASTERS ALINEADOS (reproject -> grilla destino)
+# ==============================================================================
+# 2_crear_mascara_para_areas_quemadas.py y 8_generar_mapa.py reproyectan rasters
+# (agua, máscara 10m -> 20m) a una grilla destino en cada corrida y para cada
+# año. Aquí cada resultado se guarda como .npy, con una clave que depende del
+# CONTENIDO del archivo de origen (sha256) + transform, tamaño y CRS de destino
+# + remuestreo. Si nada de eso cambió, se reutiliza sin volver a reproyectar.
+# La carpeta se limita a LIMITE_CACHE_MB borrando primero lo menos usado (LRU).
+
+# ================= CONFIGURACIÓN =================
+CARPETA_CACHE = r'D:\SIG\cache\alineados'
+LIMITE_CACHE_MB = 4096  # Tamaño máximo de la caché en disco
+FILAS_POR_FRANJA = 2048 # Se reproyecta por franjas de filas (memoria acotada)
+# =================================================
+
+# Hash ya calculado en esta sesión: (ruta, tamaño, mtime) -> sha256
+_HASHES = {}
+
+
+def hash_archivo(ruta):
+    """sha256 del contenido del archivo (leído por bloques de 1 MB)."""
+    info = os.stat(ruta)
+    firma = (os.path.abspath(ruta), info.st_size, info.st_mtime)
+    if firma not in _HASHES:
+        h = hashlib.sha256()
+        with open(ruta, 'rb') as f:
+            for bloque in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(bloque)
+        _HASHES[firma] = h.hexdigest()
+    return _HASHES[firma]
+
+
+def clave(ruta_origen, dst_transform, dst_shape, dst_crs, resampling=Resampling.nearest, banda=1):
+    """Clave de caché: contenido del origen + definición completa de la grilla destino."""
+    partes = {
+        'origen': hash_archivo(ruta_origen),
+        'banda': banda,
+        'transform': [round(v, 9) for v in list(dst_transform)[:6]],
+        'shape': [int(dst_shape[0]), int(dst_shape[1])],
+        'crs': CRS.from_user_input(dst_crs).to_wkt(),
+        'resampling': Resampling(resampling).name,
+    }
+    return hashlib.sha256(json.dumps(partes, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _liberar_espacio(conservar):
+    """Borra las entradas menos usadas hasta quedar bajo LIMITE_CACHE_MB."""
+    entradas = []
+    for nombre in os.listdir(CARPETA_CACHE):
+        ruta = os.path.join(CARPETA_CACHE, nombre)
+        if nombre.endswith('.npy') and os.path.isfile(ruta):
+            info = os.stat(ruta)
+            entradas.append((info.st_mtime, info.st_size, ruta))
+
+    total = sum(tamano for _, tamano, _ in entradas)
+    limite = LIMITE_CACHE_MB * 1024 ** 2
+    for _, tamano, ruta in sorted(entradas):
+        if total <= limite:
+            break
+        if ruta == conservar:
+            continue
+        try:
+            os.remove(ruta)
+            total -= tamano
+        except OSError:
+            pass  # En uso por otro proceso (Windows): se intenta en la próxima corrida
+
+
+def obtener_alineado(ruta_origen, dst_transform, dst_shape, dst_crs,
+                     resampling=Resampling.nearest, banda=1, dtype=np.uint8):
+    """Devuelve la ruta .npy del raster `ruta_origen` reproyectado a la grilla destino.
+
+    Si ya está en la caché no se reproyecta nada; si no, se genera por franjas.
+    """
+    os.makedirs(CARPETA_CACHE, exist_ok=True)
+    ruta = os.path.join(CARPETA_CACHE, clave(ruta_origen, dst_transform, dst_shape, dst_crs,
+                                              resampling, banda) + '.npy')
+
+    if os.path.exists(ruta):
+        os.utime(ruta)  # Marca de uso para el LRU
+        return ruta
+
+    alto, ancho = int(dst_shape[0]), int(dst_shape[1])
+    # Nombre temporal por proceso: dos tareas del orquestador pueden alinear la misma clave a la vez
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    destino = np.lib.format.open_memmap(temporal, mode='w+', dtype=dtype, shape=(alto, ancho))
+    dst_transform = Affine(*list(dst_transform)[:6])
+
+    with rasterio.open(ruta_origen) as src:
+        for fila in range(0, alto, FILAS_POR_FRANJA):
+            franja = np.zeros((min(FILAS_POR_FRANJA, alto - fila), ancho), dtype=dtype)
+            reproject(
+                source=rasterio.band(src, banda),
+                destination=franja,
+                src_transform=src.transform,
+                src_crs=src.crs,
+                dst_transform=dst_transform * Affine.translation(0, fila),
+                dst_crs=dst_crs,
+                resampling=resampling
+            )
+            destino[fila:fila + franja.shape[0]] = franja
+
+    destino.flush()
+    del destino
+    os.replace(temporal, ruta)
+
+    _liberar_espacio(conservar=ruta)
+    return ruta
+
+
+def cargar(ruta):
+    """Abre un raster alineado en modo solo lectura (memory-mapped)."""
+    return np.load(ruta, mmap_mode='r')
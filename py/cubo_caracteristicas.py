@@ -0,0 +1,231 @@
+import json
+import os
+import shutil
+import time
+import numpy as np
+import rasterio
+from rasterio.warp import Resampling
+from rasterio.windows import Window
+import cache_alineado
+import piramide_mascara
+
+# ==============================================================================
+# CUBO DE VARIABLES EN DISCO (memory-mapped, pre-tileado)
+# ==============================================================================
+# Cada corrida de 8_generar_mapa.py descomprime el Stack GeoTIFF completo y
+# reproyecta la máscara de 10m a 20m. Este script lo hace UNA sola vez por año:
+# guarda el stack + la máscara ya alineada como arreglos .npy sin comprimir,
+# organizados en tiles de TAM_TILE x TAM_TILE píxeles con las bandas
+# intercaladas por píxel (cada tile es un bloque contiguo en disco).
+# Luego 8_generar_mapa.py los abre con np.load(mmap_mode='r') y el sistema
+# operativo solo lee del disco los tiles que se tocan.
+#
+# Estructura de la carpeta del cubo:
+#   caracteristicas.npy  float32 (TilesY, TilesX, TAM_TILE, TAM_TILE, Bandas), NaN = NoData
+#   mascara.npy          uint8   (TilesY, TilesX, TAM_TILE, TAM_TILE), 1 = Agua/Construcción
+#   metadata.json        transform, CRS, nombres de bandas y firma de los archivos de origen
+
+# ================= CONFIGURACIÓN =================
+YEAR = 2020     # <--- CAMBIA EL AÑO AQUÍ
+YEARS = None    # Varios años de una vez (ej: range(2020, 2025)). None = solo YEAR.
+
+TAM_TILE = 512  # Píxeles por lado de cada tile (512x512x9 float32 ~ 9 MB)
+
+# Umbral de cobertura de la máscara: se define una sola vez en piramide_mascara.py
+# (compartido con 8_generar_mapa.py)
+from piramide_mascara import UMBRAL_COBERTURA
+
+
+def rutas_anio(year):
+    return {
+        'stack': fr'D:\SIG\raster\{year}\Stack_Susceptibilidad_{year}_Estandarizado.tif',
+        'mascara': fr'D:\SIG\raster\{year}\Mascara_Agua_Construcciones_{year}.tif',
+        'cubo': fr'D:\SIG\cache\{year}\Cubo_Susceptibilidad_{year}',
+    }
+# =================================================
+
+
+def _firma(ruta):
+    """Identifica la versión de un archivo de origen (si cambia, el cubo se regenera)."""
+    if ruta is None or not os.path.exists(ruta):
+        return None
+    info = os.stat(ruta)
+    return {'ruta': os.path.abspath(ruta), 'tamano': info.st_size, 'mtime': info.st_mtime}
+
+
+def _firma_cobertura(ruta_mascara, resolucion, umbral_cobertura):
+    """Firma del nivel de la pirámide que usaría el cubo (None si no aplica o no existe)."""
+    if ruta_mascara is None or umbral_cobertura is None:
+        return None
+    return _firma(piramide_mascara.ruta_nivel(ruta_mascara, resolucion))
+
+
+def cubo_vigente(carpeta, ruta_stack, ruta_mascara, umbral_cobertura=None):
+    """True si el cubo existe y fue generado a partir de estos mismos archivos (y umbral).
+
+    Se compara el umbral PEDIDO, no el efectivo: si no había nivel de cobertura el
+    cubo queda con nearest, y solo se regenera cuando ese nivel aparece o cambia.
+    """
+    ruta_meta = os.path.join(carpeta, 'metadata.json')
+    if not os.path.exists(ruta_meta):
+        return False
+    with open(ruta_meta, encoding='utf-8') as f:
+        meta = json.load(f)
+    resolucion = abs(meta['transform'][0])
+    return (meta['firma_stack'] == _firma(ruta_stack) and meta['firma_mascara'] == _firma(ruta_mascara)
+            and meta.get('umbral_cobertura_pedido', meta.get('umbral_cobertura')) == umbral_cobertura
+            and meta.get('firma_cobertura') == _firma_cobertura(ruta_mascara, resolucion, umbral_cobertura))
+
+
+def ingestar(ruta_stack, ruta_mascara, carpeta, tam_tile=TAM_TILE, umbral_cobertura=UMBRAL_COBERTURA):
+    """Convierte el stack (y su máscara alineada a la grilla del stack) en un cubo .npy tileado.
+
+    Con umbral_cobertura, la máscara del cubo marca las celdas cuya fracción cubierta
+    (nivel de la pirámide a la resolución del stack) es >= umbral; si ese nivel no
+    existe se usa nearest y el cubo queda registrado sin umbral efectivo (pero con el
+    umbral pedido, para que cubo_vigente no lo regenere en cada corrida).
+    """
+    umbral_pedido = umbral_cobertura if ruta_mascara is not None else None
+    # Se escribe en una carpeta temporal y se renombra al final: un cubo a medias nunca queda "vigente"
+    temporal = carpeta + '.tmp'
+    if os.path.exists(temporal):
+        shutil.rmtree(temporal)
+    os.makedirs(temporal)
+
+    with rasterio.open(ruta_stack) as src:
+        tiles_y = int(np.ceil(src.height / tam_tile))
+        tiles_x = int(np.ceil(src.width / tam_tile))
+        nodata = src.nodata
+
+        caracteristicas = np.lib.format.open_memmap(
+            os.path.join(temporal, 'caracteristicas.npy'), mode='w+', dtype=np.float32,
+            shape=(tiles_y, tiles_x, tam_tile, tam_tile, src.count))
+        mascara = None
+        mascara_alineada = None
+        if ruta_mascara is not None:
+            mascara = np.lib.format.open_memmap(
+                os.path.join(temporal, 'mascara.npy'), mode='w+', dtype=np.uint8,
+                shape=(tiles_y, tiles_x, tam_tile, tam_tile))
+            ruta_cobertura = None
+            if umbral_cobertura is not None:
+                ruta_cobertura = piramide_mascara.cobertura_alineada(
+                    ruta_mascara, src.transform, (src.height, src.width), src.crs)
+            if ruta_cobertura is not None:
+                mascara_alineada = cache_alineado.cargar(ruta_cobertura)
+            else:
+                umbral_cobertura = None
+                # Reproyectar/Remuestrear la máscara (de 10m a 20m) una sola vez
+                # (o reutilizarla de la caché de alineados)
+                mascara_alineada = cache_alineado.cargar(cache_alineado.obtener_alineado(
+                    ruta_mascara, src.transform, (src.height, src.width), src.crs,
+                    resampling=Resampling.nearest # Nearest conserva los valores 0 y 1 puros
+                ))
+
+        for ty in range(tiles_y):
+            for tx in range(tiles_x):
+                fila, col = ty * tam_tile, tx * tam_tile
+                ventana = Window(col, fila, min(tam_tile, src.width - col), min(tam_tile, src.height - fila))
+                alto, ancho = int(ventana.height), int(ventana.width)
+
+                datos = src.read(window=ventana, out_dtype='float32')
+                if nodata is not None and not np.isnan(nodata):
+                    datos[datos == nodata] = np.nan
+
+                # Relleno del borde (fuera de la imagen) = NaN -> nunca se predice
+                tile = caracteristicas[ty, tx]
+                tile[...] = np.nan
+                tile[:alto, :ancho, :] = np.moveaxis(datos, 0, -1)
+
+                if mascara_alineada is not None:
+                    mascara[ty, tx] = 0
+                    bloque = mascara_alineada[fila:fila + alto, col:col + ancho]
+                    if umbral_cobertura is not None:
+                        bloque = bloque >= umbral_cobertura
+                    mascara[ty, tx, :alto, :ancho] = bloque
+
+        caracteristicas.flush()
+        if mascara is not None:
+            mascara.flush()
+        del caracteristicas, mascara
+
+        meta = {
+            'alto': src.height,
+            'ancho': src.width,
+            'tam_tile': tam_tile,
+            'transform': list(src.transform)[:6],
+            'crs': src.crs.to_wkt() if src.crs else None,
+            'n_bandas': src.count,
+            'nombres_bandas': list(src.descriptions),  # None si el GeoTIFF no trae descripción
+            'con_mascara': ruta_mascara is not None,
+            'umbral_cobertura': umbral_cobertura if ruta_mascara is not None else None,
+            'umbral_cobertura_pedido': umbral_pedido,
+            'firma_stack': _firma(ruta_stack),
+            'firma_mascara': _firma(ruta_mascara),
+            'firma_cobertura': _firma_cobertura(ruta_mascara, abs(src.transform.a), umbral_pedido),
+        }
+
+    with open(os.path.join(temporal, 'metadata.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.exists(carpeta):
+        shutil.rmtree(carpeta)
+    os.replace(temporal, carpeta)
+    return meta
+
+
+def abrir(carpeta):
+    """Abre el cubo en modo solo lectura (memory-mapped): no lee nada hasta tocar un tile."""
+    with open(os.path.join(carpeta, 'metadata.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    cubo = {
+        'meta': meta,
+        'caracteristicas': np.load(os.path.join(carpeta, 'caracteristicas.npy'), mmap_mode='r'),
+        'mascara': None,
+    }
+    if meta['con_mascara']:
+        cubo['mascara'] = np.load(os.path.join(carpeta, 'mascara.npy'), mmap_mode='r')
+    return cubo
+
+
+def ventanas_cubo(meta):
+    """Una ventana (en píxeles de la imagen original) por cada tile del cubo."""
+    tam = meta['tam_tile']
+    return [Window(col, fila, min(tam, meta['ancho'] - col), min(tam, meta['alto'] - fila))
+            for fila in range(0, meta['alto'], tam)
+            for col in range(0, meta['ancho'], tam)]
+
+
+def leer_tile(cubo, ventana):
+    """Devuelve (caracteristicas (T, T, Bandas), mascara (T, T) o None) del tile de esa ventana.
+
+    Son vistas sobre el archivo, con el relleno del borde incluido (NaN / 0).
+    """
+    tam = cubo['meta']['tam_tile']
+    ty, tx = int(ventana.row_off) // tam, int(ventana.col_off) // tam
+    mascara = cubo['mascara'][ty, tx] if cubo['mascara'] is not None else None
+    return cubo['caracteristicas'][ty, tx], mascara
+
+
+if __name__ == "__main__":
+    for year in (list(YEARS) if YEARS is not None else [YEAR]):
+        rutas = rutas_anio(year)
+        print(f"🧊 Generando cubo de variables {year}...")
+
+        if not os.path.exists(rutas['stack']):
+            print(f"❌ ERROR: No se encuentra el Stack Tiff: {rutas['stack']}")
+            continue
+        if not os.path.exists(rutas['mascara']):
+            print(f"⚠️ ALERTA: No se encontró la máscara en: {rutas['mascara']} (cubo sin máscara)")
+            rutas['mascara'] = None
+
+        if cubo_vigente(rutas['cubo'], rutas['stack'], rutas['mascara'], UMBRAL_COBERTURA):
+            print(f"   -> Ya está al día: {rutas['cubo']}")
+            continue
+
+        t0 = time.perf_counter()
+        meta = ingestar(rutas['stack'], rutas['mascara'], rutas['cubo'])
+        print(f"✅ Cubo {year} listo en {time.perf_counter() - t0:.1f} s: {rutas['cubo']}")
+        print(f"   {meta['alto']} x {meta['ancho']} píxeles, {len(meta['nombres_bandas'])} bandas, "
+              f"tiles de {meta['tam_tile']} px")
+        if UMBRAL_COBERTURA is not None and meta['umbral_cobertura'] is None and meta['con_mascara']:
+            print("   ⚠️ No hay nivel de cobertura a la resolución del stack: máscara con nearest.")
@@ -0,0 +1,198 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import roc_auc_score
+from xgboost import XGBClassifier
+import ajuste_hiperparametros
+import almacen_caracteristicas
+from almacen_caracteristicas import VARIABLES
+
+# ==============================================================================
+# ENTRENAMIENTO MULTI-AÑO POR LOTES (streaming desde el almacén de variables)
+# ==============================================================================
+# Unir todos los años en un DataFrame deja de caber en memoria a medida que se
+# suman años y puntos. Aquí las particiones de cada año se leen por lotes y se
+# pasan a XGBoost con un DataIter:
+#   - QuantileDMatrix: XGBoost guarda solo los datos ya discretizados (1 byte por
+#     variable y fila), nunca la tabla completa en float64.
+#   - ExtMemQuantileDMatrix (MEMORIA_EXTERNA): además pagina esos datos a disco.
+# La división entrenamiento/prueba es determinista por (año, fila), así un mismo
+# punto cae siempre del mismo lado aunque cambie el tamaño de lote o se sumen años.
+# Con DIVISION_ESPACIAL se sortea por bloque espacial (ver ajuste_hiperparametros.py)
+# en vez de por fila: un bloque entero, en todos los años, cae del mismo lado.
+# Los nombres ya vienen estandarizados por lote (dist_vias_2020 -> dist_vias)
+# porque el almacén normaliza cada año al ingestarlo.
+#
+# Entrenamiento incremental: el booster guarda con qué se entrenó (atributos
+# 'years', 'division', 'parametros' y 'huellas' = huella del almacén por año); al
+# agregar un año nuevo se continúa el boosting con más árboles sobre los años
+# nuevos. Solo se continúa si todo eso coincide con lo actual: un modelo sin esos
+# atributos, de un solo año (otra división), con otros hiperparámetros o cuyos
+# años ya vistos cambiaron en el almacén se reentrena desde cero.
+
+# ================= CONFIGURACIÓN =================
+# Mismos hiperparámetros que el XGBClassifier de 7_generar_modelo.py
+PARAMETROS = {
+    'objective': 'binary:logistic',
+    'eval_metric': 'logloss',
+    'learning_rate': 0.1,
+    'max_depth': 5,
+    'seed': 42,
+    'tree_method': 'hist',
+}
+N_ARBOLES = 100
+TAM_LOTE = 262_144          # Filas leídas por lote
+FRACCION_PRUEBA = 0.3       # Igual que test_size=0.3
+SEMILLA_DIVISION = 42
+DIVISION_ESPACIAL = True    # False = por fila (puntos vecinos a ambos lados: AUC optimista)
+MEMORIA_EXTERNA = False     # True = caché en disco (para tablas que no caben ni discretizadas)
+CARPETA_CACHE_XGB = r'D:\SIG\cache\xgboost'
+MAX_FILAS_VERIFICACION = 100_000  # Filas de prueba que se devuelven para verificar el modelo compilado
+# =================================================
+
+
+def es_prueba(year, fila, fraccion=FRACCION_PRUEBA, semilla=SEMILLA_DIVISION):
+    """True para las filas del conjunto de prueba (hash splitmix64 de año + fila)."""
+    return almacen_caracteristicas.clave_aleatoria(year, fila, semilla) < fraccion
+
+
+def prueba_lote(lote):
+    """Máscara de prueba de un lote del almacén (por fila o por bloque espacial)."""
+    if DIVISION_ESPACIAL:
+        bloques = ajuste_hiperparametros.bloques(lote)
+        return es_prueba(np.zeros(len(lote), dtype=np.int64), bloques)
+    return es_prueba(lote['year'].to_numpy(), lote['fila'].to_numpy())
+
+
+def _columnas():
+    return VARIABLES + ['class'] + (['lat', 'lon'] if DIVISION_ESPACIAL else [])
+
+
+class IteradorAnios(xgb.DataIter):
+    """Entrega a XGBoost, lote por lote, las filas de entrenamiento de varios años."""
+
+    def __init__(self, years, tam_lote=TAM_LOTE, cache_prefix=None):
+        self.years = list(years)
+        self.tam_lote = tam_lote
+        self._lotes = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def reset(self):
+        self._lotes = None
+
+    def next(self, input_data):
+        if self._lotes is None:
+            self._lotes = almacen_caracteristicas.iterar_lotes(
+                'balanceado', self.years, _columnas(), self.tam_lote)
+        for lote in self._lotes:
+            lote = lote[~prueba_lote(lote)]
+            if len(lote):
+                input_data(data=lote[VARIABLES], label=lote['class'].to_numpy())
+                return True
+        return False
+
+
+def matriz_entrenamiento(years, tam_lote=TAM_LOTE, memoria_externa=MEMORIA_EXTERNA):
+    """DMatrix discretizada de las filas de entrenamiento de `years`, construida por lotes."""
+    if memoria_externa:
+        os.makedirs(CARPETA_CACHE_XGB, exist_ok=True)
+        iterador = IteradorAnios(years, tam_lote, cache_prefix=os.path.join(CARPETA_CACHE_XGB, 'cache'))
+        return xgb.ExtMemQuantileDMatrix(iterador)
+    return xgb.QuantileDMatrix(IteradorAnios(years, tam_lote))
+
+
+def anios_entrenados(booster):
+    """Años que ya vio el booster (atributo 'years'), o lista vacía."""
+    years = booster.attr('years')
+    return [int(y) for y in years.split(',')] if years else []
+
+
+def division_actual():
+    """Nombre de la división entrenamiento/prueba del modo por lotes."""
+    return 'lotes_espacial' if DIVISION_ESPACIAL else 'lotes_fila'
+
+
+def _huellas(years):
+    return {str(y): almacen_caracteristicas.huella('balanceado', [y]) for y in sorted(set(years))}
+
+
+def firmar(booster, years, division, parametros):
+    """Guarda en el booster los años, la división, los parámetros y la huella de datos de cada año."""
+    booster.set_attr(
+        years=','.join(str(y) for y in sorted(set(years))),
+        division=division,
+        parametros=json.dumps(parametros, sort_keys=True, default=str),
+        huellas=json.dumps(_huellas(years), sort_keys=True),
+    )
+
+
+def motivo_reentrenar(booster, years):
+    """None si el booster se puede continuar con `years`; si no, el motivo para reentrenar desde cero."""
+    vistos = anios_entrenados(booster)
+    if not vistos or booster.attr('huellas') is None:
+        return 'el modelo no registra con qué años y datos se entrenó'
+    if booster.attr('division') != division_actual():
+        return f"se entrenó con otra división ({booster.attr('division')}, ahora {division_actual()})"
+    if booster.attr('parametros') != json.dumps(dict(PARAMETROS, n_arboles=N_ARBOLES), sort_keys=True, default=str):
+        return 'cambiaron los hiperparámetros'
+    sobrantes = [y for y in vistos if y not in years]
+    if sobrantes:
+        return f'incluye años que no se pidieron: {sobrantes}'
+    huellas = json.loads(booster.attr('huellas'))
+    cambiados = [y for y in vistos if huellas.get(str(y)) != almacen_caracteristicas.huella('balanceado', [y])]
+    if cambiados:
+        return f'cambiaron los datos de: {cambiados}'
+    return None
+
+
+def entrenar(years, modelo_previo=None, n_arboles=N_ARBOLES, tam_lote=TAM_LOTE):
+    """Entrena (o continúa, si hay modelo_previo) un booster con los años pedidos.
+
+    Con modelo_previo (ya validado con motivo_reentrenar) solo se usan los años que
+    el modelo aún no vio; si no hay ninguno nuevo, devuelve el mismo booster sin cambios.
+    """
+    years = sorted(set(years))
+    previos = anios_entrenados(modelo_previo) if modelo_previo is not None else []
+    nuevos = [y for y in years if y not in previos]
+    if not nuevos:
+        return modelo_previo
+
+    booster = xgb.train(PARAMETROS, matriz_entrenamiento(nuevos, tam_lote),
+                        num_boost_round=n_arboles, xgb_model=modelo_previo)
+    # Los parámetros registrados son los del modelo base (los árboles agregados usan los mismos)
+    parametros = (json.loads(modelo_previo.attr('parametros')) if modelo_previo is not None
+                  else dict(PARAMETROS, n_arboles=n_arboles))
+    firmar(booster, previos + nuevos, division_actual(), parametros)
+    return booster
+
+
+def evaluar(booster, years, tam_lote=TAM_LOTE):
+    """AUC sobre las filas de prueba de `years` (predichas por lotes).
+
+    Devuelve (auc, X_muestra): X_muestra son hasta MAX_FILAS_VERIFICACION filas de
+    prueba, para verificar el modelo compilado.
+    """
+    etiquetas, probabilidades, muestra = [], [], []
+    n_muestra = 0
+    for lote in almacen_caracteristicas.iterar_lotes('balanceado', years, _columnas(), tam_lote):
+        lote = lote[prueba_lote(lote)]
+        if not len(lote):
+            continue
+        X = lote[VARIABLES]
+        etiquetas.append(lote['class'].to_numpy())
+        probabilidades.append(booster.inplace_predict(X))
+        if n_muestra < MAX_FILAS_VERIFICACION:
+            muestra.append(X.iloc[:MAX_FILAS_VERIFICACION - n_muestra])
+            n_muestra += len(muestra[-1])
+
+    auc = roc_auc_score(np.concatenate(etiquetas), np.concatenate(probabilidades))
+    return auc, pd.concat(muestra)
+
+
+def a_clasificador(booster):
+    """Envuelve el booster en un XGBClassifier (lo que esperan 8_generar_mapa.py y modelo_compilado.py)."""
+    modelo = XGBClassifier()
+    modelo.load_model(booster.save_raw(raw_format='ubj'))
+    return modelo
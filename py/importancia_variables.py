@@ -0,0 +1,193 @@
+import copy
+import hashlib
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import seaborn as sns
+import xgboost as xgb
+from matplotlib.figure import Figure
+from sklearn.inspection import permutation_importance
+from sklearn.model_selection import train_test_split
+import ajuste_hiperparametros
+import almacen_caracteristicas
+import entrenamiento_lotes
+import modelo_compilado
+import registro_modelos
+from almacen_caracteristicas import VARIABLES
+
+# ==============================================================================
+# IMPORTANCIA DE VARIABLES (TreeSHAP + permutación, sin ventanas)
+# ==============================================================================
+# 5 y 6 solo mostraban `feature_importances_` (ganancia/impureza del
+# entrenamiento) en una ventana de plt.show() que bloquea el script. Aquí se
+# calcula la importancia sobre el conjunto de PRUEBA:
+#   - TreeSHAP exacto con el propio booster (pred_contribs=True), por lotes de
+#     TAM_LOTE_SHAP filas. Se guarda en caché por huella del modelo + huella de
+#     los datos: la segunda vez no se recalcula.
+#   - Importancia por permutación (caída del AUC al desordenar cada variable),
+#     con las variables repartidas entre N_PROCESOS procesos.
+# Tablas (CSV) y gráficos (PNG) se escriben a disco con matplotlib sin
+# interfaz gráfica, así corre igual en un job por lotes que en el escritorio.
+#
+# Uso directo (importancia de una versión del registro en cada año):
+#   python importancia_variables.py
+
+# ================= CONFIGURACIÓN =================
+YEARS = [2020]        # Años en cuyo conjunto de prueba se mide la importancia
+VERSION_MODELO = None  # None = la versión más nueva del registro (ver registro_modelos.py)
+
+CARPETA_RESULTADOS = r'D:\SIG\resultados\importancia'
+CARPETA_CACHE_SHAP = r'D:\SIG\cache\shap'
+
+TAM_LOTE_SHAP = 65_536   # Filas por llamada a pred_contribs (memoria: filas x (variables + 1))
+N_REPETICIONES = 5       # Permutaciones por variable
+N_PROCESOS = os.cpu_count() or 1
+SEMILLA = 42
+# =================================================
+
+
+def huella_modelo(modelo):
+    """sha256 del modelo (booster en UBJSON si es XGBoost, igual que el registro; si no, su pickle)."""
+    if isinstance(modelo, xgb.Booster) or hasattr(modelo, 'get_booster'):
+        return registro_modelos.huella_modelo(modelo)
+    return hashlib.sha256(pickle.dumps(modelo, protocol=4)).hexdigest()
+
+
+def huella_datos(X):
+    """sha256 de las columnas y valores (float32) de X."""
+    h = hashlib.sha256(','.join(map(str, X.columns)).encode())
+    h.update(np.ascontiguousarray(X.to_numpy(dtype=np.float32)).tobytes())
+    return h.hexdigest()
+
+
+def _booster(modelo):
+    return modelo if isinstance(modelo, xgb.Booster) else modelo.get_booster()
+
+
+def contribuciones_shap(modelo, X, tam_lote=TAM_LOTE_SHAP):
+    """TreeSHAP exacto (float32, filas x (variables + sesgo)), calculado por lotes con el booster.
+
+    La última columna es el sesgo (valor esperado); cada fila suma el margen (log-odds).
+    """
+    booster = _booster(modelo)
+    rango = modelo_compilado.rango_arboles(booster)
+
+    valores = X.to_numpy(dtype=np.float32)
+    salida = np.empty((len(valores), valores.shape[1] + 1), dtype=np.float32)
+    for inicio in range(0, len(valores), tam_lote):
+        lote = xgb.DMatrix(valores[inicio:inicio + tam_lote], feature_names=list(X.columns))
+        salida[inicio:inicio + tam_lote] = booster.predict(lote, pred_contribs=True, iteration_range=rango)
+    return salida
+
+
+def shap_en_cache(modelo, X, carpeta=CARPETA_CACHE_SHAP):
+    """Como contribuciones_shap, pero reutiliza el resultado si ya se calculó para este modelo y estos datos."""
+    ruta = os.path.join(carpeta, f"{huella_modelo(modelo)[:16]}_{huella_datos(X)[:16]}.npy")
+    if os.path.exists(ruta):
+        return np.load(ruta, mmap_mode='r')
+    contribuciones = contribuciones_shap(modelo, X)
+    os.makedirs(carpeta, exist_ok=True)
+    np.save(ruta + '.tmp.npy', contribuciones)
+    os.replace(ruta + '.tmp.npy', ruta)
+    return contribuciones
+
+
+def importancia_shap(contribuciones, nombres):
+    """Media del |SHAP| por variable (sin la columna de sesgo), de mayor a menor."""
+    return pd.DataFrame({
+        'Variable': list(nombres),
+        'SHAP_medio_abs': np.abs(np.asarray(contribuciones)[:, :-1]).mean(axis=0),
+    }).sort_values('SHAP_medio_abs', ascending=False, ignore_index=True)
+
+
+def importancia_permutacion(modelo, X, y, n_repeticiones=N_REPETICIONES, n_procesos=N_PROCESOS,
+                            semilla=SEMILLA):
+    """Caída del AUC al permutar cada variable (media y desvío de n_repeticiones), de mayor a menor."""
+    n_procesos = max(1, min(n_procesos, X.shape[1]))
+    if n_procesos > 1 and hasattr(modelo, 'set_params'):
+        # Un hilo por proceso: el paralelismo lo ponen los procesos (evita sobre-suscripción)
+        modelo = copy.deepcopy(modelo)
+        try:
+            modelo.set_params(n_jobs=1)
+        except ValueError:
+            pass
+    resultado = permutation_importance(modelo, X, y, scoring='roc_auc', n_repeats=n_repeticiones,
+                                       n_jobs=n_procesos, random_state=semilla)
+    return pd.DataFrame({
+        'Variable': list(X.columns),
+        'Caida_AUC': resultado.importances_mean,
+        'Caida_AUC_std': resultado.importances_std,
+    }).sort_values('Caida_AUC', ascending=False, ignore_index=True)
+
+
+def graficar(tabla, columna, titulo, ruta, etiqueta_x=None, paleta='viridis'):
+    """Gráfico de barras horizontal de `columna` por Variable, guardado en `ruta` (PNG) sin abrir ventanas."""
+    figura = Figure(figsize=(10, 6))
+    ejes = figura.subplots()
+    sns.barplot(x=columna, y='Variable', data=tabla, hue='Variable', legend=False, palette=paleta, ax=ejes)
+    ejes.set_title(titulo)
+    ejes.set_xlabel(etiqueta_x or columna)
+    figura.tight_layout()
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    figura.savefig(ruta, dpi=150)
+    return ruta
+
+
+def guardar_tabla(tabla, ruta):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    tabla.to_csv(ruta, index=False)
+    return ruta
+
+
+def conjunto_prueba(manifiesto, year):
+    """(X, y) de prueba de `year` con la misma división con que 7_generar_modelo.py evaluó esa versión."""
+    df = almacen_caracteristicas.cargar('balanceado', [year],
+                                        columnas=VARIABLES + ['class', 'lat', 'lon', 'year', 'fila'])
+    if len(manifiesto['years']) > 1:
+        # Modo multi-año: misma división por fila/bloque que entrenamiento_lotes
+        prueba = df[entrenamiento_lotes.prueba_lote(df)]
+    elif manifiesto.get('validacion_espacial', False):
+        _, idx_prueba = ajuste_hiperparametros.division_espacial(ajuste_hiperparametros.bloques(df))
+        prueba = df.iloc[idx_prueba]
+    else:
+        _, prueba = train_test_split(df, test_size=0.3, random_state=42, stratify=df['class'])
+    return prueba[VARIABLES], prueba['class']
+
+
+if __name__ == "__main__":
+    manifiesto = registro_modelos.seleccionar(version=VERSION_MODELO) if VERSION_MODELO else (
+        registro_modelos.versiones() or [None])[-1]
+    if manifiesto is None:
+        print(f"❌ ERROR: El registro de modelos está vacío: {registro_modelos.CARPETA_REGISTRO}")
+        print("   -> Ejecuta 7_generar_modelo.py para registrar un modelo.")
+        exit()
+    modelo = registro_modelos.cargar(manifiesto)
+    version = manifiesto['version']
+    print(f"🔍 Importancia de variables - modelo {version} (años {manifiesto['years']})")
+
+    tablas = []
+    for year in YEARS:
+        if not almacen_caracteristicas.disponible('balanceado', year):
+            print(f"⚠️ ({year}) No está en el almacén de variables (ejecuta 4_dataset_balanceado_final.py).")
+            continue
+        X_test, y_test = conjunto_prueba(manifiesto, year)
+        print(f"   ({year}) {len(X_test)} filas de prueba")
+
+        shap = importancia_shap(shap_en_cache(modelo, X_test), X_test.columns)
+        permutacion = importancia_permutacion(modelo, X_test, y_test)
+        tabla = shap.merge(permutacion, on='Variable').assign(year=year)
+        tablas.append(tabla)
+
+        print(tabla.drop(columns=['year']).to_string(index=False))
+        graficar(tabla, 'SHAP_medio_abs', f'Importancia SHAP ({version}) - {year}',
+                 os.path.join(CARPETA_RESULTADOS, f'SHAP_{version}_{year}.png'),
+                 etiqueta_x='Media |SHAP| (log-odds)', paleta='magma')
+        graficar(permutacion, 'Caida_AUC', f'Importancia por permutación ({version}) - {year}',
+                 os.path.join(CARPETA_RESULTADOS, f'Permutacion_{version}_{year}.png'),
+                 etiqueta_x='Caída del AUC')
+
+    if tablas:
+        guardar_tabla(pd.concat(tablas, ignore_index=True),
+                      os.path.join(CARPETA_RESULTADOS, f'Importancia_{version}.csv'))
+        print(f"\n💾 Tablas y gráficos en: {CARPETA_RESULTADOS}")
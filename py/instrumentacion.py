@@ -0,0 +1,300 @@
+import atexit
+import cProfile
+import functools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import psutil  # Opcional: memoria en Windows (sin él, solo se mide en Linux/macOS)
+except ImportError:
+    psutil = None
+try:
+    import resource  # No existe en Windows
+except ImportError:
+    resource = None
+
+# ==============================================================================
+# INSTRUMENTACIÓN (tiempos, CPU, memoria y conteos por etapa + reporte JSON)
+# ==============================================================================
+# Los scripts solo avisaban con prints; no había forma de saber si en un año el
+# cuello de botella era el sieve, la poligonización, el muestreo de puntos, el
+# recorte o predict_proba. Cada paso marca sus etapas con:
+#
+#   with instrumentacion.etapa('sieve', year, entrada=n_pixeles) as e:
+#       ...
+#       e['salida'] = n_poligonos
+#
+#   @instrumentacion.medido('leer_csv')          # para funciones enteras
+#   instrumentacion.seccion('entrenar', YEAR)    # para scripts planos (5, 6, 7):
+#                                                # cierra la sección anterior
+#
+# De cada etapa se guarda: tiempo de reloj, CPU del proceso (todos sus hilos),
+# CPU de los procesos hijos ya terminados, memoria residente al inicio/fin y
+# pico (muestreado cada INTERVALO_MEMORIA_S), y los conteos que se le pasen.
+# La memoria de los procesos de un pool no se cuenta aquí: las etapas medidas
+# dentro de un worker vuelven al proceso principal con tomar_etapas() /
+# agregar_etapas().
+#
+# instrumentacion.iniciar(paso, years) al comienzo de un script hace que al
+# terminar (también con exit() o un error) se escriba un JSON por año en
+# CARPETA_REPORTES/<year>/<paso>_<fecha>.json.
+#
+# Perfil opcional (variable de entorno SIG_PERFIL, la hereda orquestador.py):
+#   SIG_PERFIL=cprofile -> <paso>_<fecha>.prof junto al reporte (pstats / snakeviz)
+#   SIG_PERFIL=py-spy   -> orquestador.py lanza el paso con `py-spy record`
+#                          (ver comando()); py-spy debe estar instalado aparte
+
+# ================= CONFIGURACIÓN =================
+CARPETA_REPORTES = r'D:\SIG\reportes'
+
+PERFIL = os.environ.get('SIG_PERFIL') or None  # None | 'cprofile' | 'py-spy'
+INTERVALO_MEMORIA_S = 0.05
+# =================================================
+
+_EJECUCION = {}   # Paso iniciado en este proceso (ver iniciar)
+_ETAPAS = []      # Etapas terminadas
+_ACTIVAS = []     # Etapas abiertas (el muestreador les actualiza el pico de memoria)
+_ESTADO = {'seccion': None, 'muestreador': None, 'perfilador': None, 'proceso': None}
+
+
+# ------------------------------------------------------------------------------
+# Medidas del proceso
+# ------------------------------------------------------------------------------
+def _proceso():
+    # psutil.Process se crea una vez por proceso (los workers de un pool tienen otro pid)
+    if _ESTADO['proceso'] is None or _ESTADO['proceso'].pid != os.getpid():
+        _ESTADO['proceso'] = psutil.Process()
+    return _ESTADO['proceso']
+
+
+def rss_mb():
+    """Memoria residente actual del proceso (MB), o None si no se puede medir."""
+    if psutil is not None:
+        return _proceso().memory_info().rss / 2 ** 20
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def rss_pico_proceso_mb():
+    """Máximo histórico de memoria residente del proceso (MB), o None."""
+    if psutil is not None and hasattr(_proceso().memory_info(), 'peak_wset'):
+        return _proceso().memory_info().peak_wset / 2 ** 20  # Windows
+    if resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / 2 ** 20 if sys.platform == 'darwin' else pico / 1024  # bytes en macOS, KB en Linux
+    return None
+
+
+def _cpu_hijos():
+    # En Windows siempre 0; en Linux cuenta los hijos ya esperados (ej: un pool cerrado)
+    t = os.times()
+    return t.children_user + t.children_system
+
+
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+def _muestrear():
+    while True:
+        time.sleep(INTERVALO_MEMORIA_S)
+        if _ACTIVAS:
+            rss = rss_mb()
+            for e in list(_ACTIVAS):
+                e['rss_pico_mb'] = _max(e['rss_pico_mb'], rss)
+
+
+def _asegurar_muestreador():
+    # Un hilo por proceso (tras un fork el hilo del padre no existe en el hijo)
+    hilo = _ESTADO['muestreador']
+    if (hilo is None or not hilo.is_alive()) and rss_mb() is not None:
+        hilo = threading.Thread(target=_muestrear, name='instrumentacion', daemon=True)
+        hilo.start()
+        _ESTADO['muestreador'] = hilo
+
+
+# ------------------------------------------------------------------------------
+# Etapas
+# ------------------------------------------------------------------------------
+def _abrir(nombre, year, conteos):
+    _asegurar_muestreador()
+    rss = rss_mb()
+    e = {'etapa': nombre, 'year': None if year is None else int(year), **conteos,
+         'rss_inicio_mb': rss, 'rss_pico_mb': rss,
+         '_t0': time.perf_counter(), '_cpu0': time.process_time(), '_hijos0': _cpu_hijos()}
+    _ACTIVAS.append(e)
+    return e
+
+
+def _cerrar(e):
+    _ACTIVAS.remove(e)
+    rss = rss_mb()
+    e['segundos'] = time.perf_counter() - e.pop('_t0')
+    e['cpu_s'] = time.process_time() - e.pop('_cpu0')
+    e['cpu_hijos_s'] = _cpu_hijos() - e.pop('_hijos0')
+    e['rss_fin_mb'] = rss
+    e['rss_pico_mb'] = _max(e['rss_pico_mb'], rss)
+    _ETAPAS.append(e)
+
+
+@contextmanager
+def etapa(nombre, year=None, **conteos):
+    """Mide el bloque `with`. Devuelve el dict de la etapa para agregarle conteos (ej: e['salida'] = n)."""
+    e = _abrir(nombre, year, conteos)
+    try:
+        yield e
+    except BaseException as error:
+        e['error'] = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        _cerrar(e)
+
+
+def medido(nombre=None):
+    """Decorador: cada llamada a la función es una etapa (con el nombre de la función si no se da otro)."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with etapa(nombre or funcion.__name__):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def seccion(nombre, year=None, **conteos):
+    """Para scripts sin funciones: cierra la sección abierta y abre `nombre` (None = solo cerrar).
+
+    Devuelve el dict de la nueva sección (para agregarle conteos).
+    """
+    if _ESTADO['seccion'] is not None:
+        _cerrar(_ESTADO['seccion'])
+    _ESTADO['seccion'] = _abrir(nombre, year, conteos) if nombre is not None else None
+    return _ESTADO['seccion']
+
+
+def registrar(nombre, year=None, **valores):
+    """Agrega una etapa ya medida en otra parte (ej: tiempos sumados que devuelven los workers)."""
+    _ETAPAS.append({'etapa': nombre, 'year': None if year is None else int(year), **valores})
+
+
+def tomar_etapas():
+    """Etapas terminadas en este proceso (y las borra). Para devolverlas desde un worker."""
+    etapas = list(_ETAPAS)
+    _ETAPAS.clear()
+    return etapas
+
+
+def agregar_etapas(etapas):
+    _ETAPAS.extend(etapas)
+
+
+def resumir(etapas):
+    """Totales por nombre de etapa: llamadas, tiempos y conteos sumados, pico de memoria, y entrada/s."""
+    resumen = {}
+    for e in etapas:
+        r = resumen.setdefault(e['etapa'], {'llamadas': 0})
+        r['llamadas'] += 1
+        for clave, valor in e.items():
+            if clave == 'unidad':
+                r['unidad'] = valor
+            if clave in ('etapa', 'year') or isinstance(valor, bool) or not isinstance(valor, (int, float)):
+                continue
+            if clave.startswith('rss_'):
+                r[clave] = _max(r.get(clave), valor)
+            else:
+                r[clave] = r.get(clave, 0) + valor
+    for r in resumen.values():
+        if r.get('segundos') and 'entrada' in r:
+            r['entrada_por_s'] = r['entrada'] / r['segundos']
+    return resumen
+
+
+# ------------------------------------------------------------------------------
+# Reporte por paso / año
+# ------------------------------------------------------------------------------
+def iniciar(paso, years):
+    """Empieza el reporte del paso: al salir del proceso se escribe un JSON por año (ver escribir_reportes)."""
+    _EJECUCION.update(paso=paso, years=[int(y) for y in years],
+                      inicio=datetime.now().isoformat(timespec='seconds'), estado='ok',
+                      marca=datetime.now().strftime('%Y%m%d-%H%M%S'),
+                      _t0=time.perf_counter(), _cpu0=time.process_time(), _hijos0=_cpu_hijos())
+    if PERFIL == 'cprofile':
+        _ESTADO['perfilador'] = cProfile.Profile()
+        _ESTADO['perfilador'].enable()
+
+    anterior = sys.excepthook
+
+    def _registrar_error(tipo, valor, traza):
+        _EJECUCION['estado'] = f"error: {tipo.__name__}: {valor}"
+        anterior(tipo, valor, traza)
+
+    sys.excepthook = _registrar_error
+    atexit.register(escribir_reportes)
+
+
+def marcar_error(mensaje):
+    """Para scripts que atrapan la excepción y solo la imprimen: el reporte queda con estado de error."""
+    if _EJECUCION:
+        _EJECUCION['estado'] = f"error: {mensaje}"
+
+
+def escribir_reportes():
+    """Escribe <CARPETA_REPORTES>/<year>/<paso>_<fecha>.json por cada año del paso. Devuelve las rutas."""
+    if not _EJECUCION:
+        return []
+    seccion(None)
+    paso, marca = _EJECUCION['paso'], _EJECUCION['marca']
+    os.makedirs(CARPETA_REPORTES, exist_ok=True)
+
+    ruta_perfil = None
+    if _ESTADO['perfilador'] is not None:
+        _ESTADO['perfilador'].disable()
+        ruta_perfil = os.path.join(CARPETA_REPORTES, f"{paso}_{marca}.prof")
+        _ESTADO['perfilador'].dump_stats(ruta_perfil)
+        _ESTADO['perfilador'] = None
+
+    total = {
+        'segundos': time.perf_counter() - _EJECUCION['_t0'],
+        'cpu_s': time.process_time() - _EJECUCION['_cpu0'],
+        'cpu_hijos_s': _cpu_hijos() - _EJECUCION['_hijos0'],
+        'rss_pico_mb': rss_pico_proceso_mb(),
+    }
+    rutas = []
+    for year in _EJECUCION['years']:
+        # Las etapas sin año (ej: cargar el modelo) van en el reporte de cada año
+        etapas = [e for e in _ETAPAS if e['year'] in (year, None)]
+        reporte = {
+            'paso': paso, 'year': year, 'years': _EJECUCION['years'],
+            'inicio': _EJECUCION['inicio'], 'estado': _EJECUCION['estado'], **total,
+            'perfil': ruta_perfil, 'pid': os.getpid(),
+            'python': platform.python_version(), 'plataforma': platform.platform(),
+            'resumen': resumir(etapas), 'etapas': etapas,
+        }
+        ruta = os.path.join(CARPETA_REPORTES, str(year), f"{paso}_{marca}.json")
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(reporte, f, indent=2, default=str)
+        rutas.append(ruta)
+
+    _EJECUCION.clear()
+    print(f"📊 Reporte de rendimiento: {', '.join(rutas)}")
+    return rutas
+
+
+def comando(script, etiqueta, perfil=PERFIL):
+    """Línea de comando para correr un script; con perfil 'py-spy', envuelto en `py-spy record`."""
+    if perfil == 'py-spy':
+        salida = os.path.join(CARPETA_REPORTES, f"{etiqueta}_{datetime.now():%Y%m%d-%H%M%S}.speedscope.json")
+        os.makedirs(CARPETA_REPORTES, exist_ok=True)
+        return ['py-spy', 'record', '--subprocesses', '--format', 'speedscope', '-o', salida,
+                '--', sys.executable, script]
+    return [sys.executable, script]
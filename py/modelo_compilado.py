@@ -0,0 +1,256 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# numba es opcional: si está instalado, la evaluación se compila a código nativo
+# (en paralelo por píxel); si no, se usa la versión vectorizada con NumPy.
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# ==============================================================================
+# MODELO COMPILADO (XGBoost -> arreglos planos de nodos)
+# ==============================================================================
+# El .pkl de 7_generar_modelo.py solo se usa para predecir millones de píxeles.
+# Aquí el booster (100 árboles, profundidad 5) se aplana en arreglos de nodos:
+# cada árbol se completa a un árbol binario PERFECTO de la profundidad máxima
+# (las hojas poco profundas se repiten hacia abajo), así los hijos del nodo i
+# son 2i+1 / 2i+2 y el recorrido no necesita punteros ni ramas.
+# Con numba el recorrido se compila a un bucle nativo paralelo por píxel; sin
+# numba se avanza, nivel por nivel, TODOS los árboles para TODOS los píxeles
+# de un lote con NumPy. En ambos casos sin joblib ni el wrapper de sklearn.
+#
+# Uso directo (verificación + benchmark contra el modelo .pkl):
+#   python modelo_compilado.py
+
+YEAR = 2020  # Año del dataset balanceado usado para verificar/medir
+
+ruta_modelo = r'D:\SIG\modelos\Modelo_Incendios_XGBoost_Entrenado.pkl'
+ruta_modelo_compilado = r'D:\SIG\modelos\Modelo_Incendios_XGBoost_Compilado.npz'
+archivo = fr'D:\SIG\csv\{YEAR}\Dataset_{YEAR}_BALANCEADO_FINAL.csv'
+
+TOLERANCIA = 1e-6      # Diferencia máxima permitida contra predict_proba
+TAM_LOTE = 65536       # Píxeles evaluados a la vez (memoria: Árboles x Lote enteros)
+
+
+def rango_arboles(modelo):
+    """iteration_range de XGBoost que respeta early stopping (mismos árboles que predict_proba).
+
+    Acepta un XGBClassifier o un xgb.Booster; (0, 0) = todos los árboles.
+    """
+    booster = modelo.get_booster() if hasattr(modelo, 'get_booster') else modelo
+    mejor = booster.attr('best_iteration')
+    return (0, int(mejor) + 1) if mejor is not None else (0, 0)
+
+
+def compilar(modelo):
+    """Convierte un XGBClassifier (binary:logistic) en un dict de arreglos planos."""
+    booster = modelo.get_booster()
+    modelo_json = json.loads(booster.save_raw(raw_format='json'))
+    learner = modelo_json['learner']
+
+    objetivo = learner['objective']['name']
+    if objetivo != 'binary:logistic':
+        raise ValueError(f"Solo se soporta 'binary:logistic' (el modelo usa '{objetivo}').")
+    gbm = learner['gradient_booster']
+    if gbm['name'] != 'gbtree':
+        raise ValueError(f"Solo se soporta el booster 'gbtree' (el modelo usa '{gbm['name']}').")
+
+    # base_score se guarda como probabilidad ("5E-1" o "[5E-1]" según la versión)
+    base_score = float(str(learner['learner_model_param']['base_score']).strip('[]'))
+    base_margen = float(np.log(base_score / (1.0 - base_score)))
+
+    arboles = gbm['model']['trees']
+    # Respetar early stopping si el modelo lo usó (mismos árboles que predict_proba)
+    fin = rango_arboles(booster)[1]
+    if fin:
+        arboles = arboles[:fin]
+
+    # Profundidad máxima entre todos los árboles
+    profundidad = 0
+    for arbol in arboles:
+        izq, der = arbol['left_children'], arbol['right_children']
+        nivel, d = [0], 0
+        while True:
+            nivel = [h for i in nivel if izq[i] != -1 for h in (izq[i], der[i])]
+            if not nivel:
+                break
+            d += 1
+        profundidad = max(profundidad, d)
+
+    n_internos = (1 << profundidad) - 1
+    n_hojas = 1 << profundidad
+    variable = np.zeros((len(arboles), n_internos), dtype=np.int32)
+    umbral = np.zeros((len(arboles), n_internos), dtype=np.float32)
+    defecto_izq = np.zeros((len(arboles), n_internos), dtype=bool)
+    valor = np.zeros((len(arboles), n_hojas), dtype=np.float32)
+
+    for t, arbol in enumerate(arboles):
+        izq, der = arbol['left_children'], arbol['right_children']
+        indices = arbol['split_indices']
+        # En XGBoost el valor de una hoja se guarda en split_conditions
+        condiciones = np.asarray(arbol['split_conditions'], dtype=np.float32)
+        por_defecto = arbol['default_left']
+
+        # (nodo original, posición en el árbol perfecto, nivel)
+        pendientes = [(0, 0, 0)]
+        while pendientes:
+            nodo, pos, nivel = pendientes.pop()
+            if nivel == profundidad:
+                valor[t, pos - n_internos] = condiciones[nodo]
+                continue
+            if izq[nodo] == -1:
+                # Hoja antes del último nivel: nodo de relleno (x < inf, NaN a la
+                # izquierda) y la misma hoja copiada en ambos hijos
+                umbral[t, pos] = np.inf
+                defecto_izq[t, pos] = True
+                pendientes += [(nodo, 2 * pos + 1, nivel + 1), (nodo, 2 * pos + 2, nivel + 1)]
+            else:
+                variable[t, pos] = indices[nodo]
+                umbral[t, pos] = condiciones[nodo]
+                defecto_izq[t, pos] = bool(por_defecto[nodo])
+                pendientes += [(izq[nodo], 2 * pos + 1, nivel + 1), (der[nodo], 2 * pos + 2, nivel + 1)]
+
+    return {
+        'variable': variable,
+        'umbral': umbral,
+        'defecto_izq': defecto_izq,
+        'valor': valor,
+        'profundidad': np.int32(profundidad),
+        'base_margen': np.float64(base_margen),
+        'nombres': np.array(booster.feature_names or [], dtype=str),
+    }
+
+
+def guardar(compilado, ruta):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    np.savez(ruta, **compilado)
+
+
+def cargar(ruta):
+    with np.load(ruta, allow_pickle=False) as datos:
+        return {clave: datos[clave] for clave in datos.files}
+
+
+def _recorrer_numpy(X, variable, umbral, defecto_izq, valor, profundidad, base_margen, tam_lote):
+    n_arboles, n_internos = variable.shape
+    base_internos = (np.arange(n_arboles, dtype=np.int64) * n_internos)[:, None]
+    base_hojas = (np.arange(n_arboles, dtype=np.int64) * valor.shape[1] - n_internos)[:, None]
+    variable, umbral, defecto_izq, valor = (a.ravel() for a in (variable, umbral, defecto_izq, valor))
+
+    salida = np.empty(X.shape[0], dtype=np.float32)
+    for inicio in range(0, X.shape[0], tam_lote):
+        lote = X[inicio:inicio + tam_lote]
+        filas = np.arange(lote.shape[0])
+        nodo = np.zeros((n_arboles, lote.shape[0]), dtype=np.int64)
+
+        for _ in range(profundidad):
+            k = base_internos + nodo
+            v = lote[filas, variable[k]]
+            # XGBoost: va a la izquierda si x < umbral; los NaN siguen la rama por defecto
+            ir_izq = v < umbral[k]
+            nulos = np.isnan(v)
+            if nulos.any():
+                ir_izq = np.where(nulos, defecto_izq[k], ir_izq)
+            nodo = 2 * nodo + 2 - ir_izq
+
+        margen = base_margen + valor[base_hojas + nodo].sum(axis=0, dtype=np.float64)
+        salida[inicio:inicio + lote.shape[0]] = 1.0 / (1.0 + np.exp(-margen))
+    return salida
+
+
+def _recorrer_nativo(X, variable, umbral, defecto_izq, valor, profundidad, base_margen, tam_lote):
+    n_arboles, n_internos = variable.shape
+    salida = np.empty(X.shape[0], dtype=np.float32)
+    for i in numba.prange(X.shape[0]):
+        margen = base_margen
+        for t in range(n_arboles):
+            nodo = 0
+            for _ in range(profundidad):
+                v = X[i, variable[t, nodo]]
+                ir_izq = defecto_izq[t, nodo] if np.isnan(v) else v < umbral[t, nodo]
+                # Sin ramas: izquierda = 2i+1, derecha = 2i+2
+                nodo = 2 * nodo + 2 - np.int64(ir_izq)
+            margen += valor[t, nodo - n_internos]
+        salida[i] = 1.0 / (1.0 + np.exp(-margen))
+    return salida
+
+
+if numba is not None:
+    _recorrer = numba.njit(parallel=True, cache=True)(_recorrer_nativo)
+else:
+    _recorrer = _recorrer_numpy
+
+
+def predecir(compilado, X, tam_lote=TAM_LOTE):
+    """Probabilidad de clase 1 para X (Pixeles, Bandas), equivalente a predict_proba(X)[:, 1]."""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    return _recorrer(X, compilado['variable'], compilado['umbral'], compilado['defecto_izq'],
+                     compilado['valor'], int(compilado['profundidad']),
+                     float(compilado['base_margen']), tam_lote)
+
+
+def verificar(modelo, compilado, X, tolerancia=TOLERANCIA):
+    """Compara contra predict_proba; lanza ValueError si la diferencia supera la tolerancia."""
+    esperado = modelo.predict_proba(X)[:, 1]
+    obtenido = predecir(compilado, np.asarray(X, dtype=np.float32))
+    diferencia = float(np.max(np.abs(esperado - obtenido))) if len(esperado) else 0.0
+    if diferencia > tolerancia:
+        raise ValueError(f"El modelo compilado difiere de predict_proba en {diferencia:.2e} "
+                         f"(tolerancia {tolerancia:.0e}).")
+    return diferencia
+
+
+def benchmark(modelo, compilado, X, n_pixeles=1_000_000, semilla=42):
+    """Mide píxeles/segundo de cada camino sobre n_pixeles filas remuestreadas de X."""
+    X = np.asarray(X, dtype=np.float32)
+    rng = np.random.default_rng(semilla)
+    X_bench = np.ascontiguousarray(X[rng.integers(0, X.shape[0], n_pixeles)])
+    nombres = list(compilado['nombres'])
+
+    caminos = {
+        'predict_proba (DataFrame)': lambda: modelo.predict_proba(pd.DataFrame(X_bench, columns=nombres))[:, 1],
+        'booster.inplace_predict': lambda: modelo.get_booster().inplace_predict(X_bench),
+        f"modelo compilado ({'numba' if numba is not None else 'NumPy'})": lambda: predecir(compilado, X_bench),
+    }
+    # Calentamiento (compilación JIT de numba, caches de XGBoost) fuera del cronómetro
+    predecir(compilado, X_bench[:1000])
+
+    resultados = {}
+    for nombre, funcion in caminos.items():
+        t0 = time.perf_counter()
+        funcion()
+        resultados[nombre] = n_pixeles / (time.perf_counter() - t0)
+
+    print(f"\n⏱️ BENCHMARK ({n_pixeles:,} píxeles):")
+    print("-" * 50)
+    for nombre, px_s in resultados.items():
+        print(f"{nombre:<28} {px_s:>14,.0f} px/s")
+    print("-" * 50)
+    return resultados
+
+
+if __name__ == "__main__":
+    import joblib
+    import almacen_caracteristicas
+
+    print(f"🔧 Verificando modelo compilado con los datos de {YEAR}...")
+    for ruta in (ruta_modelo, archivo):
+        if ruta == archivo and almacen_caracteristicas.disponible('balanceado', YEAR):
+            continue  # Ya está en el almacén de variables
+        if not os.path.exists(ruta):
+            print(f"❌ ERROR: No se encuentra: {ruta}")
+            exit()
+
+    modelo = joblib.load(ruta_modelo)
+    compilado = compilar(modelo)
+    guardar(compilado, ruta_modelo_compilado)
+
+    X = almacen_caracteristicas.cargar_anio('balanceado', YEAR, archivo, columnas=list(compilado['nombres']))
+
+    diferencia = verificar(modelo, compilado, X)
+    print(f"✅ Diferencia máxima contra predict_proba: {diferencia:.2e}")
+    benchmark(modelo, compilado, X)
@@ -0,0 +1,389 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+import ajuste_hiperparametros
+import almacen_caracteristicas
+import instrumentacion
+import registro_modelos
+
+# ==============================================================================
+# ORQUESTADOR DE LOS PASOS 1-8 (dependencias + reconstrucción incremental)
+# ==============================================================================
+# Los ocho scripts se corrían a mano, en orden y editando YEAR en cada uno, y
+# cada corrida recalculaba su salida aunque nada hubiera cambiado. Aquí cada
+# paso de cada año es una tarea con entradas y salidas declaradas (las mismas
+# rutas que usan los scripts); una tarea depende de las que producen alguna de
+# sus entradas. Antes de correr una tarea se calcula su huella:
+#   sha256(paso + años + código del script y de los módulos de py/ que importa
+#          + contenido de cada entrada)
+# Si coincide con la de la última corrida exitosa y sus salidas siguen intactas,
+# se salta. Los hashes de archivos se memorizan por (tamaño, mtime), así un
+# GeoTIFF grande solo se vuelve a leer si cambió.
+#
+# Como la huella mira el CONTENIDO de las entradas, si un paso se repite y su
+# salida queda igual, lo de abajo no se vuelve a correr. Y si solo cambia el
+# modelo (7_generar_modelo.py o sus hiperparámetros), se corren solo 7 y 8.
+# Por eso la salida de cada paso debe depender solo de sus entradas declaradas:
+# 7 corre con SIG_INCREMENTAL=0 (entrena desde cero, sin continuar el .pkl que
+# dejó la corrida anterior).
+#
+# Las tareas que corren a la vez (5, 6 y 7 del mismo año, o el 4 de varios años)
+# no deben escribir lo que otra lee: la partición del almacén es salida del 4 y
+# los demás solo la leen (ver almacen_caracteristicas.ingestar_si_falta). Si una
+# tarea modifica alguna de sus entradas, queda como fallida.
+#
+# Cada tarea corre el script en un proceso aparte con los años en la variable
+# de entorno SIG_YEARS (los scripts la leen en su bloque de configuración) y su
+# salida queda en <CARPETA_ESTADO>/logs/<tarea>.log (tiempos y memoria por etapa:
+# ver instrumentacion.py). Las tareas independientes
+# (otros años, otros pasos) corren en paralelo. El estado se guarda después de
+# cada tarea: si algo falla, lo que depende de ella no se corre, el resto sigue,
+# y la próxima corrida retoma desde la que falló.
+#
+# Los pasos en Google Earth Engine (Dataset_Completo_{year}.csv y el Stack)
+# quedan fuera: sus archivos son entradas de origen.
+#
+# Uso directo:
+#   python orquestador.py
+
+# ================= CONFIGURACIÓN =================
+YEARS = [2020, 2021, 2022]  # Años a procesar (pasos 1-6 y 8, una tarea por año)
+ANIOS_MODELO = None         # Años con los que 7 entrena el modelo (None = YEARS)
+PASOS = (1, 2, 3, 4, 5, 6, 7, 8)
+
+FORZAR = ()        # Pasos a repetir aunque estén al día (ej: (7,) reentrena desde cero y rehace los mapas)
+SOLO_PLAN = False  # True = solo mostrar qué se correría, sin correr nada
+
+# Tareas a la vez. Varios pasos ya usan todos los núcleos por dentro (pools de
+# procesos, XGBoost), así que conviene un número bajo.
+N_PROCESOS = 2
+
+CARPETA_ESTADO = r'D:\SIG\orquestador'
+
+SCRIPTS = {
+    1: '1_conversion_confidence_generar_cuadrados_FIRMS.py',
+    2: '2_crear_mascara_para_areas_quemadas.py',
+    3: '3_generar_Quema_v2.py',
+    4: '4_dataset_balanceado_final.py',
+    5: '5_entrenamiento_modelo_piloto.py',
+    6: '6_XGBoost_importancia_de_variables.py',
+    7: '7_generar_modelo.py',
+    8: '8_generar_mapa.py',
+}
+
+# Rutas (las mismas de la configuración de cada script)
+aoi_shp = r'D:\SIG\shapes\general\Leoncio_Prado.shp'
+ruta_modelo = r'D:\SIG\modelos\Modelo_Incendios_XGBoost_Entrenado.pkl'
+ruta_modelo_compilado = r'D:\SIG\modelos\Modelo_Incendios_XGBoost_Compilado.npz'
+
+def rutas_anio(year):
+    return {
+        'firms': fr'D:\SIG\csv\{year}\FIRMS_{year}.csv',
+        'cuadrados': fr'D:\SIG\shapes\{year}\Leoncio_Prado_cuadrados_FIRMS_{year}.shp',
+        'agua': fr'D:\SIG\raster\{year}\preproceso\Cobertura_agua_{year}.tif',
+        'construcciones': fr'D:\SIG\shapes\{year}\Construcciones_{year}_FINAL_COMPLETO_b.shp',
+        'mascara_gee': fr'D:\SIG\raster\{year}\preproceso\Mascara_Agua_Construcciones_{year}.tif',
+        'mosaico': fr'D:\SIG\raster\{year}\leoncio_prado_{year}_mosaic.tif',
+        'puntos_quema': fr'D:\SIG\shapes\{year}\Puntos_Quema_{year}.shp',
+        'completo': fr'D:\SIG\csv\{year}\Dataset_Completo_{year}.csv',
+        'balanceado': fr'D:\SIG\csv\{year}\Dataset_{year}_BALANCEADO_FINAL.csv',
+        'resultados': fr'D:\SIG\resultados\{year}',
+        'stack': fr'D:\SIG\raster\{year}\Stack_Susceptibilidad_{year}_Estandarizado.tif',
+        'mascara': fr'D:\SIG\raster\{year}\Mascara_Agua_Construcciones_{year}.tif',
+        'mapa': fr'D:\SIG\raster\{year}\Mapa_Susceptibilidad_Final_{year}.tif',
+    }
+# =================================================
+
+CARPETA_PY = os.path.dirname(os.path.abspath(__file__))
+
+_OK = ('al día', 'ejecutada')
+
+
+def _particion(year):
+    # Lo que 5, 6 y 7 leen en realidad (4 escribe el CSV y esta partición)
+    return os.path.join(almacen_caracteristicas.ruta_dataset('balanceado'), f'year={year}')
+
+
+def tareas(years=YEARS, anios_modelo=ANIOS_MODELO, pasos=PASOS):
+    """Lista de tareas (en orden topológico) de los pasos pedidos."""
+    anios_modelo = sorted(set(anios_modelo if anios_modelo is not None else years))
+    lista = []
+
+    def agregar(paso, anios, entradas, salidas, opcionales=(), acumulativas=()):
+        # acumulativas: salidas que el paso puede dejar igual (ej: el registro si el modelo no cambió)
+        if paso in pasos:
+            etiqueta = str(anios[0]) if len(anios) == 1 else f"{anios[0]}-{anios[-1]}"
+            lista.append({'id': f"{paso}_{etiqueta}", 'paso': paso, 'script': SCRIPTS[paso], 'years': list(anios),
+                          'entradas': list(entradas), 'opcionales': list(opcionales),
+                          'salidas': list(salidas) + list(acumulativas), 'acumulativas': list(acumulativas)})
+
+    for year in years:
+        r = rutas_anio(year)
+        agregar(1, [year], [r['firms'], aoi_shp], [r['cuadrados']])
+        agregar(2, [year], [aoi_shp, r['agua'], r['construcciones']], [r['mascara_gee']])
+        agregar(3, [year], [r['mosaico']], [r['puntos_quema']])
+    for year in sorted(set(years) | set(anios_modelo)):
+        r = rutas_anio(year)
+        agregar(4, [year], [r['completo']], [r['balanceado'], _particion(year)])
+    for year in years:
+        r = rutas_anio(year)
+        agregar(5, [year], [_particion(year)],
+                [os.path.join(r['resultados'], f'Importancia_RF_{year}.csv')],
+                opcionales=[ajuste_hiperparametros.ruta_parametros('rf', [year])])
+        agregar(6, [year], [_particion(year)],
+                [os.path.join(r['resultados'], f'Importancia_XGBoost_{year}.csv')],
+                opcionales=[ajuste_hiperparametros.ruta_parametros('xgb', [year])])
+    agregar(7, anios_modelo, [_particion(y) for y in anios_modelo], [ruta_modelo, ruta_modelo_compilado],
+            opcionales=[ajuste_hiperparametros.ruta_parametros('xgb', anios_modelo)],
+            acumulativas=[registro_modelos.CARPETA_REGISTRO])
+    for year in years:
+        r = rutas_anio(year)
+        # 8 elige el modelo del registro (ver registro_modelos.seleccionar); sin registro usa el .pkl
+        agregar(8, [year], [ruta_modelo, ruta_modelo_compilado, r['stack'], r['mascara']], [r['mapa']],
+                opcionales=[registro_modelos.CARPETA_REGISTRO])
+    return lista
+
+
+def _normalizar(ruta):
+    return os.path.normcase(os.path.abspath(ruta))
+
+
+def dependencias(lista):
+    """{id: ids de las tareas que producen alguna de sus entradas}. ValueError si el orden no es topológico."""
+    productor = {}
+    deps = {}
+    for t in lista:
+        deps[t['id']] = sorted({productor[_normalizar(e)] for e in t['entradas'] + t['opcionales']
+                                if _normalizar(e) in productor})
+        for s in t['salidas']:
+            if _normalizar(s) in productor:
+                raise ValueError(f"{s} es salida de {productor[_normalizar(s)]} y de {t['id']}")
+            productor[_normalizar(s)] = t['id']
+    # Una entrada producida por una tarea posterior sería un ciclo
+    for t in lista:
+        for e in t['entradas'] + t['opcionales']:
+            if _normalizar(e) in productor and productor[_normalizar(e)] not in deps[t['id']]:
+                raise ValueError(f"{t['id']} lee {e}, que produce {productor[_normalizar(e)]} (después)")
+    return deps
+
+
+# ------------------------------------------------------------------------------
+# Huellas (contenido)
+# ------------------------------------------------------------------------------
+def _archivos(ruta):
+    """Archivos que forman una entrada/salida: una carpeta completa, un .shp con sus hermanos o el archivo."""
+    if os.path.isdir(ruta):
+        return sorted(os.path.join(raiz, a) for raiz, _, archivos in os.walk(ruta) for a in archivos)
+    if ruta.lower().endswith('.shp'):
+        base = os.path.splitext(ruta)[0]
+        return [base + ext for ext in ('.shp', '.shx', '.dbf', '.prj', '.cpg') if os.path.exists(base + ext)]
+    return [ruta] if os.path.exists(ruta) else []
+
+
+def _sha256_archivo(ruta, cache):
+    # Se vuelve a leer solo si cambió el tamaño o la fecha de modificación
+    info = os.stat(ruta)
+    clave = _normalizar(ruta)
+    previo = cache.get(clave)
+    if previo and previo['tamano'] == info.st_size and previo['mtime'] == info.st_mtime_ns:
+        return previo['sha256']
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloque)
+    cache[clave] = {'tamano': info.st_size, 'mtime': info.st_mtime_ns, 'sha256': h.hexdigest()}
+    return cache[clave]['sha256']
+
+
+def huella_ruta(ruta, cache):
+    """sha256 del contenido de una entrada/salida, o None si no existe."""
+    archivos = _archivos(ruta)
+    if not archivos:
+        return None
+    if archivos == [ruta]:
+        return _sha256_archivo(ruta, cache)
+    h = hashlib.sha256()
+    for archivo in archivos:
+        h.update(os.path.relpath(archivo, os.path.dirname(ruta)).replace(os.sep, '/').encode())
+        h.update(_sha256_archivo(archivo, cache).encode())
+    return h.hexdigest()
+
+
+def modulos_locales(script, vistos=None):
+    """El script y los módulos de py/ que importa (directa o indirectamente)."""
+    vistos = set() if vistos is None else vistos
+    if script not in vistos:
+        vistos.add(script)
+        with open(os.path.join(CARPETA_PY, script), encoding='utf-8') as f:
+            for nombre in re.findall(r'^\s*(?:import|from)\s+(\w+)', f.read(), flags=re.M):
+                if os.path.exists(os.path.join(CARPETA_PY, nombre + '.py')):
+                    modulos_locales(nombre + '.py', vistos)
+    return vistos
+
+
+def huella_tarea(tarea, cache):
+    h = hashlib.sha256(json.dumps([tarea['paso'], tarea['years']]).encode())
+    for modulo in sorted(modulos_locales(tarea['script'])):
+        h.update(modulo.encode())
+        h.update(_sha256_archivo(os.path.join(CARPETA_PY, modulo), cache).encode())
+    for ruta in tarea['entradas'] + tarea['opcionales']:
+        h.update(ruta.encode())
+        h.update(str(huella_ruta(ruta, cache)).encode())
+    return h.hexdigest()
+
+
+def al_dia(tarea, huella, estado, cache):
+    """True si la última corrida exitosa tuvo la misma huella y sus salidas no se tocaron."""
+    previo = estado['tareas'].get(tarea['id'])
+    return (previo is not None and previo['huella'] == huella
+            and all(huella_ruta(s, cache) == previo['salidas'].get(s) for s in tarea['salidas']))
+
+
+# ------------------------------------------------------------------------------
+# Estado (huellas de las tareas exitosas + caché de hashes)
+# ------------------------------------------------------------------------------
+def ruta_estado():
+    return os.path.join(CARPETA_ESTADO, 'estado.json')
+
+
+def cargar_estado():
+    if not os.path.exists(ruta_estado()):
+        return {'tareas': {}, 'archivos': {}}
+    with open(ruta_estado(), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def guardar_estado(estado):
+    # Escritura atómica: un corte a mitad no deja un estado corrupto
+    os.makedirs(CARPETA_ESTADO, exist_ok=True)
+    with open(ruta_estado() + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(estado, f, indent=1)
+    os.replace(ruta_estado() + '.tmp', ruta_estado())
+
+
+# ------------------------------------------------------------------------------
+# Ejecución
+# ------------------------------------------------------------------------------
+def ejecutar_tarea(tarea):
+    """Corre el script del paso en otro proceso (años por SIG_YEARS). Devuelve (código, inicio, segundos)."""
+    entorno = dict(os.environ, SIG_YEARS=','.join(str(y) for y in tarea['years']),
+                   SIG_INCREMENTAL='0', PYTHONIOENCODING='utf-8', MPLBACKEND='Agg')
+    carpeta_logs = os.path.join(CARPETA_ESTADO, 'logs')
+    os.makedirs(carpeta_logs, exist_ok=True)
+    inicio = time.time()
+    with open(os.path.join(carpeta_logs, f"{tarea['id']}.log"), 'w', encoding='utf-8') as log:
+        # Con SIG_PERFIL=py-spy el paso corre dentro de `py-spy record` (ver instrumentacion.py)
+        proceso = subprocess.run(instrumentacion.comando(tarea['script'], tarea['id']), cwd=CARPETA_PY,
+                                 env=entorno, stdout=log, stderr=subprocess.STDOUT)
+    return proceso.returncode, inicio, time.time() - inicio
+
+
+def verificar_salidas(tarea, inicio):
+    """Mensaje de error si falta o no se reescribió alguna salida (los scripts avisan con print y exit())."""
+    for ruta in tarea['salidas']:
+        archivos = _archivos(ruta)
+        if not archivos:
+            return f"no generó {ruta}"
+        if ruta not in tarea.get('acumulativas', ()) and max(os.path.getmtime(a) for a in archivos) < inicio - 2:
+            return f"no actualizó {ruta}"
+    return None
+
+
+def verificar_entradas(tarea, antes, cache):
+    """Mensaje de error si la tarea modificó alguna de sus entradas (solo debe leerlas)."""
+    for ruta, huella in antes.items():
+        if huella_ruta(ruta, cache) != huella:
+            return f"modificó su entrada {ruta}"
+    return None
+
+
+def ejecutar(lista, n_procesos=N_PROCESOS, forzar=FORZAR, solo_plan=SOLO_PLAN):
+    """Corre las tareas que no están al día, en paralelo según sus dependencias. Devuelve {id: resultado}."""
+    deps = dependencias(lista)
+    estado = cargar_estado()
+    cache = estado.setdefault('archivos', {})
+    pendientes = {t['id']: t for t in lista}
+    resultados = {}
+    segundos = {}
+    en_curso = {}
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, n_procesos)) as pool:
+            while pendientes or en_curso:
+                # 1. Decidir las tareas cuyas dependencias ya terminaron
+                for id_tarea, t in list(pendientes.items()):
+                    previas = [resultados.get(d) for d in deps[id_tarea]]
+                    if any(r is None for r in previas):
+                        continue
+                    del pendientes[id_tarea]
+                    if any(r not in _OK + ('se correría',) for r in previas):
+                        resultados[id_tarea] = 'bloqueada'
+                        continue
+                    if solo_plan and any(r == 'se correría' for r in previas):
+                        resultados[id_tarea] = 'se correría'  # Su huella depende de lo que salga arriba
+                        continue
+                    faltan = [e for e in t['entradas'] if huella_ruta(e, cache) is None]
+                    if faltan:
+                        resultados[id_tarea] = f"❌ falta {faltan[0]}"
+                        continue
+                    huella = huella_tarea(t, cache)
+                    if t['paso'] not in forzar and al_dia(t, huella, estado, cache):
+                        resultados[id_tarea] = 'al día'
+                    elif solo_plan:
+                        resultados[id_tarea] = 'se correría'
+                    else:
+                        print(f"▶️ {id_tarea}: {t['script']} (SIG_YEARS={','.join(str(y) for y in t['years'])})")
+                        antes = {e: huella_ruta(e, cache) for e in t['entradas']}
+                        en_curso[pool.submit(ejecutar_tarea, t)] = (t, huella, antes)
+
+                if not en_curso:
+                    continue
+
+                # 2. Esperar a que termine alguna
+                listos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    t, huella, antes = en_curso.pop(futuro)
+                    try:
+                        codigo, inicio, segundos[t['id']] = futuro.result()
+                        error = (f"código de salida {codigo}" if codigo
+                                 else verificar_salidas(t, inicio) or verificar_entradas(t, antes, cache))
+                    except Exception as e:
+                        error = str(e)
+                    if error:
+                        resultados[t['id']] = f"❌ {error}"
+                        print(f"❌ {t['id']}: {error} (ver logs/{t['id']}.log)")
+                        continue
+                    estado['tareas'][t['id']] = {
+                        'huella': huella,
+                        'salidas': {s: huella_ruta(s, cache) for s in t['salidas']},
+                        'fecha': datetime.now().isoformat(timespec='seconds'),
+                        'segundos': round(segundos[t['id']], 1),
+                    }
+                    guardar_estado(estado)  # Lo ya hecho queda guardado aunque una tarea posterior falle
+                    resultados[t['id']] = 'ejecutada'
+                    print(f"✅ {t['id']} ({segundos[t['id']]:.1f} s)")
+    finally:
+        if not solo_plan:
+            guardar_estado(estado)
+
+    print("\n" + "=" * 50)
+    print("RESUMEN DE TAREAS")
+    print("-" * 50)
+    for t in lista:
+        tiempo = f"{segundos[t['id']]:>8.1f} s" if t['id'] in segundos else ' ' * 10
+        print(f"{t['id']:<12} {tiempo}  {resultados[t['id']]}")
+    print("=" * 50)
+    return resultados
+
+
+if __name__ == "__main__":
+    lista = tareas(YEARS, ANIOS_MODELO, PASOS)
+    print(f"🧩 {len(lista)} tareas (pasos {', '.join(str(p) for p in PASOS)}) | estado: {ruta_estado()}")
+    resultados = ejecutar(lista)
+    if any(r not in _OK + ('se correría',) for r in resultados.values()):
+        exit(1)
@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from rasterio.warp import Resampling
+from rasterio.windows import Window
+import cache_alineado
+
+# ==============================================================================
+# PIRÁMIDE DE COBERTURA DE LA MÁSCARA (10m -> 20m, 30m, 100m...)
+# ==============================================================================
+# 2_crear_mascara_para_areas_quemadas.py genera la máscara de exclusión a 10m,
+# pero 8_generar_mapa.py la usa en la grilla de 20m del stack (y GEE a otras
+# escalas), remuestreándola con nearest cada vez. Aquí se escriben, junto a la
+# máscara, rasters hermanos a resoluciones más gruesas donde cada celda guarda
+# la FRACCIÓN de su área cubierta por agua/construcción (0 a 1), calculada
+# exactamente sumando los píxeles de 10m que contiene (no nearest).
+# Así el consumidor toma el nivel de su resolución y aplica un umbral.
+#
+#   Mascara_Agua_Construcciones_2020.tif                 uint8, 1 = Agua/Construcción
+#   Mascara_Agua_Construcciones_2020_cobertura_20m.tif   float32, fracción cubierta
+
+# ================= CONFIGURACIÓN =================
+RESOLUCIONES = (20, 30, 100)  # Metros; múltiplos enteros de la resolución de la máscara
+FILAS_POR_FRANJA = 2048       # Filas de la máscara fina leídas a la vez (memoria acotada)
+
+# Umbral de cobertura que aplican 8_generar_mapa.py y cubo_caracteristicas.py.
+# Si 2_crear_mascara_para_areas_quemadas.py generó el nivel de cobertura a la
+# resolución del stack, se excluyen las celdas con fracción cubierta >= umbral
+# (ej: 0.5). None = máscara de 10m remuestreada con nearest (comportamiento antiguo).
+UMBRAL_COBERTURA = None
+# =================================================
+
+
+def ruta_nivel(ruta_mascara, resolucion):
+    """Ruta del raster de cobertura de un nivel, junto a la máscara original."""
+    base, extension = os.path.splitext(ruta_mascara)
+    return f"{base}_cobertura_{resolucion:g}m{extension}"
+
+
+def escribir_niveles(ruta_mascara, resoluciones=RESOLUCIONES):
+    """Escribe un GeoTIFF de fracción de cobertura por cada resolución. Devuelve sus rutas."""
+    rutas = []
+    with rasterio.open(ruta_mascara) as src:
+        res_fina = abs(src.transform.a)
+        for resolucion in resoluciones:
+            factor = resolucion / res_fina
+            if factor < 1 or abs(factor - round(factor)) > 1e-6:
+                raise ValueError(f"La resolución {resolucion} m no es un múltiplo entero de "
+                                 f"la máscara ({res_fina:g} m).")
+            factor = int(round(factor))
+
+            alto, ancho = -(-src.height // factor), -(-src.width // factor)
+            perfil = {
+                'driver': 'GTiff',
+                'height': alto,
+                'width': ancho,
+                'count': 1,
+                'dtype': 'float32',
+                'crs': src.crs,
+                'transform': src.transform * Affine.scale(factor),
+                'nodata': None,  # 0 = nada cubierto (fuera del área de estudio también)
+                'compress': 'lzw',
+                'tiled': True,
+                'blockxsize': 256,
+                'blockysize': 256,
+            }
+
+            ruta = ruta_nivel(ruta_mascara, resolucion)
+            filas_nivel = max(1, FILAS_POR_FRANJA // factor)
+            with rasterio.open(ruta, 'w', **perfil) as dst:
+                for fila in range(0, alto, filas_nivel):
+                    n = min(filas_nivel, alto - fila)
+                    # Franja de la máscara fina, rellenada con 0 hasta completar celdas enteras
+                    fina = np.zeros((n * factor, ancho * factor), dtype=np.uint8)
+                    leidas = min(n * factor, src.height - fila * factor)
+                    fina[:leidas, :src.width] = src.read(
+                        1, window=Window(0, fila * factor, src.width, leidas)) == 1
+
+                    cubiertos = fina.reshape(n, factor, ancho, factor).sum(axis=(1, 3), dtype=np.int32)
+                    dst.write((cubiertos / float(factor * factor)).astype(np.float32), 1,
+                              window=Window(0, fila, ancho, n))
+            rutas.append(ruta)
+    return rutas
+
+
+def cobertura_alineada(ruta_mascara, dst_transform, dst_shape, dst_crs):
+    """Ruta .npy (caché de alineados) de la cobertura en la grilla destino, o None.
+
+    Usa el nivel de la pirámide con la misma resolución que la grilla destino
+    (nearest a igual resolución: no se vuelve a tocar la máscara de 10m). Si ese
+    nivel no existe o es más antiguo que la máscara, devuelve None.
+    """
+    ruta = ruta_nivel(ruta_mascara, abs(dst_transform.a))
+    if not os.path.exists(ruta) or os.path.getmtime(ruta) < os.path.getmtime(ruta_mascara):
+        return None
+    return cache_alineado.obtener_alineado(
+        ruta, dst_transform, dst_shape, dst_crs,
+        resampling=Resampling.nearest, dtype=np.float32
+    )
+
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+import joblib
+from xgboost import XGBClassifier
+import modelo_compilado
+
+# ==============================================================================
+# REGISTRO DE MODELOS (UBJSON de XGBoost + manifiesto)
+# ==============================================================================
+# 7_generar_modelo.py sobrescribía un único .pkl en cada corrida y
+# 8_generar_mapa.py confiaba en que `nombres_bandas` coincidiera con el orden de
+# columnas del entrenamiento. Aquí cada modelo entrenado queda en su propia
+# versión, con el formato nativo de XGBoost (no pickle: carga más rápido y no
+# depende de las versiones de sklearn/joblib) y un manifiesto que dice con qué
+# se entrenó:
+#
+#   registro/v003/modelo.ubj        booster de XGBoost (UBJSON)
+#   registro/v003/compilado.npz     arreglos de nodos (ver modelo_compilado.py)
+#   registro/v003/manifiesto.json   variables (en orden), años, AUC, huella de los datos...
+#
+# Si el modelo (sha256 de su UBJSON) y los datos son los mismos que los de la
+# versión más nueva, 7_generar_modelo.py no registra una versión repetida.
+#
+# 8_generar_mapa.py elige la versión por año (o una fija) y compara el orden de
+# bandas del stack con `variables` del manifiesto antes de leer un solo píxel.
+#
+# Uso directo (lista las versiones y compara la carga con el .pkl):
+#   python registro_modelos.py
+
+# ================= CONFIGURACIÓN =================
+CARPETA_REGISTRO = r'D:\SIG\modelos\registro'
+
+ruta_modelo_pkl = r'D:\SIG\modelos\Modelo_Incendios_XGBoost_Entrenado.pkl'
+# =================================================
+
+
+def ruta_version(version):
+    return os.path.join(CARPETA_REGISTRO, version)
+
+
+def versiones():
+    """Manifiestos de todas las versiones, de la más antigua a la más nueva."""
+    if not os.path.isdir(CARPETA_REGISTRO):
+        return []
+    manifiestos = []
+    for version in sorted(os.listdir(CARPETA_REGISTRO)):
+        if version.endswith('.tmp'):
+            continue  # Registro interrumpido
+        ruta = os.path.join(ruta_version(version), 'manifiesto.json')
+        if os.path.exists(ruta):
+            with open(ruta, encoding='utf-8') as f:
+                manifiestos.append(json.load(f))
+    return manifiestos
+
+
+def _siguiente_version():
+    numeros = [int(m['version'][1:]) for m in versiones()]
+    return f"v{max(numeros, default=0) + 1:03d}"
+
+
+def huella_modelo(modelo):
+    """sha256 del booster en UBJSON (XGBClassifier o Booster)."""
+    booster = modelo.get_booster() if hasattr(modelo, 'get_booster') else modelo
+    return hashlib.sha256(booster.save_raw(raw_format='ubj')).hexdigest()
+
+
+def version_igual(modelo, huella_datos):
+    """Manifiesto de la versión más nueva si tiene este mismo modelo y datos; si no, None."""
+    manifiestos = versiones()
+    if not manifiestos:
+        return None
+    ultima = manifiestos[-1]
+    if ultima.get('huella_modelo') == huella_modelo(modelo) and ultima.get('huella_datos') == huella_datos:
+        return ultima
+    return None
+
+
+def registrar(modelo, variables, years, auc=None, huella_datos=None, compilado=None, extra=None):
+    """Guarda un XGBClassifier como nueva versión del registro. Devuelve el manifiesto."""
+    version = _siguiente_version()
+    # Se escribe en una carpeta temporal y se renombra al final: una versión a medias nunca aparece
+    temporal = ruta_version(version) + '.tmp'
+    if os.path.exists(temporal):
+        shutil.rmtree(temporal)
+    os.makedirs(temporal)
+
+    booster = modelo.get_booster()
+    if booster.feature_names is not None and list(booster.feature_names) != list(variables):
+        raise ValueError(f"El modelo tiene las variables {booster.feature_names}, "
+                         f"pero se registran como {list(variables)}")
+    modelo.save_model(os.path.join(temporal, 'modelo.ubj'))
+    if compilado is not None:
+        modelo_compilado.guardar(compilado, os.path.join(temporal, 'compilado.npz'))
+
+    manifiesto = {
+        'version': version,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'variables': list(variables),
+        'years': sorted(int(y) for y in set(years)),
+        'auc': None if auc is None else float(auc),
+        'huella_datos': huella_datos,
+        'huella_modelo': huella_modelo(booster),
+        'n_arboles': booster.num_boosted_rounds(),
+        'con_compilado': compilado is not None,
+        **(extra or {}),
+    }
+    with open(os.path.join(temporal, 'manifiesto.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=2)
+
+    os.replace(temporal, ruta_version(version))
+    return manifiesto
+
+
+def seleccionar(year=None, version=None):
+    """Manifiesto a usar para predecir `year`, o None si el registro está vacío.
+
+    Con `version` se usa esa (ValueError si no existe). Si no, la más nueva
+    entrenada con ese año; si ninguna lo incluye (ej: mapa de un año futuro),
+    la más nueva del registro.
+    """
+    manifiestos = versiones()
+    if version is not None:
+        for m in manifiestos:
+            if m['version'] == version:
+                return m
+        raise ValueError(f"No existe la versión {version} en {CARPETA_REGISTRO}")
+    if not manifiestos:
+        return None
+    con_anio = [m for m in manifiestos if year in m['years']]
+    return (con_anio or manifiestos)[-1]
+
+
+def ruta_modelo(manifiesto):
+    return os.path.join(ruta_version(manifiesto['version']), 'modelo.ubj')
+
+
+def cargar(manifiesto):
+    """XGBClassifier de una versión (desde UBJSON, sin unpickling)."""
+    modelo = XGBClassifier()
+    modelo.load_model(ruta_modelo(manifiesto))
+    return modelo
+
+
+def ruta_compilado(manifiesto):
+    """Ruta del modelo compilado de la versión, o None si no se registró."""
+    ruta = os.path.join(ruta_version(manifiesto['version']), 'compilado.npz')
+    return ruta if os.path.exists(ruta) else None
+
+
+def nombres_stack(descripciones, year):
+    """Nombres de las bandas del stack según su GeoTIFF, sin el sufijo del año (dist_vias_2020 -> dist_vias).
+
+    None si el GeoTIFF no trae descripción en todas las bandas.
+    """
+    if not descripciones or any(d is None or d == '' for d in descripciones):
+        return None
+    sufijo = f'_{year}'
+    return [d[:-len(sufijo)] if d.endswith(sufijo) else d for d in descripciones]
+
+
+def validar_orden(manifiesto, nombres):
+    """ValueError si el orden de bandas `nombres` no es el de las variables del manifiesto."""
+    if list(nombres) != manifiesto['variables']:
+        raise ValueError(f"El modelo {manifiesto['version']} espera las variables {manifiesto['variables']}, "
+                         f"pero el stack tiene {list(nombres)}")
+
+
+if __name__ == "__main__":
+    manifiestos = versiones()
+    print(f"📚 Registro de modelos: {CARPETA_REGISTRO} ({len(manifiestos)} versiones)")
+    for m in manifiestos:
+        auc = f"{m['auc']:.4f}" if m['auc'] is not None else '-'
+        print(f"   {m['version']}  {m['fecha']}  años {m['years']}  AUC {auc}  "
+              f"{m['n_arboles']} árboles  datos {str(m['huella_datos'])[:12]}")
+
+    if manifiestos and os.path.exists(ruta_modelo_pkl):
+        t0 = time.perf_counter()
+        cargar(manifiestos[-1])
+        t_ubj = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        joblib.load(ruta_modelo_pkl)
+        t_pkl = time.perf_counter() - t0
+        print(f"⏱️ Carga {manifiestos[-1]['version']} (UBJSON): {t_ubj * 1000:.1f} ms | .pkl: {t_pkl * 1000:.1f} ms")